@@ -1,6 +1,14 @@
 import os
+import sys
 import logging
 
+from utils.startup_profile import STARTUP_PROFILE
+
+# Reports where startup time goes and exits once the server accepts connections
+PROFILE_STARTUP = '--profile-startup' in sys.argv
+if PROFILE_STARTUP:
+    STARTUP_PROFILE.install()
+
 DEFAULT_LOG_LEVEL = 'INFO'
 
 log_level = os.environ.get('LOG_LEVEL', DEFAULT_LOG_LEVEL).upper()
@@ -15,37 +23,86 @@ logging.basicConfig(
 )
 
 import os
+import sys
 import uuid
+import socket
 import asyncio
 import uvicorn
 import socketio
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from utils.config import CONFIG
+from utils.config import CONFIG, ConfigWatcher
 from utils.states import state
 from utils.event_handler import EventHandler
+from utils.sync import StateSync
+from utils.journal import Journal
+from utils.backend import Hub, InProcessBackend, LocalSocketBackend, ReplicaSync
+from utils.metrics import METRICS
+from utils import wire
+from utils.sockets import SocketServers
+from utils.static_assets import StaticAssets
 from objects.event import Event
 from objects.client import Client
 from objects.clients import Clients
-from onvif_.monitor_events import ONVIFMonitor
+from objects.subscription import Subscription
+from onvif_.monitor import ONVIFMonitor
 
 log = logging.getLogger('main')
 
 HOST = os.environ.get('HOST', '0.0.0.0')
 PORT = int(os.environ.get('PORT', '28080'))
 
-sio = socketio.AsyncServer(
-    async_mode='asgi',
-    cors_allowed_origins='*')
+HEARTBEAT_INTERVAL = .1
+WORKER_RESPAWN_DELAY = 1
+
+# Spawned by the cluster supervisor
+IS_WORKER = '--worker' in sys.argv
+
+# Browsers speak JSON, native clients may ask for msgpack per connection
+socket_servers = {
+    'json': socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', json=wire)
+}
+msgpack_packet = wire.msgpack_packet_class()
+if msgpack_packet is not None:
+    socket_servers['msgpack'] = socketio.AsyncServer(async_mode='asgi',
+                                                     cors_allowed_origins='*',
+                                                     serializer=msgpack_packet)
+sio = SocketServers(socket_servers,
+                    CONFIG.outbound_max_queue,
+                    CONFIG.outbound_disconnect_queue,
+                    CONFIG.outbound_policy)
 
 app = FastAPI(redirect_slashes=False)
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=['*'])
 
-clients = Clients()
-event_handler = EventHandler(sio, clients)
+backend = LocalSocketBackend(CONFIG.cluster_socket_path) if IS_WORKER else InProcessBackend()
+journal = Journal(CONFIG.journal_path, CONFIG.journal_compact_interval) if CONFIG.journal_enabled else None
+# The journal is handed to `clients` once this worker leads the cluster
+clients = Clients(CONFIG.client_removal_threshold,
+                  CONFIG.event_removal_threshold,
+                  CONFIG.liveness_tick,
+                  backend=backend)
+event_handler = EventHandler(sio, clients, backend)
+state_sync = StateSync(sio, clients)
 onvif_monitor = ONVIFMonitor(event_handler)
+config_watcher = ConfigWatcher(CONFIG)
+
+async def apply_limits(changed: set):
+    clients.set_thresholds(CONFIG.client_removal_threshold, CONFIG.event_removal_threshold)
+    sio.set_outbound_limits(CONFIG.outbound_max_queue, CONFIG.outbound_disconnect_queue, CONFIG.outbound_policy)
+
+# Changed settings are applied in place, connected clients stay connected
+config_watcher.add_listener(apply_limits)
+config_watcher.add_listener(event_handler.reconfigure)
+config_watcher.add_listener(onvif_monitor.reconfigure)
+
+METRICS.add_collector(config_watcher.collect_metrics)
+METRICS.add_collector(sio.collect_metrics)
+METRICS.add_collector(clients.collect_metrics)
+METRICS.add_collector(event_handler.collect_metrics)
+METRICS.add_collector(onvif_monitor.collect_metrics)
 
 
 @app.get('/api/v1/go2rtc-config')
@@ -60,17 +117,67 @@ async def get_go2rtc_config():
 async def get_health():
     return 'I\'m healthy!'
 
-app.mount('/socket.io', socketio.ASGIApp(sio))
-app.mount('/', StaticFiles(directory='static', html=True), name='static')
+@app.get('/api/v1/metrics')
+async def get_metrics():
+    return PlainTextResponse(METRICS.render(), media_type='text/plain; version=0.0.4')
+
+app.mount('/socket.io', sio.asgi_app())
+static_assets = StaticAssets('static')
+app.mount('/', static_assets, name='static')
+
+async def apply_op(message: dict):
+    """Applies one cluster op to this worker and pushes the resulting deltas."""
+    op = message['op']
+    if op == 'broadcast':
+        await event_handler.apply(message)
+    elif op == 'armed':
+        if state.is_armed() != message['armed']:
+            state.set_armed(message['armed'])
+            if clients.journal is not None:
+                clients.journal.record_armed(message['armed'])
+            await state_sync.push_armed()
+    elif op == 'client_remove':
+        is_known = await clients.get_client(message['sid']) is not None
+        await clients.apply(message)
+        if is_known:
+            await state_sync.push_client_removed(message['sid'])
+    elif op == 'worker_gone':
+        sids = clients.worker_client_sids(message['worker'])
+        await clients.apply(message)
+        for sid in sids:
+            await state_sync.push_client_removed(sid)
+    else:
+        await clients.apply(message)
+        if op == 'client_update':
+            client: Client = await clients.get_client(message['sid'])
+            if client is not None:
+                await state_sync.push_client_updated(client)
+
+replica_sync = ReplicaSync(backend, clients, apply_op)
+backend.set_handler(replica_sync.handle)
+
+async def join_subscription_rooms(sid: str, subscription: Subscription):
+    for room in sio.rooms(sid):
+        if room != sid:
+            await sio.leave_room(sid, room)
+    for room in subscription.rooms():
+        await sio.enter_room(sid, room)
 
 @sio.on('connect')
 async def handle_connect(sid, environ):
     await clients.add_client(sid)
+    # Everything until the client narrows it down in `introduce`
+    await join_subscription_rooms(sid, Subscription())
     log.info(f'Client \'{sid}\' connected.')
 
 @sio.on('disconnect')
 async def handle_disconnect(sid, reason):
     client: Client = await clients.get_client(sid)
+    if client is None:
+        # Already removed by the client cleaner
+        log.info(f'Client \'{sid}\' disconnected, reason: {str(reason)}')
+        return
+
     log.info(f'Client \'{sid}\' ({client.name}, {client.type}) disconnected, reason: {str(reason)}')
     event = Event(
         event_id=uuid.uuid4(),
@@ -88,9 +195,15 @@ async def handle_introduce(sid, data = {}):
     client_name = data.get('name', None)
     client_type = data.get('type', None)
     last_event_id = data.get('lastEventID', None)
+    subscription = Subscription.from_dict(data.get('subscribe', None))
 
-    await clients.update_client(sid, client_name, client_type, last_event_id)
+    await join_subscription_rooms(sid, subscription)
+    await clients.update_client(sid, client_name, client_type, last_event_id, subscription)
     client: Client = await clients.get_client(sid)
+    if client is None:
+        return
+
+    await state_sync.send_snapshot(sid)
     event = Event(
         event_id=uuid.uuid4(),
         event_event='connected',
@@ -133,17 +246,14 @@ async def handle_event(sid, data = {}):
 @sio.on('set_armed')
 async def handle_set_armed(sid, data = {}):
     log.info(f'Recieved set_armed from client \'{sid}\' with data \'{data}\'.')
-    state.set_armed(data.get('armed', False))
+    is_armed = bool(data.get('armed', False))
+    if state.is_armed() != is_armed:
+        await backend.publish({'op': 'armed', 'armed': is_armed})
 
 @sio.on('get')
 async def handle_get(sid, data = {}):
     log.debug(f'Recieved get from client \'{sid}\' with data \'{data}\'.')
-    payload = {
-        'isArmed': state.is_armed(),
-        'clientList': await clients.get_client_list(True),
-        'eventList': await clients.get_event_list(sid, True)
-    }
-    await sio.emit('get_result', payload)
+    await state_sync.send_snapshot(sid)
 
 @sio.on('ack')
 async def handle_ack(sid, data = {}):
@@ -160,8 +270,8 @@ async def handle_pong(sid, data = {}):
 async def ping_worker():
     while state.is_server_up():
         try:
-            await sio.emit('ping')
-            await asyncio.sleep(.1)
+            await state_sync.heartbeat()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
         except asyncio.CancelledError:
             log.info('Ping worker was cancelled.')
             break
@@ -173,34 +283,131 @@ async def client_worker():
         try:
             deleted_client_sids = await clients.clean_client()
             for sid in deleted_client_sids:
+                await clients.remove_client(sid)
                 await sio.disconnect(sid)
-            await asyncio.sleep(.1)
+            await asyncio.sleep(CONFIG.liveness_tick)
         except asyncio.CancelledError:
             log.info('Client cleaner worker was cancelled.')
             break
         except Exception:
             pass
 
+async def outbound_worker():
+    while state.is_server_up():
+        try:
+            await sio.wait_outbound()
+            for sid in await sio.check_outbound():
+                await state_sync.send_snapshot(sid)
+        except asyncio.CancelledError:
+            log.info('Outbound worker was cancelled.')
+            break
+        except Exception:
+            pass
+
 async def event_worker():
     while state.is_server_up():
         try:
             await clients.clean_event()
-            await asyncio.sleep(.1)
+            await asyncio.sleep(CONFIG.liveness_tick)
         except asyncio.CancelledError:
             log.info('Event cleaner worker was cancelled.')
             break
         except Exception:
             pass
 
+async def journal_worker():
+    while state.is_server_up():
+        try:
+            await journal.flush()
+            if journal.needs_compaction():
+                events, acked_event_ids = clients.journal_snapshot()
+                await journal.compact(state.is_armed(), events, acked_event_ids)
+            await asyncio.sleep(CONFIG.journal_fsync_interval)
+        except asyncio.CancelledError:
+            log.info('Journal worker was cancelled.')
+            break
+        except Exception as e:
+            log.error(f'Failed to write journal: {e}')
+            await asyncio.sleep(CONFIG.journal_fsync_interval)
+
+async def leader_worker():
+    """Runs the once-per-cluster duties while this worker is the leader."""
+    await backend.wait_for_leadership()
+    tasks = []
+    try:
+        if journal is not None:
+            if clients.journal is None:
+                # Promoted follower, rewrite the journal from this replica
+                clients.set_journal(journal)
+                events, acked_event_ids = clients.journal_snapshot()
+                await journal.compact(state.is_armed(), events, acked_event_ids)
+            tasks.append(asyncio.create_task(journal_worker()))
+        # Runs even without cameras, they may be added to the config later
+        tasks.append(asyncio.create_task(onvif_monitor.onvif_event_monitoring_worker()))
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        log.info('Leader worker was cancelled.')
+    finally:
+        for task in tasks:
+            task.cancel()
+        if clients.journal is not None:
+            await clients.journal.flush()
+
+async def recover_journal():
+    is_armed, events, acked_event_ids = journal.recover(CONFIG.event_removal_threshold)
+    if is_armed is not None:
+        await backend.publish({'op': 'armed', 'armed': is_armed})
+    await clients.restore_events(events, acked_event_ids)
+    clients.set_journal(journal)
+    log.info(f'Recovered {len(events)} events from journal (armed: {state.is_armed()}).')
+
+def create_listen_socket() -> socket.socket:
+    # Every worker binds the same port, the kernel spreads connections
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((HOST, PORT))
+    return sock
+
+async def report_startup(uvicorn_server: uvicorn.Server):
+    while not uvicorn_server.started:
+        await asyncio.sleep(.001)
+    STARTUP_PROFILE.mark('uvicorn startup')
+    STARTUP_PROFILE.uninstall()
+    print(STARTUP_PROFILE.report(), flush=True)
+    uvicorn_server.should_exit = True
+
+async def exit_on_backend_loss(uvicorn_server: uvicorn.Server):
+    await backend.wait_lost()
+    # Replication is gone for good, the supervisor starts a fresh worker
+    log.critical('Cut off from the cluster, stopping this worker.')
+    uvicorn_server.should_exit = True
+
 async def main():
+    STARTUP_PROFILE.mark('imports and module setup')
+    # Assets are served uncompressed until their variants are ready
+    task_compress_static = asyncio.create_task(static_assets.compress())
+    await backend.start()
+    if backend.is_leader():
+        if journal is not None:
+            await recover_journal()
+    else:
+        await replica_sync.request()
+    STARTUP_PROFILE.mark('cluster backend and journal recovery')
+
     while True:
+        task_leader_worker = None
+        task_backend_watch = None
         try:
             log.info(f'Starting background workers...')
+            state.set_server_up(True)
+            await event_handler.start()
             task_ping_worker = asyncio.create_task(ping_worker())
             task_client_worker = asyncio.create_task(client_worker())
             task_event_worker = asyncio.create_task(event_worker())
-            if CONFIG.onvif_enabled:
-                asyncio.create_task(onvif_monitor.onvif_event_monitoring_worker())
+            task_outbound_worker = asyncio.create_task(outbound_worker())
+            task_config_watcher = asyncio.create_task(config_watcher.run())
+            task_leader_worker = asyncio.create_task(leader_worker())
 
             uvicorn_config = uvicorn.Config(app,
                                             host=HOST,
@@ -211,9 +418,21 @@ async def main():
                                             proxy_headers=True,
                                             forwarded_allow_ips=['*'])
             uvicorn_server = uvicorn.Server(uvicorn_config)
-            await uvicorn_server.serve()
-        except [KeyboardInterrupt, asyncio.exceptions.CancelledError]:
-            pass
+            task_backend_watch = asyncio.create_task(exit_on_backend_loss(uvicorn_server))
+            STARTUP_PROFILE.mark('background workers')
+            if PROFILE_STARTUP:
+                task_report_startup = asyncio.create_task(report_startup(uvicorn_server))
+            if IS_WORKER:
+                await uvicorn_server.serve(sockets=[create_listen_socket()])
+            else:
+                await uvicorn_server.serve()
+            if PROFILE_STARTUP:
+                await task_report_startup
+                break
+            if backend.lost:
+                break
+        except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+            break
         except Exception as e:
             log.error(f'Unexpected error occured: {e}')
         finally:
@@ -222,7 +441,52 @@ async def main():
             task_ping_worker.cancel()
             task_client_worker.cancel()
             task_event_worker.cancel()
+            task_outbound_worker.cancel()
+            task_config_watcher.cancel()
+            if task_backend_watch is not None:
+                task_backend_watch.cancel()
+            if task_leader_worker is not None:
+                task_leader_worker.cancel()
+                await asyncio.gather(task_leader_worker, return_exceptions=True)
+            await event_handler.stop()
             await asyncio.sleep(1)
 
+    task_compress_static.cancel()
+    await backend.stop()
+    if backend.lost:
+        sys.exit(1)
+
+async def run_worker_process(index: int):
+    process = None
+    try:
+        while True:
+            process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), '--worker')
+            log.info(f'Started worker #{index} (pid {process.pid}).')
+            return_code = await process.wait()
+            log.warning(f'Worker #{index} exited with code {return_code}, restarting...')
+            await asyncio.sleep(WORKER_RESPAWN_DELAY)
+    finally:
+        if process is not None and process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+async def supervise():
+    """Runs the cluster hub and keeps `cluster.workers` worker processes alive."""
+    hub = Hub(CONFIG.cluster_socket_path)
+    await hub.start()
+    tasks = [asyncio.create_task(run_worker_process(index)) for index in range(CONFIG.cluster_workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await hub.stop()
+
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    if CONFIG.cluster_workers > 1 and not IS_WORKER and not PROFILE_STARTUP:
+        asyncio.run(supervise())
+    else:
+        asyncio.run(main())
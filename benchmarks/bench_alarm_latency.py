@@ -0,0 +1,251 @@
+"""
+Camera-to-client alarm latency and reconnect behaviour under failures.
+
+Starts `--cameras` stand-in cameras (`benchmarks.fake_camera`) and the
+server in a subprocess that monitors them, connects an armed socket.io
+client, and then plays the phases below. Each camera raises motion at
+random intervals throughout. Every phase reports:
+- how many motion edges the cameras raised while subscribed
+- how many reached the client, and the camera-to-client latency
+- how many new subscriptions the server had to create
+- for reboots, how long after the camera came back its subscription was
+  live again
+
+Edges raised while a camera had no subscription at all are reported
+separately. They can't reach anyone.
+
+    python -m benchmarks.bench_alarm_latency [--cameras N] [--phase-seconds S] [--script FILE]
+
+`--script` replaces the built-in phases with one phase that replays the
+given fake camera script on every camera.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Optional
+
+import aiohttp
+import socketio
+
+from benchmarks.fake_camera import FakeCamera
+
+# name, fake camera script played by every camera at the start of the phase
+PHASES = (
+    ('steady', []),
+    ('latency 200 ms + jitter 100 ms', [{'at': 0, 'latency': .2, 'jitter': .1}]),
+    ('30% PullMessages faults', [{'at': 0, 'fault': {'action': 'PullMessages', 'kind': 'fault', 'count': None, 'probability': .3}}]),
+    ('10% HTTP 503', [{'at': 0, 'fault': {'kind': 'http_error', 'count': None, 'probability': .1}}]),
+    ('10% connection resets', [{'at': 0, 'fault': {'kind': 'reset', 'count': None, 'probability': .1}}]),
+    ('pull hangs 3 s once', [{'at': 0, 'fault': {'action': 'PullMessages', 'kind': 'timeout', 'duration': 3}}]),
+    ('reboot, down 2 s', [{'at': 1, 'reboot': 2}]),
+)
+EDGE_DURATION = .05
+SETTLE_TIME = 2
+SERVER_START_TIMEOUT = 30
+
+
+class Edge:
+    def __init__(self, camera_id: str, raised_at: float) -> None:
+        self.camera_id = camera_id
+        self.raised_at = raised_at
+        self.received_at: Optional[float] = None
+
+
+class AlarmClient:
+    """An armed socket.io client recording when each camera's events arrive."""
+    def __init__(self) -> None:
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.received: Dict[str, List[float]] = {}
+        self.sio.on('ping', self._handle_ping)
+        self.sio.on('event', self._handle_event)
+        self.sio.on('event_ignored', self._handle_event)
+
+    async def connect(self, url: str) -> None:
+        await self.sio.connect(url, transports=['websocket'])
+        await self.sio.emit('introduce', {'name': 'bench', 'type': 'bench'})
+        await self.sio.emit('set_armed', {'armed': True})
+
+    async def _handle_ping(self, data=None) -> None:
+        await self.sio.emit('pong')
+
+    async def _handle_event(self, payload: dict) -> None:
+        received_at = time.monotonic()
+        data = payload.get('event', {}).get('data') or {}
+        camera_id = data.get('camera')
+        if camera_id is not None:
+            self.received.setdefault(camera_id, []).append(received_at)
+
+
+async def raise_motion(camera_id: str, fake_camera: FakeCamera, edges: List[Edge], unsubscribed: List[Edge], until: float) -> None:
+    while time.monotonic() < until:
+        await asyncio.sleep(random.uniform(.3, .7))
+        edge = Edge(camera_id, time.monotonic())
+        (edges if fake_camera.subscriptions else unsubscribed).append(edge)
+        fake_camera.trigger(True)
+        await asyncio.sleep(EDGE_DURATION)
+        fake_camera.trigger(False)
+
+
+def match(edges: List[Edge], client: AlarmClient, matched: Dict[str, int]) -> None:
+    """Events of one camera arrive in order, pairs them with its edges first come first served."""
+    by_camera: Dict[str, List[Edge]] = {}
+    for edge in edges:
+        by_camera.setdefault(edge.camera_id, []).append(edge)
+    for camera_id, camera_edges in by_camera.items():
+        received = client.received.get(camera_id, [])
+        for edge in camera_edges:
+            while matched.get(camera_id, 0) < len(received):
+                received_at = received[matched.get(camera_id, 0)]
+                matched[camera_id] = matched.get(camera_id, 0) + 1
+                if received_at >= edge.raised_at:
+                    edge.received_at = received_at
+                    break
+            if edge.received_at is None:
+                break
+
+
+async def run_phase(name: str,
+                    script: List[dict],
+                    fake_cameras: Dict[str, FakeCamera],
+                    client: AlarmClient,
+                    matched: Dict[str, int],
+                    seconds: float) -> None:
+    subscriptions_before = {camera_id: len(fake_camera.subscribed_at) for camera_id, fake_camera in fake_cameras.items()}
+    start = time.monotonic()
+    edges: List[Edge] = []
+    unsubscribed: List[Edge] = []
+    await asyncio.gather(
+        *(fake_camera.run_script(script) for fake_camera in fake_cameras.values()),
+        *(raise_motion(camera_id, fake_camera, edges, unsubscribed, start + seconds)
+          for camera_id, fake_camera in fake_cameras.items())
+    )
+    for fake_camera in fake_cameras.values():
+        fake_camera.clear_faults()
+        fake_camera.latency = 0
+        fake_camera.jitter = 0
+    await asyncio.sleep(SETTLE_TIME)
+
+    edges.sort(key=lambda edge: edge.raised_at)
+    match(edges, client, matched)
+    latencies = [(edge.received_at - edge.raised_at) * 1000 for edge in edges if edge.received_at is not None]
+    reconnects = sum(len(fake_camera.subscribed_at) - subscriptions_before[camera_id]
+                     for camera_id, fake_camera in fake_cameras.items())
+    recoveries = []
+    for step in script:
+        if 'reboot' in step:
+            back_at = start + step.get('at', 0) + step['reboot']
+            for fake_camera in fake_cameras.values():
+                resubscribed = [subscribed for subscribed in fake_camera.subscribed_at if subscribed >= back_at]
+                if resubscribed:
+                    recoveries.append((resubscribed[0] - back_at) * 1000)
+
+    line = f'{name:<32} edges {len(edges):4}  delivered {len(latencies):4}'
+    if latencies:
+        line += (f'  latency p50 {statistics.median(latencies):7.1f} ms'
+                 f'  p95 {sorted(latencies)[int(len(latencies) * .95)]:7.1f} ms  max {max(latencies):7.1f} ms')
+    line += f'  new subscriptions {reconnects}'
+    if unsubscribed:
+        line += f'  unsubscribed edges {len(unsubscribed)}'
+    if recoveries:
+        line += f'  resubscribed after p50 {statistics.median(recoveries):6.1f} ms max {max(recoveries):6.1f} ms'
+    print(line, flush=True)
+
+
+async def wait_for_server(url: str) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f'{url}/api/v1/health') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError('Server did not start')
+            await asyncio.sleep(.1)
+
+
+async def wait_for_subscriptions(fake_cameras: Dict[str, FakeCamera]) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while not all(fake_camera.subscriptions for fake_camera in fake_cameras.values()):
+        if time.monotonic() > deadline:
+            raise TimeoutError('Cameras were not subscribed')
+        await asyncio.sleep(.05)
+
+
+async def run(args: argparse.Namespace) -> None:
+    fake_cameras = {f'cam{index}': FakeCamera() for index in range(args.cameras)}
+    for fake_camera in fake_cameras.values():
+        await fake_camera.start()
+
+    command = [sys.executable, '-m', 'benchmarks.bench_alarm_latency', '--serve', str(args.port),
+               *(str(fake_camera.port) for fake_camera in fake_cameras.values())]
+    server = subprocess.Popen(command)
+    client = AlarmClient()
+    try:
+        url = f'http://127.0.0.1:{args.port}'
+        await wait_for_server(url)
+        await client.connect(url)
+        await wait_for_subscriptions(fake_cameras)
+
+        phases = PHASES
+        if args.script is not None:
+            with open(args.script, 'r', encoding='utf-8') as f:
+                phases = ((os.path.basename(args.script), json.load(f)),)
+        matched: Dict[str, int] = {}
+        for name, script in phases:
+            await run_phase(name, script, fake_cameras, client, matched, args.phase_seconds)
+    finally:
+        await client.sio.disconnect()
+        server.terminate()
+        server.wait()
+        for fake_camera in fake_cameras.values():
+            await fake_camera.stop()
+
+
+def serve(port: int, camera_ports: List[int]) -> None:
+    """Runs the server against the given stand-in cameras, emitting every motion edge."""
+    os.environ['HOST'] = '127.0.0.1'
+    os.environ['PORT'] = str(port)
+    os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+    from utils.config import CONFIG, CameraConfig
+    CONFIG.onvif_cameras = [
+        CameraConfig(f'cam{index}', '127.0.0.1', camera_port, 'user', 'password')
+        for index, camera_port in enumerate(camera_ports)
+    ]
+    CONFIG.onvif_enabled = True
+    CONFIG.onvif_coalesce_window = 0
+    CONFIG.onvif_cache_path = None
+    CONFIG.journal_enabled = False
+    CONFIG.webhook_enabled = False
+    import app
+    asyncio.run(app.main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--phase-seconds', type=float, default=8)
+    parser.add_argument('--port', type=int, default=28181)
+    parser.add_argument('--script', help='fake camera script to play instead of the built-in phases')
+    parser.add_argument('--serve', type=int, nargs='+', metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], args.serve[1:])
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
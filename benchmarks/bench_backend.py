@@ -0,0 +1,114 @@
+"""
+Benchmark for the cluster backends.
+
+Runs N replicas of `Clients` in one process, connected either directly
+(`InProcessBackend`, N=1) or through a Unix socket `Hub`. Every replica
+publishes client/event/ack ops concurrently, then the replicas are checked
+for being identical and a late joiner is synchronized from the leader.
+Reports publish-to-applied latency percentiles and ops/s.
+
+    python -m benchmarks.bench_backend [--workers N] [--ops N]
+"""
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+from typing import List
+
+from objects.event import Event
+from objects.clients import Clients
+from utils.backend import Backend, Hub, InProcessBackend, LocalSocketBackend, ReplicaSync
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * pct / 100), len(samples) - 1)]
+
+
+def make_replica(backend: Backend) -> ReplicaSync:
+    clients = Clients(backend=backend)
+    replica_sync = ReplicaSync(backend, clients, clients.apply)
+    backend.set_handler(replica_sync.handle)
+    return replica_sync
+
+
+async def produce(clients: Clients, ops: int, latencies: List[float]) -> None:
+    sid = uuid.uuid4().hex
+    await clients.add_client(sid)
+    for index in range(ops):
+        start = time.perf_counter()
+        if index % 3 == 0:
+            await clients.update_client(sid, f'client-{sid[:6]}', 'bench')
+        else:
+            event = Event(str(uuid.uuid4()), f'event-{index}', 'bench', 'bench')
+            await clients.add_event(event)
+            await clients.ack_event(sid, event.id)
+        latencies.append(time.perf_counter() - start)
+
+
+def fingerprint(clients: Clients) -> tuple:
+    exported = clients.export_state()
+    return (
+        tuple((event['id'], event['seq']) for event in exported['events']),
+        tuple(sorted((client['sid'], client['cursor']) for client in exported['clients'])),
+        tuple(exported['unacked'])
+    )
+
+
+async def run(workers: int, ops: int) -> None:
+    hub = None
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+    if workers == 1:
+        backends: List[Backend] = [InProcessBackend()]
+    else:
+        hub = Hub(path)
+        await hub.start()
+        backends = [LocalSocketBackend(path) for _ in range(workers)]
+
+    replicas = [make_replica(backend) for backend in backends]
+    for backend in backends:
+        await backend.start()
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(produce(replica._clients, ops, latencies) for replica in replicas))
+    elapsed = time.perf_counter() - start
+
+    total = len(latencies)
+    print(f'workers={workers} ops={total} elapsed={elapsed:.3f}s throughput={total / elapsed:,.0f} ops/s')
+    print(f'  latency p50={percentile(latencies, 50) * 1e6:.0f}us '
+          f'p99={percentile(latencies, 99) * 1e6:.0f}us max={max(latencies) * 1e6:.0f}us')
+
+    if hub is not None:
+        # Let the last ops reach every replica before comparing
+        await asyncio.sleep(.2)
+        late = LocalSocketBackend(path)
+        late_replica = make_replica(late)
+        await late.start()
+        await late_replica.request()
+        replicas.append(late_replica)
+        backends.append(late)
+
+        prints = {fingerprint(replica._clients) for replica in replicas}
+        print(f'  replicas identical (incl. late joiner): {len(prints) == 1}')
+
+    for backend in backends:
+        await backend.stop()
+    if hub is not None:
+        await hub.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=2000, help='ops per worker')
+    args = parser.parse_args()
+    asyncio.run(run(1, args.ops))
+    if args.workers > 1:
+        asyncio.run(run(args.workers, args.ops))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Contention benchmark for `Clients` with hundreds of simulated clients.
+
+Each simulated client pongs every 100 ms, acks every event and asks for a
+snapshot once a second, while a producer adds events and the cleaners
+run. Reports per-operation latency percentiles for the lock-free `Clients`
+and for a baseline that serializes every call on one lock held across an
+await, as the previous implementation did.
+
+    python -m benchmarks.bench_clients_contention [--clients N] [--seconds S]
+"""
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List
+
+from objects.event import Event
+from objects.clients import Clients
+
+
+class LockedClients(Clients):
+    """Baseline: every operation holds a global lock across an await."""
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = asyncio.Lock()
+
+    def __getattribute__(self, name: str):
+        attr = super().__getattribute__(name)
+        if name in ('add_client', 'update_client', 'update_last_seen', 'get_client_list',
+                    'add_event', 'get_event_list', 'ack_event', 'clean_client', 'clean_event',
+                    'is_previous_event_valid'):
+            lock = super().__getattribute__('_lock')
+
+            async def locked(*args, **kwargs):
+                async with lock:
+                    await asyncio.sleep(0)
+                    return await attr(*args, **kwargs)
+            return locked
+        return attr
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * pct / 100), len(samples) - 1)]
+
+
+async def timed(latencies: Dict[str, List[float]], name: str, coro) -> object:
+    start = time.perf_counter()
+    result = await coro
+    latencies.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+async def simulate(clients: Clients, client_count: int, seconds: float) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = {}
+    deadline = time.monotonic() + seconds
+
+    async def client(sid: str) -> None:
+        await timed(latencies, 'add_client', clients.add_client(sid))
+        await timed(latencies, 'update_client', clients.update_client(sid, sid, 'html'))
+        tick = 0
+        while time.monotonic() < deadline:
+            await timed(latencies, 'update_last_seen', clients.update_last_seen(sid))
+            events = await timed(latencies, 'get_event_list', clients.get_event_list(sid, False))
+            for event in events:
+                await timed(latencies, 'ack_event', clients.ack_event(sid, str(event.id)))
+            if tick % 10 == 0:
+                await timed(latencies, 'get_client_list', clients.get_client_list(True))
+            tick += 1
+            await asyncio.sleep(.1)
+
+    async def producer() -> None:
+        while time.monotonic() < deadline:
+            event = Event(str(uuid.uuid4()), 'motion', 'onvif', 'server')
+            await timed(latencies, 'is_previous_event_valid', clients.is_previous_event_valid(event.event))
+            await timed(latencies, 'add_event', clients.add_event(event))
+            await asyncio.sleep(.05)
+
+    async def cleaner() -> None:
+        while time.monotonic() < deadline:
+            await timed(latencies, 'clean_client', clients.clean_client())
+            await timed(latencies, 'clean_event', clients.clean_event())
+            await asyncio.sleep(.1)
+
+    await asyncio.gather(producer(), cleaner(), *(client(f'sid-{i}') for i in range(client_count)))
+    return latencies
+
+
+def report(label: str, latencies: Dict[str, List[float]]) -> None:
+    print(label)
+    print(f'  {"operation":<25} {"calls":>8} {"p50 us":>10} {"p99 us":>10} {"max us":>10}')
+    for name, samples in sorted(latencies.items()):
+        print(f'  {name:<25} {len(samples):>8} '
+              f'{statistics.median(samples) * 1e6:>10.1f} '
+              f'{percentile(samples, 99) * 1e6:>10.1f} '
+              f'{max(samples) * 1e6:>10.1f}')
+
+
+async def run(args: argparse.Namespace) -> None:
+    report('Clients (lock-free)', await simulate(Clients(), args.clients, args.seconds))
+    report('baseline (global lock held across an await)', await simulate(LockedClients(), args.clients, args.seconds))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for the buffered event store.
+
+Compares `EventStore` against the plain list that `Clients._events` used to
+be, with 100k buffered events. Run from the repository root:
+
+    python -m benchmarks.bench_event_store
+"""
+import time
+import uuid
+from typing import List
+
+from objects.event import Event
+from objects.event_store import EventStore
+
+EVENT_COUNT = 100_000
+LOOKUP_COUNT = 10_000
+THRESHOLD = 15
+EVENT_NAMES = ['motion', 'person', 'kill', 'ignore', 'recover']
+
+
+def make_events(count: int, now: float) -> List[Event]:
+    events = []
+    for i in range(count):
+        event = Event(str(uuid.uuid4()), EVENT_NAMES[i % len(EVENT_NAMES)], 'onvif', 'server')
+        # Spread arrivals evenly over the last 2 * THRESHOLD seconds
+        event.received = now - 2 * THRESHOLD + (2 * THRESHOLD * i / count)
+        events.append(event)
+    return events
+
+
+def timed(label: str, func, repeat: int = 1) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{label:<45} {elapsed * 1e6:>12.1f} us')
+
+
+def bench_list(events: List[Event], now: float) -> None:
+    buffered = list(events)
+    lookup_ids = [str(event.id) for event in events[-LOOKUP_COUNT:]]
+
+    def is_previous_event_valid():
+        for event in reversed(buffered):
+            if event.event == 'never_seen' and now - event.received < THRESHOLD:
+                return True
+        return False
+
+    def lookup():
+        for event_id in lookup_ids[:100]:
+            for event in buffered:
+                if str(event.id) == event_id:
+                    break
+
+    def expire():
+        for event in list(buffered):
+            if now - event.received > THRESHOLD:
+                buffered.remove(event)
+
+    print('list (previous implementation)')
+    timed('  is_previous_event_valid (miss)', is_previous_event_valid, 10)
+    timed('  lookup by id (100 lookups)', lookup)
+    timed(f'  expire {EVENT_COUNT // 2} events', expire)
+
+
+def bench_store(events: List[Event], now: float) -> None:
+    store = EventStore()
+    lookup_ids = [str(event.id) for event in events[-LOOKUP_COUNT:]]
+
+    def append():
+        for event in events:
+            store.append(event)
+
+    def is_previous_event_valid():
+        store.is_previous_event_valid('never_seen', THRESHOLD, now)
+        store.is_previous_event_valid('motion', THRESHOLD, now)
+
+    def lookup():
+        for event_id in lookup_ids[:100]:
+            store.get(event_id)
+
+    print('EventStore')
+    timed(f'  append {EVENT_COUNT} events', append)
+    timed('  is_previous_event_valid (miss + hit)', is_previous_event_valid, 10_000)
+    timed('  lookup by id (100 lookups)', lookup, 1_000)
+    timed('  replay last 100 events by seq', lambda: store.events_since(store.last_seq - 100), 10_000)
+    timed(f'  expire {EVENT_COUNT // 2} events', lambda: store.expire(THRESHOLD, now))
+    timed('  expire (nothing due)', lambda: store.expire(THRESHOLD, now), 10_000)
+
+
+def main() -> None:
+    now = time.monotonic()
+    events = make_events(EVENT_COUNT, now)
+    bench_store(events, now)
+    bench_list(events, now)
+
+
+if __name__ == '__main__':
+    main()
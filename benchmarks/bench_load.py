@@ -0,0 +1,432 @@
+"""
+End-to-end load test of the socket.io server with simulated clients.
+
+Every simulated client speaks the protocol of `static/static/js/session.js`:
+connect, `introduce`, `pong` every `ping`, track `delta` revisions (asking
+for a new snapshot with `get` on a gap) and `ack` every event it receives.
+The clients are spread over `--processes` load processes. An injector
+client sends `--event-rate` events per second through the `event`
+handler while the server is measured for `--duration` seconds.
+
+Reports:
+- alarm latency, from injecting an event to each client receiving it
+- the interval between pings seen by each client, 100 ms when the server
+  keeps up
+- messages/s received by the clients
+- server CPU and RSS, summed over its process tree
+- disconnects the clients didn't ask for, e.g. by missing
+  `clientRemovalThreshold`
+- the CPU use of each load process, a load process near 100% skews
+  every latency above
+
+Unless `--url` points at a running server (give `--server-pid` to
+measure it), one is started on `--port` with the default config. Results
+go to `--output` as JSON. With `--baseline`, the run is compared to an
+earlier results file and exits with 1 on a regression beyond
+`--max-regression`.
+
+    python -m benchmarks.bench_load [--clients N] [--processes N] [--duration S] [--event-rate R] [--serializer json|msgpack]
+                                    [--output FILE] [--baseline FILE]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import datetime
+import resource
+import subprocess
+from typing import Dict, List, Optional
+
+import aiohttp
+import socketio
+
+CONNECT_CONCURRENCY = 50
+SERVER_START_TIMEOUT = 30
+SETTLE_TIME = 2
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = resource.getpagesize()
+
+# Compared with `--baseline`, each lower is better
+REGRESSION_METRICS = (
+    ('alarm_latency_ms', 'p50'),
+    ('alarm_latency_ms', 'p99'),
+    ('ping_interval_ms', 'p99'),
+    ('server', 'cpu_percent'),
+    ('server', 'rss_mib_max')
+)
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)], 3)
+
+    return {
+        'count': len(ordered),
+        'p50': percentile(.5),
+        'p90': percentile(.9),
+        'p99': percentile(.99),
+        'max': round(ordered[-1], 3)
+    }
+
+
+class SimulatedClient:
+    """One browser session, as implemented by session.js."""
+    def __init__(self, index: int, http_session: aiohttp.ClientSession, window: tuple, serializer: str = 'default') -> None:
+        self.name = f'load-{os.getpid()}-{index}'
+        self.sio = socketio.AsyncClient(reconnection=False, http_session=http_session, handle_sigint=False,
+                                        serializer=serializer)
+        self.window = window
+        self.revision: Optional[int] = None
+        self.last_ping: Optional[float] = None
+        self.closing = False
+        self.messages = 0
+        self.ping_intervals: List[float] = []
+        self.alarm_latencies: List[float] = []
+        self.spurious_disconnects = 0
+        self.sio.on('connect', self._handle_connect)
+        self.sio.on('disconnect', self._handle_disconnect)
+        self.sio.on('ping', self._handle_ping)
+        self.sio.on('get_result', self._handle_get_result)
+        self.sio.on('delta', self._handle_delta)
+        self.sio.on('event', self._handle_event)
+        self.sio.on('event_ignored', self._handle_event)
+
+    def _in_window(self, now: float) -> bool:
+        return self.window[0] <= now < self.window[1]
+
+    def _count(self, now: float) -> None:
+        if self._in_window(now):
+            self.messages += 1
+
+    async def _handle_connect(self) -> None:
+        self.revision = None
+        await self.sio.emit('introduce', {'name': self.name, 'type': 'html'})
+
+    async def _handle_disconnect(self, reason=None) -> None:
+        if not self.closing:
+            self.spurious_disconnects += 1
+
+    async def _handle_ping(self, data=None) -> None:
+        now = time.monotonic()
+        self._count(now)
+        await self.sio.emit('pong')
+        if self.last_ping is not None and self._in_window(now):
+            self.ping_intervals.append((now - self.last_ping) * 1000)
+        self.last_ping = now
+
+    async def _handle_get_result(self, data: dict) -> None:
+        self._count(time.monotonic())
+        self.revision = data['rev']
+        for event in data['eventList']:
+            await self.sio.emit('ack', {'id': event['id']})
+
+    async def _handle_delta(self, data: dict) -> None:
+        self._count(time.monotonic())
+        if self.revision is None or data['rev'] <= self.revision:
+            return
+        if data['rev'] != self.revision + 1:
+            # Missed a delta, resync from a full snapshot
+            self.revision = None
+            await self.sio.emit('get')
+            return
+        self.revision = data['rev']
+
+    async def _handle_event(self, data: dict) -> None:
+        now = time.monotonic()
+        self._count(now)
+        event = data['event']
+        await self.sio.emit('ack', {'id': event['id']})
+        sent = (event.get('data') or {}).get('sent')
+        if sent is not None and self._in_window(sent):
+            self.alarm_latencies.append((now - sent) * 1000)
+
+
+async def run_clients(args: argparse.Namespace) -> None:
+    """Load process: runs `--clients` simulated clients and prints their results as JSON."""
+    window = (args.window_start, args.window_start + args.duration)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http_session:
+        serializer = 'msgpack' if args.serializer == 'msgpack' else 'default'
+        clients = [SimulatedClient(index, http_session, window, serializer) for index in range(args.clients)]
+        url = args.url if args.serializer == 'json' else f'{args.url}?serializer={args.serializer}'
+        semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+        connect_failures = 0
+
+        async def connect(client: SimulatedClient) -> None:
+            nonlocal connect_failures
+            async with semaphore:
+                try:
+                    await client.sio.connect(url, transports=['websocket'])
+                except Exception:
+                    connect_failures += 1
+
+        await asyncio.gather(*(connect(client) for client in clients))
+        await asyncio.sleep(max(window[0] - time.monotonic(), 0))
+        # Clients evicted before the window opened don't receive its events
+        connected = sum(1 for client in clients if client.sio.connected)
+        cpu_start = time.process_time()
+        await asyncio.sleep(max(window[1] - time.monotonic(), 0))
+        cpu = time.process_time() - cpu_start
+        # Late deliveries of events sent inside the window still count
+        await asyncio.sleep(SETTLE_TIME)
+
+        for client in clients:
+            client.closing = True
+        await asyncio.gather(*(client.sio.disconnect() for client in clients), return_exceptions=True)
+
+    print(json.dumps({
+        'connected': connected,
+        'cpu_percent': round(cpu / args.duration * 100, 1),
+        'connect_failures': connect_failures,
+        'spurious_disconnects': sum(client.spurious_disconnects for client in clients),
+        'messages': sum(client.messages for client in clients),
+        'ping_intervals': [value for client in clients for value in client.ping_intervals],
+        'alarm_latencies': [value for client in clients for value in client.alarm_latencies]
+    }))
+
+
+def process_tree(pid: int) -> List[int]:
+    parents: Dict[int, int] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                parents[int(entry)] = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree = [pid]
+    for member in tree:
+        tree.extend(child for child, parent in parents.items() if parent == member)
+    return tree
+
+
+def sample_server(pid: int) -> tuple:
+    """CPU seconds used and RSS in MiB of the process tree under `pid`."""
+    cpu = 0.
+    rss = 0.
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f'/proc/{member}/statm') as statm:
+                rss += int(statm.read().split()[1]) * PAGE_SIZE / 2 ** 20
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+
+async def inject_events(url: str, rate: float, window: tuple) -> int:
+    """Arms the server and sends `rate` events per second through the `event` handler during the window."""
+    sio = socketio.AsyncClient(reconnection=False)
+
+    @sio.on('ping')
+    async def handle_ping(data=None) -> None:
+        await sio.emit('pong')
+
+    await sio.connect(url, transports=['websocket'])
+    await sio.emit('introduce', {'name': 'load-injector', 'type': 'pc'})
+    await sio.emit('set_armed', {'armed': True})
+    sent = 0
+    try:
+        await asyncio.sleep(max(window[0] - time.monotonic(), 0))
+        for index in range(int((window[1] - window[0]) * rate)):
+            await asyncio.sleep(max(window[0] + index / rate - time.monotonic(), 0))
+            await sio.emit('event', {
+                'id': str(uuid.uuid4()),
+                'event': 'load',
+                'type': 'user',
+                'source': 'load-injector',
+                'data': {'sent': time.monotonic()}
+            })
+            sent += 1
+        # Disconnecting right away could drop the last queued emit
+        await asyncio.sleep(max(window[1] - time.monotonic(), 0))
+        return sent
+    finally:
+        await sio.disconnect()
+
+
+async def wait_for_server(url: str) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f'{url}/api/v1/health') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError('Server did not start')
+            await asyncio.sleep(.1)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    server = None
+    url = args.url
+    server_pid = args.server_pid
+    if url is None:
+        url = f'http://127.0.0.1:{args.port}'
+        server = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_load', '--serve', str(args.port)])
+        server_pid = server.pid
+    try:
+        await wait_for_server(url)
+        window_start = time.monotonic() + args.ramp + SETTLE_TIME
+        window = (window_start, window_start + args.duration)
+
+        per_process = [args.clients // args.processes + (1 if index < args.clients % args.processes else 0)
+                       for index in range(args.processes)]
+        load_processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'benchmarks.bench_load', '--clients-process',
+                '--url', url, '--clients', str(count), '--duration', str(args.duration),
+                '--serializer', args.serializer,
+                '--window-start', repr(window_start),
+                stdout=asyncio.subprocess.PIPE
+            )
+            for count in per_process if count > 0
+        ]
+
+        async def sample_during_window() -> dict:
+            await asyncio.sleep(max(window[0] - time.monotonic(), 0))
+            if server_pid is None:
+                await asyncio.sleep(args.duration)
+                return {}
+            cpu_start, rss_start = sample_server(server_pid)
+            rss_max = rss_start
+            while time.monotonic() < window[1]:
+                await asyncio.sleep(min(.5, max(window[1] - time.monotonic(), 0)))
+                rss_max = max(rss_max, sample_server(server_pid)[1])
+            cpu_end, rss_end = sample_server(server_pid)
+            return {
+                'cpu_percent': round((cpu_end - cpu_start) / args.duration * 100, 1),
+                'rss_mib_start': round(rss_start, 1),
+                'rss_mib_end': round(rss_end, 1),
+                'rss_mib_max': round(rss_max, 1)
+            }
+
+        sent, server_usage, *outputs = await asyncio.gather(
+            inject_events(url, args.event_rate, window),
+            sample_during_window(),
+            *(process.communicate() for process in load_processes)
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = [json.loads(stdout) for stdout, _ in outputs]
+    connected = sum(result['connected'] for result in results)
+    alarm_latencies = [value for result in results for value in result['alarm_latencies']]
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'parameters': {
+            'clients': args.clients,
+            'processes': args.processes,
+            'duration': args.duration,
+            'event_rate': args.event_rate,
+            'serializer': args.serializer
+        },
+        'clients': {
+            'connected': connected,
+            'connect_failures': sum(result['connect_failures'] for result in results),
+            'spurious_disconnects': sum(result['spurious_disconnects'] for result in results)
+        },
+        'events': {
+            'sent': sent,
+            'deliveries': len(alarm_latencies),
+            'expected_deliveries': sent * connected
+        },
+        'alarm_latency_ms': summarize(alarm_latencies),
+        'ping_interval_ms': summarize([value for result in results for value in result['ping_intervals']]),
+        'messages_per_second': round(sum(result['messages'] for result in results) / args.duration, 1),
+        'server': server_usage,
+        # Near 100% means the load processes, not the server, limit the results
+        'load_process_cpu_percent': [result['cpu_percent'] for result in results]
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Prints each tracked metric against the baseline, returns whether none regressed."""
+    is_ok = True
+    for section, key in REGRESSION_METRICS:
+        current = results.get(section, {}).get(key)
+        previous = baseline.get(section, {}).get(key)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = change > max_regression
+        is_ok = is_ok and not regressed
+        print(f'{section + "." + key:<24} {previous:10.2f} -> {current:10.2f} ({change:+.0%}){"  REGRESSION" if regressed else ""}')
+    return is_ok
+
+
+def serve(port: int) -> None:
+    """Runs the server with the default config on `port`."""
+    os.environ['HOST'] = '127.0.0.1'
+    os.environ['PORT'] = str(port)
+    os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+    import app
+    asyncio.run(app.main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=max((os.cpu_count() or 1) // 2, 1))
+    parser.add_argument('--duration', type=float, default=10, help='seconds measured after every client connected')
+    parser.add_argument('--ramp', type=float, default=10, help='seconds allowed for the clients to connect')
+    parser.add_argument('--event-rate', type=float, default=2, help='injected events per second')
+    parser.add_argument('--serializer', choices=('json', 'msgpack'), default='json', help='wire format of the simulated clients')
+    parser.add_argument('--port', type=int, default=28182)
+    parser.add_argument('--url', help='a running server to test instead of starting one')
+    parser.add_argument('--server-pid', type=int, help='pid of the server given by --url, to measure CPU and RSS')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='earlier results file to compare with')
+    parser.add_argument('--max-regression', type=float, default=.2)
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--clients-process', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--window-start', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    if args.clients_process:
+        asyncio.run(run_clients(args))
+        return
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            if not compare(results, json.load(f), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
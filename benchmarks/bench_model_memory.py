@@ -0,0 +1,91 @@
+"""
+Memory per buffered event and per client, and the cost of a pong.
+
+Compares the slotted `Event` and `Client` with the dict-backed classes
+they replaced (copied below), which kept `datetime` wall clock times.
+String ids, event data and names are built before measuring, so only the
+objects themselves are counted. The cached wire representation of an
+event is measured separately. Run from the repository root:
+
+    python -m benchmarks.bench_model_memory [--count N]
+"""
+import time
+import uuid
+import datetime
+import argparse
+import tracemalloc
+from typing import Callable, List, Optional, Set, Union
+
+from objects.client import Client
+from objects.event import Event
+
+
+class LegacyEvent:
+    def __init__(self, event_id: str, event_event: str, event_type: str, event_source: str, event_data: Union[dict, None] = None) -> None:
+        self.id: str = event_id
+        self.event: str = event_event
+        self.type: str = event_type
+        self.source: str = event_source
+        self.data: dict = event_data
+        self.timestamp: datetime = datetime.datetime.now()
+        self.received: float = time.monotonic()
+        self.seq: Optional[int] = None
+
+
+class LegacyClient:
+    def __init__(self, sid: str, cursor: int = 0) -> None:
+        self.sid: str = sid
+        self.name: str | None = None
+        self.type: str | None = None
+        self.cursor: int = cursor
+        self.acked: Set[int] = set()
+        self.registered: datetime = datetime.datetime.now()
+        self.last_seen: datetime = datetime.datetime.now()
+
+    def update_last_seen(self) -> None:
+        self.last_seen = datetime.datetime.now()
+
+
+def measure(label: str, build: Callable[[], List]) -> List:
+    tracemalloc.start()
+    objects = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<45} {size / len(objects):>8.1f} bytes')
+    return objects
+
+
+def timed(label: str, func: Callable, repeat: int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{label:<45} {elapsed * 1e9:>8.1f} ns')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100_000)
+    args = parser.parse_args()
+
+    string_ids = [str(uuid.uuid4()) for _ in range(args.count)]
+    data = [{'camera': f'cam{index % 8}', 'topic': 'tns1:VideoSource/MotionAlarm'} for index in range(args.count)]
+    sids = [uuid.uuid4().hex for _ in range(args.count)]
+
+    print('per buffered event')
+    measure('  previous', lambda: [LegacyEvent(string_ids[i], 'motion', 'onvif', 'server', data[i]) for i in range(args.count)])
+    measure('  slotted', lambda: [Event(string_ids[i], 'motion', 'onvif', 'server', data[i]) for i in range(args.count)])
+    events = [Event(string_ids[i], 'motion', 'onvif', 'server', data[i]) for i in range(args.count)]
+    measure('  cached wire dict and JSON, on top', lambda: [event.to_json() for event in events])
+
+    print('per client')
+    legacy_clients = measure('  previous', lambda: [LegacyClient(sid) for sid in sids])
+    clients = measure('  slotted', lambda: [Client(sid) for sid in sids])
+
+    print('per pong')
+    timed('  previous update_last_seen', legacy_clients[0].update_last_seen, 200_000)
+    timed('  slotted update_last_seen', clients[0].update_last_seen, 200_000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Startup cost of monitoring 1 vs N ONVIF cameras.
+
+Starts N stand-in cameras (`benchmarks.fake_camera`), runs one
+`CameraMonitor` per camera and reports the time until every PullPoint
+subscription is live, the CPU time and the RSS growth it took, then
+triggers motion on every camera and checks each event is stamped with
+its camera id. Each camera count runs in a fresh process so the parsed
+WSDL cache starts cold every time.
+
+    python -m benchmarks.bench_onvif_cameras [--cameras 1 16] [--no-preload]
+"""
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import subprocess
+from typing import List
+
+from objects.event import Event
+from utils.config import CameraConfig
+from onvif_.monitor_events import CameraMonitor, preload_wsdl
+from benchmarks.fake_camera import FakeCamera
+
+
+class EventSink:
+    """Collects what the monitors would broadcast."""
+    def __init__(self) -> None:
+        self.events: List[Event] = []
+
+    async def broadcast(self, event: Event) -> None:
+        self.events.append(event)
+
+
+def rss_mib() -> float:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+async def run(camera_count: int, preload: bool) -> None:
+    fake_cameras = [FakeCamera() for _ in range(camera_count)]
+    for fake_camera in fake_cameras:
+        await fake_camera.start()
+
+    sink = EventSink()
+    monitors = [
+        CameraMonitor(CameraConfig(f'cam{index}', '127.0.0.1', fake_camera.port, 'user', 'password'), sink)
+        for index, fake_camera in enumerate(fake_cameras)
+    ]
+
+    rss_before = rss_mib()
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    if preload:
+        await preload_wsdl()
+    tasks = [asyncio.create_task(monitor.run()) for monitor in monitors]
+    while not all(monitor.is_up for monitor in monitors):
+        await asyncio.sleep(.005)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    rss = rss_mib() - rss_before
+
+    for fake_camera in fake_cameras:
+        fake_camera.trigger()
+    deadline = time.monotonic() + 5
+    while len(sink.events) < camera_count and time.monotonic() < deadline:
+        await asyncio.sleep(.01)
+    sources = {event.source for event in sink.events}
+
+    print(f'cameras={camera_count:<3} all subscribed in {elapsed * 1000:7.1f} ms  '
+          f'cpu={cpu * 1000:7.1f} ms  rss +{rss:5.1f} MiB  '
+          f'events={len(sink.events)} distinct sources={len(sources)}')
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for fake_camera in fake_cameras:
+        await fake_camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--no-preload', action='store_true', help='let every camera parse the WSDL on its own')
+    args = parser.parse_args()
+
+    if len(args.cameras) > 1:
+        for camera_count in args.cameras:
+            command = [sys.executable, '-m', 'benchmarks.bench_onvif_cameras', '--cameras', str(camera_count)]
+            if args.no_preload:
+                command.append('--no-preload')
+            subprocess.run(command, check=True)
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.cameras[0], not args.no_preload))
+
+
+if __name__ == '__main__':
+    main()
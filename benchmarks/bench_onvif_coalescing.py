@@ -0,0 +1,98 @@
+"""
+Events broadcast for a camera reporting long and flapping motion.
+
+A stand-in camera (`benchmarks.fake_camera`) plays `--bursts` bursts,
+each made of `--flaps` short motion periods `--gap` seconds apart, and
+re-reports the active state every `--repeat-interval` seconds while
+motion lasts. Reports how many notifications the camera sent, how many
+events reached `EventHandler.broadcast` and the latency of the first
+event of each burst.
+
+    python -m benchmarks.bench_onvif_coalescing [--bursts N] [--flaps N] [--coalesce-window S] [--emit-cleared]
+"""
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+from typing import List
+
+from objects.event import Event
+from utils.config import CONFIG, CameraConfig
+from onvif_.monitor_events import CameraMonitor, preload_wsdl
+from benchmarks.fake_camera import FakeCamera
+
+
+class EventSink:
+    def __init__(self) -> None:
+        self.events: List[Event] = []
+        self.broadcast_at: List[float] = []
+
+    async def broadcast(self, event: Event) -> None:
+        self.events.append(event)
+        self.broadcast_at.append(time.monotonic())
+
+
+async def run(args: argparse.Namespace) -> None:
+    fake_camera = FakeCamera()
+    await fake_camera.start()
+    sink = EventSink()
+    monitor = CameraMonitor(CameraConfig('bench', '127.0.0.1', fake_camera.port, 'user', 'password'), sink)
+
+    await preload_wsdl()
+    task = asyncio.create_task(monitor.run())
+    while not monitor.is_up:
+        await asyncio.sleep(.01)
+
+    notifications = 0
+    burst_started: List[float] = []
+    for _ in range(args.bursts):
+        burst_started.append(time.monotonic())
+        for _ in range(args.flaps):
+            for _ in range(args.repeats):
+                fake_camera.trigger(True)
+                notifications += 1
+                await asyncio.sleep(args.repeat_interval)
+            fake_camera.trigger(False)
+            notifications += 1
+            await asyncio.sleep(args.gap)
+        await asyncio.sleep(args.pause)
+
+    first_latencies = []
+    for started in burst_started:
+        after = [broadcast for broadcast in sink.broadcast_at if broadcast >= started]
+        if after:
+            first_latencies.append((after[0] - started) * 1000)
+    names = {}
+    for event in sink.events:
+        names[event.event] = names.get(event.event, 0) + 1
+
+    counts = [event.data['count'] for event in sink.events if 'count' in event.data]
+    print(f'notifications {notifications}  broadcasts {len(sink.events)} {names}  cleared counts {counts}  '
+          f'first event of a burst p50 {statistics.median(first_latencies):5.1f} ms')
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await fake_camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--flaps', type=int, default=4, help='motion periods per burst')
+    parser.add_argument('--repeats', type=int, default=10, help='active reports per motion period')
+    parser.add_argument('--repeat-interval', type=float, default=.05)
+    parser.add_argument('--gap', type=float, default=.3, help='seconds without motion between the periods of a burst')
+    parser.add_argument('--pause', type=float, default=6, help='seconds between bursts')
+    parser.add_argument('--coalesce-window', type=float, default=CONFIG.onvif_coalesce_window)
+    parser.add_argument('--emit-cleared', action='store_true')
+    args = parser.parse_args()
+
+    CONFIG.onvif_coalesce_window = args.coalesce_window
+    CONFIG.onvif_emit_cleared = args.emit_cleared
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Parsing cost of ONVIF notification messages.
+
+Records `--recorded` notification messages (motion, people and an
+unmonitored topic, with random values) from a stand-in camera
+(`benchmarks.fake_camera`) through a real PullMessages round trip, then
+parses `--messages` of them with the compiled topic extractors, the way
+the pull loop does.
+
+    python -m benchmarks.bench_onvif_parser [--messages N] [--keep-raw-message]
+"""
+import time
+import random
+import asyncio
+import logging
+import argparse
+import datetime
+from typing import Any, List
+
+from onvif import ONVIFCamera
+
+from utils.config import DEFAULT_ONVIF_TOPICS, parse_topic_configs
+from onvif_.event_parser import compile_topic_extractors, parse_event_message
+from onvif_.monitor_events import WSDL_DIR
+from benchmarks.fake_camera import FakeCamera, notification
+
+RECORDED_TOPICS = (
+    ('tns1:RuleEngine/CellMotionDetector/Motion', 'IsMotion', 6),
+    ('tns1:RuleEngine/PeopleDetector/People', 'IsPeople', 2),
+    ('tns1:VideoSource/ImageTooDark/AnalyticsService', 'IsTooDark', 2)
+)
+
+
+async def record(count: int) -> List[Any]:
+    fake_camera = FakeCamera()
+    await fake_camera.start()
+    device = ONVIFCamera('127.0.0.1', fake_camera.port, 'user', 'password', WSDL_DIR)
+    try:
+        await device.update_xaddrs()
+        pullpoint_manager = await device.create_pullpoint_manager(datetime.timedelta(minutes=1), lambda: None)
+        subscription = next(iter(fake_camera.subscriptions.values()))
+        rng = random.Random(1)
+        topics = [(topic, name) for topic, name, weight in RECORDED_TOPICS for _ in range(weight)]
+        for _ in range(count):
+            topic, name = rng.choice(topics)
+            subscription.push(notification(topic, rng.random() < .5, name))
+        response = await pullpoint_manager.get_service().PullMessages(
+            {'MessageLimit': count, 'Timeout': datetime.timedelta(seconds=1)}
+        )
+        await pullpoint_manager.shutdown()
+        return list(response.NotificationMessage)
+    finally:
+        await device.close()
+        await fake_camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--recorded', type=int, default=1000)
+    parser.add_argument('--keep-raw-message', action='store_true')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    recorded = asyncio.run(record(args.recorded))
+    extractors = compile_topic_extractors(parse_topic_configs(DEFAULT_ONVIF_TOPICS), args.keep_raw_message)
+    messages = [recorded[index % len(recorded)] for index in range(args.messages)]
+
+    parsed = 0
+    start = time.perf_counter()
+    for msg in messages:
+        if parse_event_message(msg, extractors) is not None:
+            parsed += 1
+    elapsed = time.perf_counter() - start
+
+    print(f'messages={len(messages)} events={parsed}  {elapsed * 1000:7.1f} ms  '
+          f'{elapsed / len(messages) * 1e6:5.2f} us/message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Latency from a camera raising motion to `EventHandler.broadcast`.
+
+Runs one `CameraMonitor` against a stand-in camera
+(`benchmarks.fake_camera`), triggers motion at random moments and
+reports the trigger-to-broadcast latency, the pull-to-broadcast stage
+latency recorded by the monitor and how many PullMessages requests the
+camera had to answer per second while idle. A short
+`--subscription-time` checks the subscription is renewed before it
+expires: every subscription the camera had to create beyond the first
+means the monitor lost one.
+
+    python -m benchmarks.bench_onvif_pull_latency [--events N] [--latency S] [--subscription-time S]
+"""
+import time
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+from typing import List
+
+from objects.event import Event
+from utils.config import CameraConfig
+from utils.metrics import STAGE_LATENCY
+from onvif_.monitor_events import CameraMonitor, preload_wsdl
+from benchmarks.fake_camera import FakeCamera
+
+
+class EventSink:
+    def __init__(self) -> None:
+        self.broadcast_at: List[float] = []
+
+    async def broadcast(self, event: Event) -> None:
+        self.broadcast_at.append(time.monotonic())
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run(args: argparse.Namespace) -> None:
+    fake_camera = FakeCamera(latency=args.latency, subscription_time=args.subscription_time)
+    await fake_camera.start()
+    sink = EventSink()
+    monitor = CameraMonitor(CameraConfig('bench', '127.0.0.1', fake_camera.port, 'user', 'password'), sink)
+
+    await preload_wsdl()
+    task = asyncio.create_task(monitor.run())
+    while not monitor.is_up:
+        await asyncio.sleep(.01)
+
+    # Idle request rate, nothing to deliver
+    pulls_before = fake_camera.requests.get('PullMessages', 0)
+    await asyncio.sleep(args.idle)
+    idle_pulls = (fake_camera.requests.get('PullMessages', 0) - pulls_before) / args.idle
+
+    for _ in range(args.events):
+        await asyncio.sleep(random.uniform(.2, 1.2))
+        fake_camera.trigger()
+    deadline = time.monotonic() + 5
+    while len(sink.broadcast_at) < args.events and time.monotonic() < deadline:
+        await asyncio.sleep(.01)
+
+    latencies = [(broadcast - triggered) * 1000 for triggered, broadcast in zip(fake_camera.triggered_at, sink.broadcast_at)]
+    stage = STAGE_LATENCY._counts.get(('onvif_pull_to_broadcast',))
+    stage_mean = ''
+    if stage:
+        stage_mean = f'  pull-to-broadcast mean {STAGE_LATENCY._sums[("onvif_pull_to_broadcast",)] / sum(stage) * 1000:.2f} ms'
+
+    print(f'events {len(latencies)}/{args.events}  trigger-to-broadcast '
+          f'p50 {statistics.median(latencies):7.1f} ms  p95 {percentile(latencies, .95):7.1f} ms  '
+          f'max {max(latencies):7.1f} ms{stage_mean}  idle PullMessages {idle_pulls:.2f}/s  '
+          f'subscriptions {fake_camera.requests.get("CreatePullPointSubscription", 0)}  '
+          f'renewals {fake_camera.requests.get("Renew", 0)}')
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await fake_camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0, help='camera response time in seconds')
+    parser.add_argument('--idle', type=float, default=5, help='seconds to count idle PullMessages requests')
+    parser.add_argument('--subscription-time', type=float, default=600, help='seconds the camera keeps a subscription without a Renew')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Time until alarms flow again after startup and after a camera blip.
+
+Runs one `CameraMonitor` against a stand-in camera that answers every
+request after `--latency` seconds, and reports:
+
+  - startup: WSDL preload, then connect until the PullPoint subscription
+    is live; run once with an empty XAddr cache file and once with the
+    file the first run left behind (each in a fresh process)
+  - blip: the camera is restarted, and the time from it accepting
+    connections again until the subscription is live is measured
+
+`--no-cache` disables the XAddr cache, so every connect rediscovers the
+services as before.
+
+    python -m benchmarks.bench_onvif_reconnect [--latency S] [--no-cache]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, Optional
+
+from utils.config import CameraConfig
+from onvif_.monitor_events import CameraMonitor, preload_wsdl
+from onvif_.xaddr_cache import XAddrCache
+from benchmarks.fake_camera import FakeCamera
+
+
+class NoXAddrCache(XAddrCache):
+    def get(self, camera: CameraConfig) -> Optional[Dict[str, str]]:
+        return None
+
+
+class EventSink:
+    async def broadcast(self, event) -> None:
+        pass
+
+
+async def wait_until_up(monitor: CameraMonitor) -> None:
+    while not monitor.is_up:
+        await asyncio.sleep(.001)
+
+
+async def run(args: argparse.Namespace) -> None:
+    cache = NoXAddrCache() if args.no_cache else XAddrCache(args.cache_path)
+    port = 0
+    if args.reuse_port:
+        # Cached entries are tied to the camera address, keep the port of the previous run
+        port = cache._entries.get('bench', {}).get('port', 0)
+    fake_camera = FakeCamera(port=port, latency=args.latency)
+    await fake_camera.start()
+    camera = CameraConfig('bench', '127.0.0.1', fake_camera.port, 'user', 'password')
+
+    monitor = CameraMonitor(camera, EventSink(), cache)
+
+    start = time.perf_counter()
+    await preload_wsdl()
+    preloaded = time.perf_counter()
+    task = asyncio.create_task(monitor.run())
+    await wait_until_up(monitor)
+    connected = time.perf_counter()
+
+    await fake_camera.stop()
+    while monitor.is_up:
+        await asyncio.sleep(.001)
+    await asyncio.sleep(.05)
+    await fake_camera.start()
+    restarted = time.perf_counter()
+    await wait_until_up(monitor)
+    recovered = time.perf_counter()
+
+    print(f'{args.label:<28} preload {(preloaded - start) * 1000:6.1f} ms  '
+          f'connect {(connected - preloaded) * 1000:6.1f} ms  '
+          f'blip recovery {(recovered - restarted) * 1000:6.1f} ms  '
+          f'requests {sum(fake_camera.requests.values())}')
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await fake_camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=.05, help='camera response time in seconds')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--cache-path')
+    parser.add_argument('--label')
+    parser.add_argument('--reuse-port', action='store_true')
+    args = parser.parse_args()
+
+    if args.cache_path is None and args.label is None:
+        cache_path = os.path.join(tempfile.mkdtemp(), 'onvif_cache.json')
+        base = [sys.executable, '-m', 'benchmarks.bench_onvif_reconnect', '--latency', str(args.latency)]
+        if args.no_cache:
+            subprocess.run([*base, '--no-cache', '--label', 'no XAddr cache'], check=True)
+            return
+        subprocess.run([*base, '--cache-path', cache_path, '--label', 'cold start, empty cache'], check=True)
+        subprocess.run([*base, '--cache-path', cache_path, '--reuse-port',
+                        '--label', 'restart, persisted cache'], check=True)
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    args.label = args.label or 'run'
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+One slow consumer among healthy clients, per outbound policy.
+
+Starts the server with each outbound setting in turn, connects
+`--healthy` socket.io clients and one client on a throttled link: a raw
+engine.io websocket with a small receive buffer that reads at most
+`--slow-kbps` KiB per second, answering pings and acking events as it
+reads them. An injector sends `--event-rate` armed events per second
+carrying `--payload-kb` KiB of data. Reports, per setting:
+- healthy clients' alarm latency
+- what the slow client read, and when it saw the connection close
+- the largest outbound queue seen for it and the server's peak RSS
+- the server's slow consumer actions
+
+    python -m benchmarks.bench_slow_consumer [--healthy N] [--duration S] [--payload-kb K] [--slow-kbps K]
+"""
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+from typing import List, Optional
+
+import aiohttp
+import socketio
+
+from benchmarks.bench_load import sample_server, wait_for_server
+
+# name, maxQueue, disconnectQueue, policy; limits below the defaults so the run hits them
+SETTINGS = (
+    ('off', 0, 0, 'disconnect'),
+    ('drop', 32, 128, 'drop'),
+    ('disconnect', 32, 128, 'disconnect'),
+)
+SLOW_RECEIVE_BUFFER = 8 * 1024
+SAMPLE_INTERVAL = .2
+
+
+class HealthyClient:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.latencies: List[float] = []
+        self.sio.on('ping', self._handle_ping)
+        self.sio.on('event', self._handle_event)
+
+    async def _emit(self, event: str, data=None) -> None:
+        # Handlers run as tasks and may finish after the disconnect
+        if self.sio.connected:
+            try:
+                await self.sio.emit(event, data)
+            except socketio.exceptions.BadNamespaceError:
+                pass
+
+    async def _handle_ping(self, data=None) -> None:
+        await self._emit('pong')
+
+    async def _handle_event(self, payload: dict) -> None:
+        event = payload['event']
+        sent = (event.get('data') or {}).get('sent')
+        if sent is not None:
+            self.latencies.append((time.monotonic() - sent) * 1000)
+        await self._emit('ack', {'id': event['id']})
+
+    async def connect(self, url: str) -> None:
+        await self.sio.connect(url, transports=['websocket'])
+        await self.sio.emit('introduce', {'name': f'healthy-{self.index}', 'type': 'pc'})
+
+
+class SlowClient:
+    """Speaks engine.io/socket.io over a websocket it reads at a limited rate."""
+    def __init__(self, kbps: float) -> None:
+        self.bytes_per_second = kbps * 1024
+        self.events = 0
+        self.snapshots = 0
+        self.disconnected_at: Optional[float] = None
+
+    @staticmethod
+    def _socket_factory(addr_info) -> socket.socket:
+        family, socket_type, proto, _, _ = addr_info
+        sock = socket.socket(family, socket_type, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_RECEIVE_BUFFER)
+        return sock
+
+    async def run(self, url: str, until: float) -> None:
+        connector = aiohttp.TCPConnector(socket_factory=self._socket_factory)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            ws_url = url.replace('http', 'ws', 1) + '/socket.io/?EIO=4&transport=websocket'
+            async with session.ws_connect(ws_url, max_msg_size=0) as ws:
+                await ws.receive()
+                await ws.send_str('40')
+                await ws.receive()
+                await ws.send_str('42' + json.dumps(['introduce', {'name': 'slow', 'type': 'ha'}]))
+                while time.monotonic() < until:
+                    try:
+                        message = await asyncio.wait_for(ws.receive(), max(until - time.monotonic(), .01))
+                    except asyncio.TimeoutError:
+                        break
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        self.disconnected_at = time.monotonic()
+                        break
+                    await asyncio.sleep(len(message.data) / self.bytes_per_second)
+                    await self._handle(ws, message.data)
+
+    async def _handle(self, ws: aiohttp.ClientWebSocketResponse, data: str) -> None:
+        if data == '2':
+            await ws.send_str('3')
+        elif data.startswith('41'):
+            self.disconnected_at = time.monotonic()
+        elif data.startswith('42'):
+            name, *args = json.loads(data[2:])
+            if name == 'ping':
+                await ws.send_str('42["pong"]')
+            elif name == 'event':
+                self.events += 1
+                await ws.send_str('42' + json.dumps(['ack', {'id': args[0]['event']['id']}]))
+            elif name == 'get_result':
+                self.snapshots += 1
+
+
+async def inject(url: str, rate: float, payload_kb: int, until: float) -> int:
+    sio = socketio.AsyncClient(reconnection=False)
+
+    @sio.on('ping')
+    async def handle_ping(data=None) -> None:
+        await sio.emit('pong')
+
+    await sio.connect(url, transports=['websocket'])
+    await sio.emit('introduce', {'name': 'injector', 'type': 'pc'})
+    await sio.emit('set_armed', {'armed': True})
+    blob = 'x' * (payload_kb * 1024)
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() < until:
+        await asyncio.sleep(max(start + sent / rate - time.monotonic(), 0))
+        await sio.emit('event', {
+            'id': str(uuid.uuid4()),
+            'event': 'load',
+            'type': 'user',
+            'source': 'injector',
+            'data': {'sent': time.monotonic(), 'blob': blob}
+        })
+        sent += 1
+    await sio.disconnect()
+    return sent
+
+
+async def sample(url: str, server_pid: int, until: float) -> dict:
+    """Peak outbound queue and RSS, and the final outbound actions, from the metrics endpoint."""
+    peak_queue = 0
+    peak_rss = 0.
+    actions = {}
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < until:
+            async with session.get(f'{url}/api/v1/metrics') as response:
+                for line in (await response.text()).splitlines():
+                    if line.startswith('ice_client_outbound_queue_max '):
+                        peak_queue = max(peak_queue, int(float(line.rsplit(' ', 1)[1])))
+                    elif line.startswith('ice_outbound_actions_total{'):
+                        action = line.split('"')[1]
+                        actions[action] = int(float(line.rsplit(' ', 1)[1]))
+            peak_rss = max(peak_rss, sample_server(server_pid)[1])
+            await asyncio.sleep(SAMPLE_INTERVAL)
+    return {'peak_queue': peak_queue, 'peak_rss': peak_rss, 'actions': actions}
+
+
+async def run_setting(args: argparse.Namespace, name: str, max_queue: int, disconnect_queue: int, policy: str) -> None:
+    command = [sys.executable, '-m', 'benchmarks.bench_slow_consumer', '--serve', str(args.port),
+               str(max_queue), str(disconnect_queue), policy]
+    server = subprocess.Popen(command)
+    url = f'http://127.0.0.1:{args.port}'
+    healthy = [HealthyClient(index) for index in range(args.healthy)]
+    try:
+        await wait_for_server(url)
+        for client in healthy:
+            await client.connect(url)
+        slow = SlowClient(args.slow_kbps)
+        start = time.monotonic()
+        until = start + args.duration
+        sent, _, usage = await asyncio.gather(
+            inject(url, args.event_rate, args.payload_kb, until),
+            slow.run(url, until + 1),
+            sample(url, server.pid, until + 1)
+        )
+    finally:
+        for client in healthy:
+            await client.sio.disconnect()
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(value for client in healthy for value in client.latencies)
+    dropped = f'{slow.disconnected_at - start:4.1f} s' if slow.disconnected_at is not None else '   -  '
+    print(f'{name:<11} healthy p50 {statistics.median(latencies):6.1f} ms  p99 {latencies[int(len(latencies) * .99)]:6.1f} ms  '
+          f'slow: events {slow.events:3}/{sent}  snapshots {slow.snapshots:2}  noticed close at {dropped}  '
+          f'peak queue {usage["peak_queue"]:4}  peak RSS {usage["peak_rss"]:5.1f} MiB  {usage["actions"]}', flush=True)
+
+
+async def run(args: argparse.Namespace) -> None:
+    for setting in SETTINGS:
+        await run_setting(args, *setting)
+
+
+def serve(port: int, max_queue: int, disconnect_queue: int, policy: str) -> None:
+    import os
+    os.environ['HOST'] = '127.0.0.1'
+    os.environ['PORT'] = str(port)
+    os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+    from utils.config import CONFIG
+    CONFIG.outbound_max_queue = max_queue
+    CONFIG.outbound_disconnect_queue = disconnect_queue
+    CONFIG.outbound_policy = policy
+    CONFIG.journal_enabled = False
+    CONFIG.webhook_enabled = False
+    import app
+    asyncio.run(app.main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--healthy', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--event-rate', type=float, default=20)
+    parser.add_argument('--payload-kb', type=int, default=64)
+    parser.add_argument('--slow-kbps', type=float, default=64)
+    parser.add_argument('--port', type=int, default=28183)
+    parser.add_argument('--serve', nargs=4, metavar=('PORT', 'MAX_QUEUE', 'DISCONNECT_QUEUE', 'POLICY'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        port, max_queue, disconnect_queue, policy = args.serve
+        serve(int(port), int(max_queue), int(disconnect_queue), policy)
+        return
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Cost of building and encoding a `get_result` snapshot versus buffered events.
+
+Compares the previous path, which rebuilt every event dict (timestamp
+`isoformat()` included) and encoded the whole payload for each snapshot,
+with cached per-event JSON spliced in by `utils.wire`. Both are encoded
+the way socket.io encodes an emitted packet. Run from the repository root:
+
+    python -m benchmarks.bench_snapshot [--clients N]
+"""
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Callable
+
+from engineio import json as engineio_json
+from socketio import packet
+
+from objects.clients import Clients
+from objects.event import Event
+from utils import wire
+
+EVENT_COUNTS = (10, 100, 1000, 10_000)
+
+
+class LegacyPacket(packet.Packet):
+    json = engineio_json
+
+
+class WirePacket(packet.Packet):
+    json = wire
+
+
+def legacy_event_dict(event: Event) -> dict:
+    return {
+        'id': str(event.id),
+        'event': event.event,
+        'type': event.type,
+        'source': event.source,
+        'data': event.data,
+        'timestamp': event.timestamp.isoformat()
+    }
+
+
+async def make_clients(client_count: int, event_count: int) -> Clients:
+    clients = Clients()
+    for index in range(client_count):
+        await clients.add_client(f'sid{index}')
+        await clients.update_client(f'sid{index}', f'client{index}', 'browser')
+    for index in range(event_count):
+        event = Event(str(uuid.uuid4()), 'motion', 'onvif', 'server', {'camera': f'cam{index % 8}', 'topic': 'tns1:VideoSource/MotionAlarm'})
+        await clients.add_event(event)
+    return clients
+
+
+async def timed(label: str, func: Callable, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'  {label:<30} {elapsed * 1e6:>12.1f} us')
+    return elapsed
+
+
+async def run(args: argparse.Namespace) -> None:
+    for event_count in EVENT_COUNTS:
+        clients = await make_clients(args.clients, event_count)
+        repeat = max(10, 20_000 // event_count)
+        print(f'{event_count} buffered events, {args.clients} clients')
+
+        async def legacy():
+            payload = {
+                'isArmed': True,
+                'clientList': await clients.get_client_list(True),
+                'eventList': [legacy_event_dict(event) for event in await clients.get_event_list('sid0', False)],
+                'rev': 1
+            }
+            LegacyPacket(packet.EVENT, data=['get_result', payload]).encode()
+
+        async def cached():
+            payload = {
+                'isArmed': True,
+                'clientList': await clients.get_encoded_client_list(),
+                'eventList': [event.to_json() for event in await clients.get_event_list('sid0', False)],
+                'rev': 1
+            }
+            WirePacket(packet.EVENT, data=['get_result', payload]).encode()
+
+        await cached()
+        before = await timed('previous (rebuild + encode)', legacy, repeat)
+        after = await timed('cached event JSON', cached, repeat)
+        print(f'  {"speedup":<30} {before / after:>12.1f} x')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    args = parser.parse_args()
+    print(f'orjson: {"yes" if wire.orjson is not None else "no"}')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
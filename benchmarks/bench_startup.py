@@ -0,0 +1,66 @@
+"""
+Time from launching the server to its first accepted socket.
+
+Starts `app.py` `--runs` times and, from the moment the process is
+spawned, polls its port until a TCP connection is accepted and then the
+health endpoint until it answers. Reports the median and slowest of both.
+Run from the repository root:
+
+    python -m benchmarks.bench_startup [--runs N] [--port P]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from typing import Tuple
+
+POLL_INTERVAL = .002
+STARTUP_TIMEOUT = 30
+
+
+def measure(port: int) -> Tuple[float, float]:
+    env = dict(os.environ, HOST='127.0.0.1', PORT=str(port), LOG_LEVEL='WARNING')
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, 'app.py'], env=env, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + STARTUP_TIMEOUT
+        accepted = None
+        while accepted is None:
+            if time.perf_counter() > deadline:
+                raise TimeoutError('server did not start')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                accepted = time.perf_counter() - start
+            except OSError:
+                time.sleep(POLL_INTERVAL)
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/v1/health', timeout=1):
+                    return accepted, time.perf_counter() - start
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(POLL_INTERVAL)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--port', type=int, default=28184)
+    args = parser.parse_args()
+
+    results = [measure(args.port) for _ in range(args.runs)]
+    for index, label in enumerate(('first accepted socket', 'first health response')):
+        times = [result[index] * 1000 for result in results]
+        print(f'{label:<22} median {statistics.median(times):7.1f} ms  max {max(times):7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
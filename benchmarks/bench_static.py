@@ -0,0 +1,133 @@
+"""
+Bytes and server time for kiosks loading the session page.
+
+Drives the previous handler (Starlette's StaticFiles) and StaticAssets
+in-process, the way a browser loads `/session/`: the page, then the assets
+it references, recursively. A cold load fetches everything. A reload
+revalidates what the browser must: every URL with the previous handler,
+only the page with StaticAssets, whose fingerprinted assets are immutable.
+Run from the repository root:
+
+    python -m benchmarks.bench_static [--kiosks N]
+"""
+import re
+import gzip
+import time
+import asyncio
+import argparse
+from typing import Callable, Dict, List, Tuple
+
+from starlette.staticfiles import StaticFiles
+
+from utils.static_assets import StaticAssets, brotli
+
+PAGE = '/session/'
+ACCEPT_ENCODING = 'gzip, deflate, br'
+ASSET_URL_PATTERN = re.compile(r'/static/[\w./-]+(?:\?v=[\w.-]*)?')
+DECODERS = {'gzip': gzip.decompress}
+if brotli is not None:
+    DECODERS['br'] = brotli.decompress
+
+
+async def request(app: Callable, url: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('127.0.0.1', 80)
+    }
+    response = {'headers': {}, 'body': b''}
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # File responses listen for the client going away until they are sent
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+            if not message.get('more_body', False):
+                done.set()
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], response['body']
+
+
+async def load(app: Callable, cache: Dict[str, Tuple[str, bytes]], revalidate: Callable[[str], bool]) -> Tuple[int, int, float]:
+    """
+    Loads the page with the browser cache `cache` (URL -> ETag and decoded
+    body), returns the requests made, the bytes received and the server time.
+    """
+    requests = 0
+    received = 0
+    elapsed = 0.
+    queue = [PAGE]
+    seen = set(queue)
+    while queue:
+        url = queue.pop(0)
+        headers = {'accept-encoding': ACCEPT_ENCODING}
+        if url in cache and revalidate(url):
+            headers['if-none-match'] = cache[url][0]
+        if url not in cache or 'if-none-match' in headers:
+            start = time.perf_counter()
+            status, response_headers, body = await request(app, url, headers)
+            elapsed += time.perf_counter() - start
+            requests += 1
+            received += len(body) + sum(len(name) + len(value) + 4 for name, value in response_headers.items())
+            if status == 200:
+                text = DECODERS.get(response_headers.get('content-encoding'), bytes)(body)
+                cache[url] = (response_headers.get('etag', ''), text)
+        if url.split('?', 1)[0].endswith(('/', '.html', '.css', '.js')) and url in cache:
+            for asset_url in ASSET_URL_PATTERN.findall(cache[url][1].decode('utf-8')):
+                if asset_url not in seen:
+                    seen.add(asset_url)
+                    queue.append(asset_url)
+    return requests, received, elapsed
+
+
+async def run(args: argparse.Namespace) -> None:
+    static_assets = StaticAssets('static')
+    await static_assets.compress()
+    handlers: List[Tuple[str, Callable, Callable[[str], bool]]] = [
+        ('StaticFiles', StaticFiles(directory='static', html=True), lambda url: True),
+        ('StaticAssets', static_assets, lambda url: url == PAGE)
+    ]
+    print(f'{args.kiosks} kiosks loading {PAGE}')
+    for name, app, revalidate in handlers:
+        cache: Dict[str, Tuple[str, bytes]] = {}
+        for label in ('cold load', 'reload'):
+            totals = [0, 0, 0.]
+            for _ in range(args.kiosks):
+                requests, received, elapsed = await load(app, dict(cache), revalidate)
+                totals = [totals[0] + requests, totals[1] + received, totals[2] + elapsed]
+            if label == 'cold load':
+                await load(app, cache, revalidate)
+            print(f'  {name:<13} {label:<10} {totals[0]:>6} requests  {totals[1] / 1024:>9.1f} KiB  '
+                  f'{totals[2] * 1000:>8.1f} ms server time')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kiosks', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares the compiled webhook template render plan with the previous
+`recursive_replace` walk, for the sample config payload and a larger
+payload that is mostly constant.
+
+    python -m benchmarks.bench_template
+"""
+import uuid
+import timeit
+import datetime
+
+from utils.config import WEBHOOK_PLACEHOLDERS
+from utils.template_replacer import compile_template
+
+ITERATIONS = 20_000
+
+SAMPLE_TEMPLATE = {
+    'id': '$event_id',
+    'name': 'name: $event_name',
+    'type': 'type: $event_type',
+    'source': '$event_source',
+    'data': '$event_data',
+    'timestamp': 'timestamp: $event_timestamp'
+}
+
+LARGE_TEMPLATE = {
+    'title': 'ICE alarm $event_name from $event_source at $event_timestamp',
+    'event': SAMPLE_TEMPLATE,
+    'static': {
+        f'section_{i}': {'enabled': True, 'labels': [f'label_{j}' for j in range(10)], 'text': 'no placeholders here'}
+        for i in range(20)
+    }
+}
+
+
+def recursive_replace(value: dict, replacements: dict) -> dict:
+    """The previous per-call walk, kept as the baseline."""
+    # If the value is a dictionary, recurse through its items.
+    if isinstance(value, dict):
+        return {k: recursive_replace(v, replacements) for k, v in value.items()}
+
+    # If the value is a list, recurse through its items.
+    elif isinstance(value, list):
+        return [recursive_replace(item, replacements) for item in value]
+
+    # If the value is a string, check for replacements.
+    elif isinstance(value, str):
+        # Exact match replacement (e.g., "$dict_value" -> {"new": "dict"})
+        if value in replacements:
+            return replacements[value]
+
+        # Substring replacement (e.g., "prefix_$string_value" -> "prefix_10:00")
+        for old_template, new_value in replacements.items():
+            if isinstance(new_value, str) and old_template in value:
+                return value.replace(old_template, new_value)
+
+    # Return the value as is if no replacement is needed.
+    return value
+
+
+def replacements() -> dict:
+    return {
+        '$event_id': str(uuid.uuid4()),
+        '$event_name': 'motion',
+        '$event_type': 'onvif',
+        '$event_source': 'server',
+        '$event_data': {'camera': 'front'},
+        '$event_timestamp': datetime.datetime.now().isoformat()
+    }
+
+
+def bench(label: str, template) -> None:
+    replacements_map = replacements()
+    compiled = compile_template(template, WEBHOOK_PLACEHOLDERS)
+
+    recursive = timeit.timeit(lambda: recursive_replace(template, replacements_map), number=ITERATIONS)
+    rendered = timeit.timeit(lambda: compiled.render(replacements_map), number=ITERATIONS)
+    print(f'{label}')
+    print(f'  recursive_replace   {recursive / ITERATIONS * 1e6:>8.2f} us/render')
+    print(f'  compiled render     {rendered / ITERATIONS * 1e6:>8.2f} us/render')
+
+
+def main() -> None:
+    bench('sample config payload', SAMPLE_TEMPLATE)
+    bench('large, mostly constant payload', LARGE_TEMPLATE)
+
+
+if __name__ == '__main__':
+    main()
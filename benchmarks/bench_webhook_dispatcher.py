@@ -0,0 +1,88 @@
+"""
+Fires a motion burst through `WebhookDispatcher` at a local aiohttp
+stand-in receiver that injects latency and 503s, then reports delivery
+counters, requests seen by the receiver and wall time.
+
+    python -m benchmarks.bench_webhook_dispatcher [--events N] [--batch-window S]
+"""
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from utils.webhook_dispatcher import WebhookDispatcher
+
+DRAIN_TIMEOUT = 60
+
+
+class StandInReceiver:
+    def __init__(self, latency: float, fail_every: int) -> None:
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.payloads = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.fail_every and self.requests % self.fail_every == 0:
+            return web.Response(status=503)
+
+        body = await request.json()
+        self.payloads += len(body) if isinstance(body, list) else 1
+        return web.Response(text='ok')
+
+
+async def run(args: argparse.Namespace) -> None:
+    receiver = StandInReceiver(args.latency, args.fail_every)
+    server_app = web.Application()
+    server_app.router.add_post('/hook', receiver.handle)
+    runner = web.AppRunner(server_app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    dispatcher = WebhookDispatcher(
+        f'http://127.0.0.1:{port}/hook',
+        'POST',
+        workers=args.workers,
+        queue_size=args.queue_size,
+        timeout=1,
+        retries=3,
+        backoff=.01,
+        batch_window=args.batch_window
+    )
+    await dispatcher.start()
+
+    start = time.perf_counter()
+    for i in range(args.events):
+        dispatcher.submit({'json': {'id': i, 'name': 'motion'}})
+    # Delivers everything queued, then stops the workers
+    await dispatcher.close(DRAIN_TIMEOUT)
+    elapsed = time.perf_counter() - start
+
+    await runner.cleanup()
+
+    print(f'events submitted      {args.events}')
+    print(f'receiver requests     {receiver.requests}')
+    print(f'receiver payloads     {receiver.payloads}')
+    for name, value in dispatcher.metrics.items():
+        print(f'{name:<21} {value}')
+    print(f'elapsed               {elapsed * 1000:.1f} ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=1000)
+    parser.add_argument('--batch-window', type=float, default=0)
+    parser.add_argument('--latency', type=float, default=.005)
+    parser.add_argument('--fail-every', type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
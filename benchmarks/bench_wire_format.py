@@ -0,0 +1,90 @@
+"""
+Payload size, server encode time and client decode time per wire format.
+
+Encodes an `event` broadcast, a client `delta` (nothing cached to splice)
+and `get_result` snapshots of growing size the way each socket.io server
+does (JSON with the cached event JSON spliced in, or msgpack), then
+decodes them the way a client would. Needs msgpack installed. Run from
+the repository root:
+
+    python -m benchmarks.bench_wire_format [--clients N]
+"""
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Callable
+
+import msgpack
+from socketio import packet
+
+from objects.clients import Clients
+from objects.event import Event
+from utils import wire
+
+EVENT_COUNTS = (1, 10, 100, 1000)
+
+
+class JSONPacket(packet.Packet):
+    json = wire
+
+
+MsgPackPacket = wire.msgpack_packet_class()
+
+
+def timed(func: Callable, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def compare(label: str, data: list, repeat: int) -> None:
+    print(label)
+    for name, packet_class, loads in (
+        ('json', JSONPacket, lambda encoded: json.loads(encoded[1:])),
+        ('msgpack', MsgPackPacket, msgpack.loads)
+    ):
+        encoded = packet_class(packet.EVENT, data=data).encode()
+        size = len(encoded.encode('utf-8')) if isinstance(encoded, str) else len(encoded)
+        encode_time = timed(lambda: packet_class(packet.EVENT, data=data).encode(), repeat)
+        decode_time = timed(lambda: loads(encoded), repeat)
+        print(f'  {name:<8} {size:>10} bytes  encode {encode_time * 1e6:>9.1f} us  decode {decode_time * 1e6:>9.1f} us')
+
+
+async def run(args: argparse.Namespace) -> None:
+    clients = Clients()
+    for index in range(args.clients):
+        await clients.add_client(f'sid{index}')
+        await clients.update_client(f'sid{index}', f'client{index}', 'pc')
+
+    for event_count in EVENT_COUNTS:
+        while len(await clients.get_event_list('sid0', False)) < event_count:
+            event = Event(uuid.uuid4(), 'motion', 'onvif', 'server', {'camera': 'cam0', 'topic': 'tns1:VideoSource/MotionAlarm'})
+            await clients.add_event(event)
+        events = await clients.get_event_list('sid0', False)
+        repeat = max(20, 20_000 // event_count)
+
+        if event_count == 1:
+            compare('event broadcast', ['event', {'event': events[0].to_json()}], repeat)
+            client = await clients.get_client('sid0')
+            compare('client delta', ['delta', {'clientUpdated': client.to_dict(json_friendly=True), 'rev': 1}], repeat)
+        snapshot = {
+            'isArmed': True,
+            'clientList': await clients.get_encoded_client_list(),
+            'eventList': [event.to_json() for event in events],
+            'rev': 1
+        }
+        compare(f'get_result, {event_count} events, {args.clients} clients', ['get_result', snapshot], repeat)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
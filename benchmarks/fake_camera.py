@@ -0,0 +1,408 @@
+"""
+Local stand-in for an ONVIF camera with a PullPoint event service.
+
+Speaks just enough SOAP over HTTP for `onvif-zeep-async`: GetServices and
+GetCapabilities on the device service, CreatePullPointSubscription on the
+event service, and PullMessages / Renew / Unsubscribe /
+SetSynchronizationPoint on each subscription. Motion is raised by calling
+`trigger()` or at a fixed `motion_rate` (events per second). Every request
+is answered after `latency` seconds (plus up to `jitter`), like a slow
+embedded web server. Subscriptions expire `subscription_time` seconds
+after their creation or last Renew, and PullMessages reports their real
+termination time. Stopping the camera drops its subscriptions, as a
+reboot would.
+
+Failures are injected with `inject()`: a SOAP fault, an HTTP error, a
+request that hangs before it's answered, or a connection reset, for some
+or all actions. A script replays timed steps, e.g.
+
+    [
+        {"at": 0, "motionRate": 2},
+        {"at": 5, "latency": 0.2, "jitter": 0.1},
+        {"at": 10, "fault": {"action": "PullMessages", "kind": "timeout", "duration": 30}},
+        {"at": 20, "reboot": 3},
+        {"at": 30, "trigger": true}
+    ]
+
+    python -m benchmarks.fake_camera [--port N] [--motion-rate R] [--latency S] [--subscription-time S] [--script FILE]
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import itertools
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+NAMESPACES = (
+    'xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:tds="http://www.onvif.org/ver10/device/wsdl" '
+    'xmlns:tev="http://www.onvif.org/ver10/events/wsdl" '
+    'xmlns:tt="http://www.onvif.org/ver10/schema" '
+    'xmlns:wsnt="http://docs.oasis-open.org/wsn/b-2" '
+    'xmlns:wsa="http://www.w3.org/2005/08/addressing" '
+    'xmlns:tns1="http://www.onvif.org/ver10/topics"'
+)
+MOTION_TOPIC = 'tns1:RuleEngine/CellMotionDetector/Motion'
+BODY_PATTERN = re.compile(rb'<(?:[\w-]+:)?Body[^>]*>\s*<(?:[\w-]+:)?(\w+)')
+DURATION_PATTERN = re.compile(r'PT(?:(\d+)M)?(?:([\d.]+)S)?')
+TIMEOUT_PATTERN = re.compile(rb'<(?:[\w-]+:)?Timeout>([^<]+)<')
+DEFAULT_TERMINATION = datetime.timedelta(minutes=10)
+FAULT_KINDS = ('fault', 'http_error', 'timeout', 'reset')
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _isoformat(value: datetime.datetime) -> str:
+    return value.isoformat(timespec='seconds').replace('+00:00', 'Z')
+
+
+def _parse_duration(value: str, default: float) -> float:
+    match = DURATION_PATTERN.fullmatch(value.strip())
+    if not match:
+        return default
+    return int(match.group(1) or 0) * 60 + float(match.group(2) or 0)
+
+
+def envelope(body: str) -> str:
+    return f'<?xml version="1.0" encoding="UTF-8"?><s:Envelope {NAMESPACES}><s:Body>{body}</s:Body></s:Envelope>'
+
+
+def notification(topic: str, value: bool, name: str = 'IsMotion') -> str:
+    return (
+        '<wsnt:NotificationMessage>'
+        f'<wsnt:Topic Dialect="http://www.onvif.org/ver10/tev/topicExpression/ConcreteSet">{topic}</wsnt:Topic>'
+        '<wsnt:Message>'
+        f'<tt:Message UtcTime="{_isoformat(_now())}" PropertyOperation="Changed">'
+        '<tt:Source><tt:SimpleItem Name="VideoSourceConfigurationToken" Value="VideoSourceConfig"/></tt:Source>'
+        f'<tt:Data><tt:SimpleItem Name="{name}" Value="{"true" if value else "false"}"/></tt:Data>'
+        '</tt:Message>'
+        '</wsnt:Message>'
+        '</wsnt:NotificationMessage>'
+    )
+
+
+class Subscription:
+    def __init__(self, subscription_id: int, termination: float) -> None:
+        self.id = subscription_id
+        self.termination = termination
+        self.queue: List[str] = []
+        self.wakeup = asyncio.Event()
+
+    def push(self, message: str) -> None:
+        self.queue.append(message)
+        self.wakeup.set()
+
+
+class FaultRule:
+    """
+    Fails requests for `action` ('*' for any): `count` times (None for
+    every request), each with the given probability.
+    """
+    def __init__(self,
+                 action: str = '*',
+                 kind: str = 'fault',
+                 count: Optional[int] = 1,
+                 probability: float = 1,
+                 duration: float = 60) -> None:
+        if kind not in FAULT_KINDS:
+            raise ValueError(f'Unknown fault kind {kind}')
+        self.action = action
+        self.kind = kind
+        self.count = count
+        self.probability = probability
+        # How long a 'timeout' request hangs before it's answered
+        self.duration = duration
+
+    def matches(self, action: str) -> bool:
+        return (self.action in ('*', action) and
+                (self.count is None or self.count > 0) and
+                random.random() < self.probability)
+
+
+class FakeCamera:
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 motion_rate: float = 0,
+                 latency: float = 0,
+                 subscription_time: float = DEFAULT_TERMINATION.total_seconds(),
+                 jitter: float = 0) -> None:
+        self.host = host
+        self.port = port
+        self.motion_rate = motion_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.faults: List[FaultRule] = []
+        self.subscription_time = subscription_time
+        self.subscriptions: Dict[int, Subscription] = {}
+        self.requests: Dict[str, int] = {}
+        # Monotonic time at which each triggered motion was queued, by sequence
+        self.triggered_at: List[float] = []
+        # Monotonic time of every subscription created and every fault injected
+        self.subscribed_at: List[float] = []
+        self.faulted_at: List[float] = []
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self._motion_task: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self) -> None:
+        server_app = web.Application()
+        server_app.router.add_post('/onvif/device_service', self._handle_device)
+        server_app.router.add_post('/onvif/event_service', self._handle_events)
+        server_app.router.add_post('/onvif/subscription/{id}', self._handle_subscription)
+        self._runner = web.AppRunner(server_app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        if self.motion_rate > 0:
+            self._motion_task = asyncio.create_task(self._motion_loop())
+
+    async def stop(self) -> None:
+        if self._motion_task is not None:
+            self._motion_task.cancel()
+        for subscription in self.subscriptions.values():
+            subscription.wakeup.set()
+        self.subscriptions.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def set_motion_rate(self, motion_rate: float) -> None:
+        self.motion_rate = motion_rate
+        if self._motion_task is not None:
+            self._motion_task.cancel()
+            self._motion_task = None
+        if motion_rate > 0 and self._runner is not None:
+            self._motion_task = asyncio.create_task(self._motion_loop())
+
+    def inject(self, action: str = '*', kind: str = 'fault', count: Optional[int] = 1,
+               probability: float = 1, duration: float = 60) -> FaultRule:
+        rule = FaultRule(action, kind, count, probability, duration)
+        self.faults.append(rule)
+        return rule
+
+    def clear_faults(self) -> None:
+        self.faults.clear()
+
+    async def reboot(self, downtime: float = 1) -> None:
+        """Goes offline for `downtime` seconds and comes back on the same port without subscriptions."""
+        await self.stop()
+        await asyncio.sleep(downtime)
+        await self.start()
+
+    async def run_script(self, steps: List[dict]) -> None:
+        """Replays timed steps, `at` is in seconds from the start of the script."""
+        start = time.monotonic()
+        for step in sorted(steps, key=lambda step: step.get('at', 0)):
+            await asyncio.sleep(max(start + step.get('at', 0) - time.monotonic(), 0))
+            if 'motionRate' in step:
+                self.set_motion_rate(float(step['motionRate']))
+            if 'latency' in step:
+                self.latency = float(step['latency'])
+            if 'jitter' in step:
+                self.jitter = float(step['jitter'])
+            if 'fault' in step:
+                fault = step['fault']
+                self.inject(fault.get('action', '*'), fault.get('kind', 'fault'), fault.get('count', 1),
+                            float(fault.get('probability', 1)), float(fault.get('duration', 60)))
+            if step.get('clearFaults'):
+                self.clear_faults()
+            if step.get('trigger'):
+                self.trigger(step['trigger'] is True or step['trigger'] == 'true')
+            if 'reboot' in step:
+                await self.reboot(float(step['reboot']))
+
+    def trigger(self, value: bool = True) -> None:
+        self.triggered_at.append(time.monotonic())
+        message = notification(MOTION_TOPIC, value)
+        for subscription in self.subscriptions.values():
+            subscription.push(message)
+
+    async def _motion_loop(self) -> None:
+        while True:
+            await asyncio.sleep(1 / self.motion_rate)
+            self.trigger()
+
+    def _count(self, action: str) -> None:
+        self.requests[action] = self.requests.get(action, 0) + 1
+
+    @staticmethod
+    def _reply(body: str) -> web.Response:
+        return web.Response(text=envelope(body), content_type='application/soap+xml')
+
+    @staticmethod
+    def _fault_body(reason: str) -> str:
+        return envelope(
+            '<s:Fault><s:Code><s:Value>s:Receiver</s:Value></s:Code>'
+            f'<s:Reason><s:Text xml:lang="en">{reason}</s:Text></s:Reason></s:Fault>'
+        )
+
+    def _fault(self, reason: str, status: int = 500) -> web.Response:
+        return web.Response(text=self._fault_body(reason), status=status, content_type='application/soap+xml')
+
+    async def _action(self, request: web.Request) -> tuple:
+        body = await request.read()
+        match = BODY_PATTERN.search(body)
+        action = match.group(1).decode() if match else ''
+        self._count(action)
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        for rule in self.faults:
+            if rule.matches(action):
+                if rule.count is not None:
+                    rule.count -= 1
+                self.faulted_at.append(time.monotonic())
+                await self._fail(request, rule)
+                break
+        return action, body
+
+    async def _fail(self, request: web.Request, rule: FaultRule) -> None:
+        if rule.kind == 'timeout':
+            # Hangs, then answers normally unless the client gave up
+            await asyncio.sleep(rule.duration)
+            return
+        if rule.kind == 'reset':
+            request.transport.close()
+            raise web.HTTPInternalServerError()
+        if rule.kind == 'http_error':
+            raise web.HTTPServiceUnavailable()
+        raise web.HTTPInternalServerError(text=self._fault_body('Injected fault'), content_type='application/soap+xml')
+
+    async def _handle_device(self, request: web.Request) -> web.Response:
+        action, _ = await self._action(request)
+        if action == 'GetServices':
+            return self._reply(
+                '<tds:GetServicesResponse>'
+                '<tds:Service><tds:Namespace>http://www.onvif.org/ver10/device/wsdl</tds:Namespace>'
+                f'<tds:XAddr>{self.base_url}/onvif/device_service</tds:XAddr>'
+                '<tds:Version><tt:Major>2</tt:Major><tt:Minor>60</tt:Minor></tds:Version></tds:Service>'
+                '<tds:Service><tds:Namespace>http://www.onvif.org/ver10/events/wsdl</tds:Namespace>'
+                f'<tds:XAddr>{self.base_url}/onvif/event_service</tds:XAddr>'
+                '<tds:Version><tt:Major>2</tt:Major><tt:Minor>60</tt:Minor></tds:Version></tds:Service>'
+                '</tds:GetServicesResponse>'
+            )
+        if action == 'GetCapabilities':
+            return self._reply(
+                '<tds:GetCapabilitiesResponse><tds:Capabilities>'
+                f'<tt:Device><tt:XAddr>{self.base_url}/onvif/device_service</tt:XAddr></tt:Device>'
+                f'<tt:Events><tt:XAddr>{self.base_url}/onvif/event_service</tt:XAddr>'
+                '<tt:WSSubscriptionPolicySupport>false</tt:WSSubscriptionPolicySupport>'
+                '<tt:WSPullPointSupport>true</tt:WSPullPointSupport>'
+                '<tt:WSPausableSubscriptionManagerInterfaceSupport>false</tt:WSPausableSubscriptionManagerInterfaceSupport>'
+                '</tt:Events>'
+                '</tds:Capabilities></tds:GetCapabilitiesResponse>'
+            )
+        if action == 'GetSystemDateAndTime':
+            now = _now()
+            return self._reply(
+                '<tds:GetSystemDateAndTimeResponse><tds:SystemDateAndTime>'
+                '<tt:DateTimeType>NTP</tt:DateTimeType><tt:DaylightSavings>false</tt:DaylightSavings>'
+                '<tt:UTCDateTime>'
+                f'<tt:Time><tt:Hour>{now.hour}</tt:Hour><tt:Minute>{now.minute}</tt:Minute><tt:Second>{now.second}</tt:Second></tt:Time>'
+                f'<tt:Date><tt:Year>{now.year}</tt:Year><tt:Month>{now.month}</tt:Month><tt:Day>{now.day}</tt:Day></tt:Date>'
+                '</tt:UTCDateTime>'
+                '</tds:SystemDateAndTime></tds:GetSystemDateAndTimeResponse>'
+            )
+        return self._fault(f'Unsupported action {action}')
+
+    async def _handle_events(self, request: web.Request) -> web.Response:
+        action, _ = await self._action(request)
+        if action == 'CreatePullPointSubscription':
+            subscription = Subscription(next(self._ids), time.monotonic() + self.subscription_time)
+            self.subscriptions[subscription.id] = subscription
+            self.subscribed_at.append(time.monotonic())
+            now = _now()
+            return self._reply(
+                '<tev:CreatePullPointSubscriptionResponse>'
+                f'<tev:SubscriptionReference><wsa:Address>{self.base_url}/onvif/subscription/{subscription.id}</wsa:Address></tev:SubscriptionReference>'
+                f'<wsnt:CurrentTime>{_isoformat(now)}</wsnt:CurrentTime>'
+                f'<wsnt:TerminationTime>{_isoformat(now + datetime.timedelta(seconds=self.subscription_time))}</wsnt:TerminationTime>'
+                '</tev:CreatePullPointSubscriptionResponse>'
+            )
+        return self._fault(f'Unsupported action {action}')
+
+    async def _handle_subscription(self, request: web.Request) -> web.Response:
+        action, body = await self._action(request)
+        subscription = self.subscriptions.get(int(request.match_info['id']))
+        if subscription is not None and subscription.termination <= time.monotonic():
+            del self.subscriptions[subscription.id]
+            subscription = None
+        if subscription is None:
+            return self._fault('Unknown subscription')
+
+        now = _now()
+        termination = now + datetime.timedelta(seconds=subscription.termination - time.monotonic())
+        if action == 'PullMessages':
+            match = TIMEOUT_PATTERN.search(body)
+            timeout = _parse_duration(match.group(1).decode(), 1) if match else 1
+            timeout = min(timeout, subscription.termination - time.monotonic())
+            if not subscription.queue:
+                subscription.wakeup.clear()
+                try:
+                    await asyncio.wait_for(subscription.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            messages, subscription.queue = subscription.queue, []
+            return self._reply(
+                '<tev:PullMessagesResponse>'
+                f'<tev:CurrentTime>{_isoformat(now)}</tev:CurrentTime>'
+                f'<tev:TerminationTime>{_isoformat(termination)}</tev:TerminationTime>'
+                f'{"".join(messages)}'
+                '</tev:PullMessagesResponse>'
+            )
+        if action == 'Renew':
+            subscription.termination = time.monotonic() + self.subscription_time
+            return self._reply(
+                '<wsnt:RenewResponse>'
+                f'<wsnt:TerminationTime>{_isoformat(now + datetime.timedelta(seconds=self.subscription_time))}</wsnt:TerminationTime>'
+                f'<wsnt:CurrentTime>{_isoformat(now)}</wsnt:CurrentTime>'
+                '</wsnt:RenewResponse>'
+            )
+        if action == 'Unsubscribe':
+            del self.subscriptions[subscription.id]
+            subscription.wakeup.set()
+            return self._reply('<wsnt:UnsubscribeResponse/>')
+        if action == 'SetSynchronizationPoint':
+            return self._reply('<tev:SetSynchronizationPointResponse/>')
+        return self._fault(f'Unsupported action {action}')
+
+
+async def serve(args: argparse.Namespace) -> None:
+    camera = FakeCamera(args.host, args.port, args.motion_rate, args.latency, args.subscription_time)
+    await camera.start()
+    print(f'Fake ONVIF camera listening on {camera.base_url}')
+    try:
+        if args.script is not None:
+            with open(args.script, 'r', encoding='utf-8') as f:
+                await camera.run_script(json.load(f))
+        await asyncio.Event().wait()
+    finally:
+        await camera.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--motion-rate', type=float, default=0, help='motion events per second')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before answering each request')
+    parser.add_argument('--subscription-time', type=float, default=DEFAULT_TERMINATION.total_seconds(),
+                        help='seconds a subscription lives without a Renew')
+    parser.add_argument('--script', help='JSON file with timed steps to replay')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
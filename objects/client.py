@@ -1,45 +1,71 @@
+import time
 import datetime
-import asyncio
-from typing import List
+from typing import Optional, Set
 
-from objects.event import Event
+from objects.subscription import Subscription
 
 class Client:
-    def __init__(self, sid: str) -> None:
-        self._lock = asyncio.Lock()
+    __slots__ = ('sid', 'worker', 'name', 'type', 'subscription', 'cursor', 'acked', 'registered', 'last_seen')
+
+    def __init__(self, sid: str, cursor: int = 0, worker: Optional[str] = None) -> None:
         self.sid: str = sid
+        # Id of the worker whose socket this is, its clients go when it goes
+        self.worker: Optional[str] = worker
         self.name: str | None = None
         self.type: str | None = None
-        self.events: List[Event] = []
-        self.registered: datetime = datetime.datetime.now()
-        self.last_seen: datetime = datetime.datetime.now()
+        self.subscription: Subscription = Subscription()
+        # Every event with seq <= cursor is acked, `acked` holds the ones
+        # acked out of order beyond the cursor.
+        self.cursor: int = cursor
+        self.acked: Set[int] = set()
+        # Wall clock times for display, liveness is tracked on the monotonic clock
+        self.registered: float = time.time()
+        self.last_seen: float = self.registered
 
-    def update(self, client_name: str, client_type: str) -> None:
+    def update(self, client_name: str, client_type: str, subscription: Optional[Subscription] = None) -> None:
         self.name = client_name
         self.type = client_type
+        if subscription is not None:
+            self.subscription = subscription
 
     def update_last_seen(self) -> None:
-        self.last_seen = datetime.datetime.now()
+        self.last_seen = time.time()
+
+    def ack_event(self, seq: int) -> None:
+        if seq <= self.cursor:
+            return
+        self.acked.add(seq)
+        self._advance()
+
+    def is_acked(self, seq: int) -> bool:
+        return seq <= self.cursor or seq in self.acked
 
-    async def add_event(self, event: Event) -> None:
-        async with self._lock:
-            self.events.append(event)
+    def skip_to(self, seq: int) -> None:
+        """Moves the cursor forward to `seq`, e.g. past events that expired."""
+        if seq <= self.cursor:
+            return
+        self.cursor = seq
+        if self.acked:
+            self.acked = {acked_seq for acked_seq in self.acked if acked_seq > seq}
+            self._advance()
 
-    async def ack_event(self, event_id: str) -> None:
-        async with self._lock:
-            new_event_list = [event for event in self.events if str(event.id) != event_id]
-            self.events = new_event_list
+    def reset_cursor(self, seq: int) -> None:
+        self.cursor = seq
+        self.acked.clear()
 
-    async def restore_events(self, event_list: List[Event]) -> None:
-        async with self._lock:
-            self.events = event_list
+    def _advance(self) -> None:
+        while self.cursor + 1 in self.acked:
+            self.cursor += 1
+            self.acked.discard(self.cursor)
 
     def to_dict(self, json_friendly: bool):
+        registered = datetime.datetime.fromtimestamp(self.registered)
+        last_seen = datetime.datetime.fromtimestamp(self.last_seen)
         client_obj = {
             'sid': self.sid,
             'name': self.name,
             'type': self.type,
-            'registered': self.registered.isoformat() if json_friendly else self.registered,
-            'last_seen': self.last_seen.isoformat() if json_friendly else self.last_seen
+            'registered': registered.isoformat() if json_friendly else registered,
+            'last_seen': last_seen.isoformat() if json_friendly else last_seen
         }
-        return client_obj
\ No newline at end of file
+        return client_obj
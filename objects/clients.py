@@ -1,118 +1,408 @@
-import datetime
-import asyncio
-from typing import Dict, List, Optional
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 
 from objects.client import Client
 from objects.event import Event
+from objects.event_store import EventStore
+from objects.subscription import ACCEPTED_ROOM_PREFIX, IGNORED_ROOM_PREFIX, Subscription, event_keys
+from utils.timer_wheel import TimerWheel
+from utils.wire import RawJSON, encode
+from utils.metrics import CLIENTS_CONNECTED, EVENTS_BUFFERED, EVENTS_PENDING, STAGE_LATENCY
+
+if TYPE_CHECKING:
+    from utils.backend import Backend
+    from utils.journal import Journal
 
 CLIENT_REMOVAL_THRESHOLD = 1
 EVENT_REMOVAL_THRESHOLD = 15
+LIVENESS_TICK = .1
 
 class Clients:
-    def __init__(self) -> None:
+    """
+    Connected clients and the shared event log.
+
+    This is one worker's replica. Mutations are published as ops through the
+    cluster backend and applied by `apply` in the same order on every worker
+    (directly, when there is no backend). Applying an op is plain synchronous
+    code that never awaits, so on the event loop each one runs to completion
+    without interleaving and no lock is needed. Client list reads are served
+    from a copy-on-write snapshot that is only rebuilt after the membership
+    or a client's name/type changed.
+
+    Liveness is tracked only for the clients connected to this worker, their
+    owner publishes the removal once they time out. When a worker dies, the
+    hub's `worker_gone` op removes all of its clients at once.
+
+    Each client's subscription is indexed by the socket.io rooms it maps to,
+    so the clients interested in an event are found without visiting the
+    others. Events a client doesn't subscribe to never enter its backlog.
+    """
+    def __init__(self,
+                 client_removal_threshold: float = CLIENT_REMOVAL_THRESHOLD,
+                 event_removal_threshold: float = EVENT_REMOVAL_THRESHOLD,
+                 liveness_tick: float = LIVENESS_TICK,
+                 journal: Optional['Journal'] = None,
+                 backend: Optional['Backend'] = None) -> None:
         self._clients: Dict[str, Client] = {}
-        self._events: List[Event] = []
-        self._lock = asyncio.Lock()
+        self._events = EventStore()
+        # Immutable client list snapshots, dropped whenever clients change
+        self._client_list: Optional[Tuple[Client, ...]] = None
+        self._client_list_json: Optional[Tuple[dict, ...]] = None
+        self._client_list_encoded: Optional[RawJSON] = None
+        self._client_removal_threshold = client_removal_threshold
+        self._event_removal_threshold = event_removal_threshold
+        self._liveness = TimerWheel(liveness_tick)
+        # Subscription room -> sids of the clients in it, across the cluster
+        self._subscribers: Dict[str, Set[str]] = {}
+        self._journal = journal
+        self._backend = backend
+        # Event objects published by this worker, reused when their op comes back
+        self._outgoing_events: Dict[str, Event] = {}
+        # Seqs of buffered events no client has acked yet
+        self._unacked: Set[int] = set()
+        # Events up to this seq were recovered from the journal
+        self._recovered_seq = 0
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def local_count(self) -> int:
+        """Number of clients connected to this worker."""
+        return len(self._liveness)
+
+    def set_thresholds(self, client_removal_threshold: float, event_removal_threshold: float) -> None:
+        """Applies to the next pong and the next expiry check."""
+        self._client_removal_threshold = client_removal_threshold
+        self._event_removal_threshold = event_removal_threshold
+
+    @property
+    def journal(self) -> Optional['Journal']:
+        return self._journal
+
+    def set_journal(self, journal: Optional['Journal']) -> None:
+        """Only the cluster leader writes the journal."""
+        self._journal = journal
+
+    def _invalidate_client_list(self) -> None:
+        self._client_list = None
+        self._client_list_json = None
+        self._client_list_encoded = None
+
+    def _is_local(self, message: dict) -> bool:
+        return self._backend is None or message.get('origin') == self._backend.worker_id
+
+    async def _publish(self, message: dict) -> None:
+        if self._backend is None:
+            await self.apply(message)
+        else:
+            await self._backend.publish(message)
 
     async def add_client(self, sid: str) -> None:
-        async with self._lock:
-            client = Client(sid)
-            self._clients[sid] = client
+        await self._publish({'op': 'client_add', 'sid': sid})
 
     async def remove_client(self, sid: str) -> None:
-        async with self._lock:
-            if sid in self._clients:
-                del self._clients[sid]
+        await self._publish({'op': 'client_remove', 'sid': sid})
 
     async def update_client(self,
                             sid: str,
                             client_name: str,
                             client_type: str,
-                            last_event_id: Optional[str] = None) -> None:
-        async with self._lock:
-            if sid in self._clients:
-                client = self._clients[sid]
-                client.update(client_name, client_type)
-                client.update_last_seen()
-
-                if last_event_id is not None:
-                    new_event_list = []
-                    for event in reversed(self._events):
-                        if str(event.id) != last_event_id:
-                            new_event_list.append(event)
-                        else:
-                            break
-                    await client.restore_events(new_event_list)
+                            last_event_id: Optional[str] = None,
+                            subscription: Optional[Subscription] = None) -> None:
+        await self._publish({
+            'op': 'client_update',
+            'sid': sid,
+            'name': client_name,
+            'type': client_type,
+            'last_event_id': last_event_id,
+            'subscription': subscription.to_dict() if subscription is not None else None
+        })
+
+    async def add_event(self, event: Event) -> None:
+        await self._publish(self.event_op(event))
+
+    async def restore_events(self, events: List[Event], acked_event_ids: Set[str]) -> None:
+        await self._publish({
+            'op': 'events_restore',
+            'events': [event.to_dict(json_friendly=True) for event in events],
+            'acked': sorted(acked_event_ids)
+        })
+
+    async def ack_event(self, sid: str, event_id: str) -> None:
+        if self._events.get(event_id) is None or sid not in self._clients:
+            return
+        await self._publish({'op': 'event_ack', 'sid': sid, 'id': str(event_id)})
+
+    def event_op(self, event: Event) -> dict:
+        """Builds the op that appends `event`, remembering the original object."""
+        self._outgoing_events[event.id] = event
+        return {'op': 'event_add', 'event': event.to_dict(json_friendly=True)}
+
+    async def apply(self, message: dict) -> None:
+        op = message['op']
+        if op == 'client_add':
+            self._apply_client_add(message)
+        elif op == 'client_remove':
+            self._apply_client_remove(message)
+        elif op == 'client_update':
+            self._apply_client_update(message)
+        elif op == 'event_add':
+            self.apply_event(message)
+        elif op == 'event_ack':
+            self._apply_event_ack(message)
+        elif op == 'events_restore':
+            self._apply_events_restore(message)
+        elif op == 'worker_gone':
+            self._apply_worker_gone(message)
+
+    def _apply_client_add(self, message: dict) -> None:
+        sid = message['sid']
+        cursor = self._events.last_seq
+        # Hand alarms recovered from the journal that nobody acked yet
+        # to whoever connects first after a restart.
+        pending_recovered = [seq for seq in self._unacked if seq <= self._recovered_seq]
+        if pending_recovered:
+            cursor = min(pending_recovered) - 1
+        self._clients[sid] = Client(sid, cursor=cursor, worker=message.get('origin'))
+        self._index_subscription(sid, self._clients[sid].subscription)
+        if self._is_local(message):
+            self._liveness.schedule(sid, self._client_removal_threshold)
+        self._invalidate_client_list()
+
+    def _apply_client_remove(self, message: dict) -> None:
+        sid = message['sid']
+        if sid in self._clients:
+            self._unindex_subscription(sid, self._clients[sid].subscription)
+            del self._clients[sid]
+            self._invalidate_client_list()
+        self._liveness.cancel(sid)
+
+    def _apply_worker_gone(self, message: dict) -> None:
+        for sid in self.worker_client_sids(message['worker']):
+            self._apply_client_remove({'sid': sid})
+
+    def worker_client_sids(self, worker_id: str) -> List[str]:
+        """Clients connected to the worker `worker_id`."""
+        return [sid for sid, client in self._clients.items() if client.worker == worker_id]
+
+    def _apply_client_update(self, message: dict) -> None:
+        sid = message['sid']
+        if sid not in self._clients:
+            return
+
+        client = self._clients[sid]
+        subscription = None
+        if message.get('subscription') is not None:
+            subscription = Subscription.from_dict(message['subscription'])
+            self._unindex_subscription(sid, client.subscription)
+            self._index_subscription(sid, subscription)
+        client.update(message['name'], message['type'], subscription)
+        if self._is_local(message):
+            client.update_last_seen()
+            self._liveness.schedule(sid, self._client_removal_threshold)
+        self._invalidate_client_list()
+
+        last_event_id = message.get('last_event_id')
+        if last_event_id is not None:
+            # Replay everything after the last event the client saw,
+            # or the whole buffer if that event already expired.
+            last_event = self._events.get(last_event_id)
+            if last_event is not None:
+                client.reset_cursor(last_event.seq)
+            else:
+                client.reset_cursor(self._events.first_seq - 1)
+
+    def _index_subscription(self, sid: str, subscription: Subscription) -> None:
+        for room in subscription.rooms():
+            self._subscribers.setdefault(room, set()).add(sid)
+
+    def _unindex_subscription(self, sid: str, subscription: Subscription) -> None:
+        for room in subscription.rooms():
+            sids = self._subscribers.get(room)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self._subscribers[room]
+
+    @staticmethod
+    def event_rooms(event_type: str, event_source: str, is_accepted: bool) -> List[str]:
+        """socket.io rooms of the clients subscribed to an event."""
+        prefix = ACCEPTED_ROOM_PREFIX if is_accepted else IGNORED_ROOM_PREFIX
+        return [prefix + key for key in event_keys(event_type, event_source)]
+
+    def local_subscriber_count(self, rooms: List[str]) -> int:
+        """Clients of this worker in `rooms`, which hold each client at most once."""
+        return sum(1 for room in rooms for sid in self._subscribers.get(room, ()) if sid in self._liveness)
+
+    def _has_subscribers(self, event: Event) -> bool:
+        return any(room in self._subscribers for room in self.event_rooms(event.type, event.source, True))
+
+    def _skip_unsubscribed(self, client: Client) -> None:
+        """Moves the cursor of a filtering client past events it doesn't subscribe to."""
+        if client.subscription.is_all:
+            return
+        for event in self._events.events_since(client.cursor):
+            if not client.is_acked(event.seq) and client.subscription.matches(event.type, event.source):
+                break
+            client.ack_event(event.seq)
+
+    def apply_event(self, message: dict) -> Event:
+        event_obj = message['event']
+        event = self._outgoing_events.pop(event_obj['id'], None)
+        if event is None:
+            event = Event.from_dict(event_obj)
+        seq = self._events.append(event)
+        # Events nobody subscribes to have no one to wait for, unless there
+        # is no one at all yet (recovered alarms go to the first client)
+        if not self._clients or self._has_subscribers(event):
+            self._unacked.add(seq)
+        if self._journal is not None:
+            self._journal.record_event(event)
+        return event
+
+    def _apply_event_ack(self, message: dict) -> None:
+        sid, event_id = message['sid'], message['id']
+        event = self._events.get(event_id)
+        if sid not in self._clients or event is None:
+            return
+
+        client = self._clients[sid]
+        client.skip_to(self._events.first_seq - 1)
+        if not client.is_acked(event.seq) and self._is_local(message):
+            STAGE_LATENCY.observe(time.monotonic() - event.received, stage='ack')
+        client.ack_event(event.seq)
+        self._skip_unsubscribed(client)
+
+        if event.seq in self._unacked:
+            self._unacked.discard(event.seq)
+            if self._journal is not None:
+                self._journal.record_ack(event_id)
+
+    def _apply_events_restore(self, message: dict) -> None:
+        acked_event_ids = set(message['acked'])
+        for event_obj in message['events']:
+            event = Event.from_dict(event_obj)
+            seq = self._events.append(event)
+            if event.id not in acked_event_ids:
+                self._unacked.add(seq)
+        self._recovered_seq = self._events.last_seq
+
+    def export_state(self) -> dict:
+        """JSON-friendly copy of the replica, for a worker joining late."""
+        return {
+            'events': [{**event.to_dict(json_friendly=True), 'seq': event.seq} for event in self._events],
+            'next_seq': self._events.last_seq + 1,
+            'unacked': sorted(self._unacked),
+            'recovered_seq': self._recovered_seq,
+            'clients': [{
+                'sid': client.sid,
+                'worker': client.worker,
+                'name': client.name,
+                'type': client.type,
+                'subscription': client.subscription.to_dict(),
+                'cursor': client.cursor,
+                'acked': sorted(client.acked)
+            } for client in self._clients.values()]
+        }
+
+    def import_state(self, exported: dict) -> None:
+        events = []
+        for event_obj in exported['events']:
+            event = Event.from_dict(event_obj)
+            event.seq = event_obj['seq']
+            events.append(event)
+        self._events.load(events, exported['next_seq'])
+        self._unacked = set(exported['unacked'])
+        self._recovered_seq = exported['recovered_seq']
+
+        self._clients = {}
+        self._subscribers = {}
+        for client_obj in exported['clients']:
+            client = Client(client_obj['sid'], cursor=client_obj['cursor'], worker=client_obj.get('worker'))
+            client.update(client_obj['name'], client_obj['type'], Subscription.from_dict(client_obj.get('subscription')))
+            client.acked = set(client_obj['acked'])
+            self._clients[client.sid] = client
+            self._index_subscription(client.sid, client.subscription)
+        self._invalidate_client_list()
+
+    def journal_snapshot(self) -> Tuple[List[Event], Set[str]]:
+        """Buffered events and the ids of those acked by some client."""
+        events = list(self._events)
+        acked_event_ids = {event.id for event in events if event.seq not in self._unacked}
+        return events, acked_event_ids
 
     async def get_client(self, sid: str) -> None:
-        async with self._lock:
-            if sid in self._clients:
-                return self._clients[sid]
+        if sid in self._clients:
+            return self._clients[sid]
 
     async def update_last_seen(self, sid: str) -> None:
-        async with self._lock:
-            if sid in self._clients:
-                self._clients[sid].update_last_seen()
-
-    async def get_client_list(self, json_friendly: bool) -> List[dict]:
-        async with self._lock:
-            client_list = []
-            for client in self._clients.values():
-                if json_friendly:
-                    client_list.append(client.to_dict(json_friendly))
-                else:
-                    client_list.append(client)
-            return client_list
+        if sid in self._clients and sid in self._liveness:
+            self._clients[sid].update_last_seen()
+            self._liveness.schedule(sid, self._client_removal_threshold)
 
-    async def add_event(self, event: Event) -> None:
-        async with self._lock:
-            self._events.append(event)
+    async def get_client_list(self, json_friendly: bool) -> Tuple:
+        """Returns a shared, read-only snapshot of the client list."""
+        if self._client_list is None:
+            self._client_list = tuple(self._clients.values())
+        if not json_friendly:
+            return self._client_list
 
-            for client in self._clients.values():
-                await client.add_event(event)
+        if self._client_list_json is None:
+            self._client_list_json = tuple(client.to_dict(json_friendly) for client in self._client_list)
+        return self._client_list_json
 
-    async def get_event_list(self, sid: str, json_friendly: bool) -> List[dict]:
-        async with self._lock:
-            event_list = []
-            if sid in self._clients:
-                for event in self._clients[sid].events:
-                    if json_friendly:
-                        event_list.append(event.to_dict(json_friendly))
-                    else:
-                        event_list.append(event)
-            return event_list
+    async def get_encoded_client_list(self) -> RawJSON:
+        """The JSON-friendly client list, encoded once per snapshot."""
+        if self._client_list_encoded is None:
+            client_list = await self.get_client_list(True)
+            self._client_list_encoded = RawJSON(encode(client_list), client_list)
+        return self._client_list_encoded
 
-    async def ack_event(self, sid: str, event_id: str) -> None:
-        async with self._lock:
-            if sid in self._clients:
-                await self._clients[sid].ack_event(event_id)
+    async def get_event_list(self, sid: str, json_friendly: bool) -> List[dict]:
+        event_list = []
+        if sid in self._clients:
+            client = self._clients[sid]
+            client.skip_to(self._events.first_seq - 1)
+            self._skip_unsubscribed(client)
+            for event in self._events.events_since(client.cursor):
+                if client.is_acked(event.seq) or not client.subscription.matches(event.type, event.source):
+                    continue
+                if json_friendly:
+                    event_list.append(event.to_dict(json_friendly))
+                else:
+                    event_list.append(event)
+        return event_list
 
     async def clean_client(self) -> List[str]:
-        async with self._lock:
-            time_now = datetime.datetime.now()
-            deleted_client_sids = []
-            for sid in list(self._clients.keys()):
-                client = self._clients[sid]
-                if (time_now - client.last_seen).total_seconds() > CLIENT_REMOVAL_THRESHOLD:
-                    deleted_client_sids.append(sid)
-                    del self._clients[sid]
-            return deleted_client_sids
+        """Returns the local clients that timed out, the caller removes them."""
+        return [sid for sid in self._liveness.expire() if sid in self._clients]
 
     async def clean_event(self) -> None:
-        async with self._lock:
-            for event in self._events:
-                if (datetime.datetime.now() - event.timestamp).total_seconds() > EVENT_REMOVAL_THRESHOLD:
-                    self._events.remove(event)
-                    for client in self._clients.values():
-                        await client.ack_event(str(event.id))
-
-    async def is_previous_event_valid(self, event_event: str) -> bool:
-        async with self._lock:
-            time_now = datetime.datetime.now()
-            for event in reversed(self._events):
-                time_diff = time_now - event.timestamp
-
-                if event.event == event_event and time_diff.total_seconds() < EVENT_REMOVAL_THRESHOLD:
-                    return True
-
-            return False
\ No newline at end of file
+        # Client cursors skip past expired events lazily on their next read
+        for event in self._events.expire(self._event_removal_threshold):
+            self._unacked.discard(event.seq)
+
+    async def is_previous_event_valid(self, event_event: str, event_source: Optional[str] = None) -> bool:
+        return self._events.is_previous_event_valid(event_event,
+                                                    self._event_removal_threshold,
+                                                    event_source=event_source)
+
+    def collect_metrics(self) -> None:
+        CLIENTS_CONNECTED.clear()
+        client_counts: Dict[str, int] = {}
+        pending = 0
+        first_seq, last_seq = self._events.first_seq, self._events.last_seq
+        for client in self._clients.values():
+            client_type = str(client.type)
+            client_counts[client_type] = client_counts.get(client_type, 0) + 1
+            base = max(client.cursor, first_seq - 1)
+            if client.subscription.is_all:
+                pending += max(last_seq - base - sum(1 for seq in client.acked if seq > base), 0)
+            else:
+                pending += sum(1 for event in self._events.events_since(base)
+                               if not client.is_acked(event.seq) and client.subscription.matches(event.type, event.source))
+
+        for client_type, count in client_counts.items():
+            CLIENTS_CONNECTED.set(count, type=client_type)
+        EVENTS_BUFFERED.set(len(self._events))
+        EVENTS_PENDING.set(pending)
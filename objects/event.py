@@ -1,22 +1,60 @@
+import time
 import datetime
-from typing import Union
+from typing import Optional, Union
+
+from utils.wire import RawJSON, encode
 
 class Event:
+    __slots__ = ('id', 'event', 'type', 'source', 'data', 'wall_time', 'received', 'seq', '_wire_dict', '_wire_json')
+
     def __init__(self, event_id: str, event_event: str, event_type: str, event_source: str, event_data: Union[dict, None] = None) -> None:
-        self.id: str = event_id
+        # Ids arrive as UUIDs, strings or numbers, they are keyed by their string form
+        self.id: str = str(event_id)
         self.event: str = event_event
         self.type: str = event_type
         self.source: str = event_source
         self.data: dict = event_data
-        self.timestamp: datetime = datetime.datetime.now()
+        # Wall clock time is only displayed, expiry compares `received`
+        self.wall_time: float = time.time()
+        self.received: float = time.monotonic()
+        self.seq: Optional[int] = None
+        # Wire representation, built on first use and shared by every emit
+        self._wire_dict: Optional[dict] = None
+        self._wire_json: Optional[RawJSON] = None
 
     def to_dict(self, json_friendly: bool) -> dict:
+        """The JSON-friendly dict is cached, callers must not modify it."""
+        if json_friendly and self._wire_dict is not None:
+            return self._wire_dict
         event_obj = {
-            'id': str(self.id) if json_friendly else self.id,
+            'id': self.id,
             'event': self.event,
             'type': self.type,
             'source': self.source,
             'data': self.data,
             'timestamp': self.timestamp.isoformat() if json_friendly else self.timestamp
         }
-        return event_obj
\ No newline at end of file
+        if json_friendly:
+            self._wire_dict = event_obj
+        return event_obj
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.wall_time)
+
+    def to_json(self) -> RawJSON:
+        """Encoded `to_dict(json_friendly=True)`, spliced into socket.io payloads as is."""
+        if self._wire_json is None:
+            event_obj = self.to_dict(json_friendly=True)
+            self._wire_json = RawJSON(encode(event_obj), event_obj)
+        return self._wire_json
+
+    @classmethod
+    def from_dict(cls, event_obj: dict) -> 'Event':
+        """Rebuilds an event from `to_dict(json_friendly=True)` output."""
+        event = cls(event_obj['id'], event_obj['event'], event_obj['type'], event_obj['source'], event_obj.get('data'))
+        event.wall_time = datetime.datetime.fromisoformat(event_obj['timestamp']).timestamp()
+        # Carry the event's age over to this process' monotonic clock
+        age = time.time() - event.wall_time
+        event.received = time.monotonic() - max(age, 0)
+        return event
@@ -0,0 +1,111 @@
+import time
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+from objects.event import Event
+
+# Compact the log once this many expired slots have piled up at its head
+COMPACT_THRESHOLD = 1024
+
+class EventStore:
+    """
+    Shared log of buffered events ordered by arrival time.
+
+    Every appended event is stamped with a monotonically increasing sequence
+    number. The log is a list with a moving head (oldest live event), plus an
+    id index and "last seen" indexes per event name and per (name, source),
+    so validity checks and lookups are O(1), expiry advances the head in
+    amortized O(1) and replay after a sequence number is a bisect.
+    """
+    def __init__(self) -> None:
+        self._events: List[Event] = []
+        self._head = 0
+        self._next_seq = 1
+        self._by_id: Dict[str, Event] = {}
+        self._last_by_name: Dict[str, Event] = {}
+        self._last_by_source: Dict[Tuple[str, str], Event] = {}
+
+    def __len__(self) -> int:
+        return len(self._events) - self._head
+
+    def __iter__(self):
+        for index in range(self._head, len(self._events)):
+            yield self._events[index]
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest buffered event (or the next one if empty)."""
+        if self._head < len(self._events):
+            return self._events[self._head].seq
+        return self._next_seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest event ever appended (0 if none)."""
+        return self._next_seq - 1
+
+    def append(self, event: Event) -> int:
+        event.seq = self._next_seq
+        self._next_seq += 1
+
+        self._events.append(event)
+        self._by_id[event.id] = event
+        self._last_by_name[event.event] = event
+        self._last_by_source[(event.event, event.source)] = event
+        return event.seq
+
+    def load(self, events: List[Event], next_seq: int) -> None:
+        """Replaces the log with `events`, which already carry their sequence numbers."""
+        self._events = list(events)
+        self._head = 0
+        self._next_seq = next_seq
+        self._by_id = {event.id: event for event in self._events}
+        self._last_by_name = {event.event: event for event in self._events}
+        self._last_by_source = {(event.event, event.source): event for event in self._events}
+
+    def get(self, event_id: str) -> Optional[Event]:
+        return self._by_id.get(str(event_id))
+
+    def is_previous_event_valid(self,
+                                event_event: str,
+                                threshold: float,
+                                now: Optional[float] = None,
+                                event_source: Optional[str] = None) -> bool:
+        """Whether an `event_event` event (from `event_source`, if given) arrived within `threshold`."""
+        if event_source is None:
+            last_event = self._last_by_name.get(event_event)
+        else:
+            last_event = self._last_by_source.get((event_event, event_source))
+        if last_event is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - last_event.received < threshold
+
+    def events_since(self, seq: int) -> List[Event]:
+        """Returns buffered events with a sequence number greater than `seq`."""
+        index = bisect.bisect_right(self._events, seq, lo=self._head, key=lambda event: event.seq)
+        return self._events[index:]
+
+    def expire(self, threshold: float, now: Optional[float] = None) -> List[Event]:
+        """Drops and returns every event older than `threshold` seconds."""
+        if now is None:
+            now = time.monotonic()
+
+        expired = []
+        while self._head < len(self._events) and now - self._events[self._head].received > threshold:
+            event = self._events[self._head]
+            self._head += 1
+            if self._by_id.get(event.id) is event:
+                del self._by_id[event.id]
+            if self._last_by_name.get(event.event) is event:
+                del self._last_by_name[event.event]
+            if self._last_by_source.get((event.event, event.source)) is event:
+                del self._last_by_source[(event.event, event.source)]
+            expired.append(event)
+
+        if self._head == len(self._events) or \
+           (self._head >= COMPACT_THRESHOLD and self._head * 2 >= len(self._events)):
+            del self._events[:self._head]
+            self._head = 0
+        return expired
@@ -6,9 +6,11 @@ class ONVIFEvent:
                  topic: str,
                  value: Any | None = None,
                  event_name: str | None = None,
-                 raw_message: Any | None = None):
+                 raw_message: Any | None = None,
+                 active: bool = False):
 
         self.topic = topic
         self.value = value
-        self.event_name = event_name # Custom event name from EVENT_DICT (e.g., 'motion', 'person')
-        self.raw_message = raw_message # The original full message object
\ No newline at end of file
+        self.event_name = event_name # Event name from the topic's config (e.g., 'motion', 'person')
+        self.raw_message = raw_message # The original full message object, only kept when `keepRawMessage` is set
+        self.active = active # Whether `value` is one of the topic's `activeWhen` values
\ No newline at end of file
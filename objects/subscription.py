@@ -0,0 +1,78 @@
+from itertools import product
+from typing import FrozenSet, Optional, Tuple
+
+ALL_KEY = '*'
+ACCEPTED_ROOM_PREFIX = 'events/'
+IGNORED_ROOM_PREFIX = 'ignored/'
+
+def event_keys(event_type: str, event_source: str) -> Tuple[str, str, str, str]:
+    """Filter keys an event is delivered under, a subscription holds exactly one of them."""
+    return (
+        ALL_KEY,
+        f'type:{event_type}',
+        f'source:{event_source}',
+        f'type:{event_type}|source:{event_source}'
+    )
+
+class Subscription:
+    """
+    Event types and sources a client handles, `None` meaning all of them,
+    and whether it wants `event_ignored` notifications.
+
+    Declared in `introduce` as `subscribe: {types, sources, ignored}`.
+    """
+    __slots__ = ('types', 'sources', 'ignored')
+
+    def __init__(self,
+                 types: Optional[FrozenSet[str]] = None,
+                 sources: Optional[FrozenSet[str]] = None,
+                 ignored: bool = True) -> None:
+        self.types = types
+        self.sources = sources
+        self.ignored = ignored
+
+    @classmethod
+    def from_dict(cls, subscription_obj: Optional[dict]) -> 'Subscription':
+        if not isinstance(subscription_obj, dict):
+            return cls()
+
+        def names(key: str) -> Optional[FrozenSet[str]]:
+            value = subscription_obj.get(key)
+            if not isinstance(value, list):
+                return None
+            return frozenset(str(name) for name in value)
+
+        return cls(names('types'), names('sources'), bool(subscription_obj.get('ignored', True)))
+
+    def to_dict(self) -> dict:
+        return {
+            'types': sorted(self.types) if self.types is not None else None,
+            'sources': sorted(self.sources) if self.sources is not None else None,
+            'ignored': self.ignored
+        }
+
+    @property
+    def is_all(self) -> bool:
+        return self.types is None and self.sources is None
+
+    def keys(self) -> Tuple[str, ...]:
+        """Filter keys of the events this subscription matches, see `event_keys`."""
+        if self.types is None and self.sources is None:
+            return (ALL_KEY,)
+        if self.sources is None:
+            return tuple(f'type:{event_type}' for event_type in self.types)
+        if self.types is None:
+            return tuple(f'source:{event_source}' for event_source in self.sources)
+        return tuple(f'type:{event_type}|source:{event_source}'
+                     for event_type, event_source in product(self.types, self.sources))
+
+    def rooms(self) -> Tuple[str, ...]:
+        """socket.io rooms to join for this subscription."""
+        rooms = tuple(ACCEPTED_ROOM_PREFIX + key for key in self.keys())
+        if self.ignored:
+            rooms += tuple(IGNORED_ROOM_PREFIX + key for key in self.keys())
+        return rooms
+
+    def matches(self, event_type: str, event_source: str) -> bool:
+        return ((self.types is None or event_type in self.types) and
+                (self.sources is None or event_source in self.sources))
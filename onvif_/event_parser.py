@@ -1,137 +1,95 @@
 from __future__ import annotations
 import logging
-from typing import Any
+from typing import Any, Callable, Dict, Iterable
 
 from objects.onvif_event import ONVIFEvent
+from utils.config import TopicConfig
 
-# Ensure basic logging is configured if this snippet is run standalone for testing
-# In the full script, this would be set up globally.
 LOGGER = logging.getLogger(__name__)
 
-# --- Custom Parser Definitions ---
-EVENT_DICT = {
-    'tns1:RuleEngine/CellMotionDetector/Motion': {
-        'event': 'motion',
-        'type': 'bool',
-        'value_name': 'IsMotion'
-    },
-    'tns1:RuleEngine/PeopleDetector/People': {
-        'event': 'person',
-        'type': 'bool',
-        'value_name': 'IsPeople'
-    }
-}
+TopicExtractor = Callable[[Any], ONVIFEvent | None]
 
-# --- Unified Event Parser Function ---
-async def parse_event_message(msg: Any) -> ONVIFEvent | None:
-    """
-    Parses a generic ONVIF event message using custom definitions or
-    falls back to extracting all SimpleItem data.
-    """
-    # Check if msg has a valid topic structure before proceeding
-    if not hasattr(msg, 'Topic') or not hasattr(msg.Topic, '_value_1'):
-        LOGGER.debug("Received an event message without a valid topic, skipping.")
-        return None
-
-    topic = msg.Topic._value_1.rstrip("/.")
-    parsed_event_name: str | None = None
-    parsed_value: Any | None = None
-    source_items_parsed: dict[str, str] = {}
-    data_items_parsed: dict[str, str] = {}
-
-    # 1. Extract source data (always try to do this)
-    try:
-        # Check for existence of Message, Source, and SimpleItem before iterating
-        if hasattr(msg, 'Message') and \
-           hasattr(msg.Message, 'Source') and \
-           hasattr(msg.Message.Source, 'SimpleItem') and \
-           msg.Message.Source.SimpleItem is not None: # Ensure SimpleItem is not None
+VALUE_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    'bool': lambda raw_value: raw_value == 'true',
+    'str': str,
+    'int': int,
+    'float': float
+}
 
-            for item in msg.Message.Source.SimpleItem:
-                if hasattr(item, 'Name') and hasattr(item, 'Value'):
-                    source_items_parsed[item.Name] = item.Value
-    except (AttributeError, TypeError, IndexError) as e:
-        LOGGER.debug(f"Error extracting source data for topic {topic}: {e}")
+def _active_values(rule: TopicConfig, convert: Callable[[str], Any]) -> frozenset:
+    values = rule.active_when if isinstance(rule.active_when, list) else [rule.active_when]
+    # Config files may quote values the way the camera sends them
+    return frozenset(convert(value) if isinstance(value, str) else value for value in values)
 
-    # 2. Try to use custom parser definitions from EVENT_DICT
-    if topic in EVENT_DICT:
-        config = EVENT_DICT[topic]
-        parsed_event_name = config['event']
-        target_value_name = config['value_name']
-        value_type = config['type']
+def _compile_extractor(rule: TopicConfig, keep_raw_message: bool) -> TopicExtractor:
+    topic = rule.topic
+    event_name = rule.event
+    value_name = rule.value_name
+    convert = VALUE_CONVERTERS[rule.value_type]
+    active_values = _active_values(rule, convert)
 
+    # zeep objects resolve item access in one lookup, attribute access takes two
+    def extract(msg: Any) -> ONVIFEvent | None:
         try:
-            # Check for existence of Message, _value_1, Data, and SimpleItem before iterating
-            if hasattr(msg, 'Message') and \
-               hasattr(msg.Message, '_value_1') and \
-               hasattr(msg.Message._value_1, 'Data') and \
-               hasattr(msg.Message._value_1.Data, 'SimpleItem') and \
-               msg.Message._value_1.Data.SimpleItem is not None: # Ensure SimpleItem is not None
-
-                # SimpleItem is often a list, so iterate. It could also be a single object.
-                # Convert to a list if it's a single object for consistent iteration.
-                simple_items = msg.Message._value_1.Data.SimpleItem
-                if not isinstance(simple_items, list):
-                    simple_items = [simple_items]
+            simple_items = msg['Message']['_value_1']['Data']['SimpleItem']
+        except (KeyError, TypeError):
+            LOGGER.debug(f"Message for topic {topic} has no data items, skipping.")
+            return None
+        if simple_items is None:
+            return None
+        # SimpleItem is usually a list, but may be a single object
+        if not isinstance(simple_items, list):
+            simple_items = [simple_items]
+
+        for item in simple_items:
+            if item['Name'] == value_name:
+                raw_value = item['Value']
+                try:
+                    value = convert(raw_value)
+                except (TypeError, ValueError):
+                    LOGGER.warning(f"Could not convert '{raw_value}' to {rule.value_type} for topic {topic}.")
+                    return None
+                return ONVIFEvent(
+                    topic=topic,
+                    value=value,
+                    event_name=event_name,
+                    raw_message=msg if keep_raw_message else None,
+                    active=value in active_values
+                )
+
+        LOGGER.debug(f"Message for topic {topic} has no '{value_name}' item, skipping.")
+        return None
 
-                for item in simple_items:
-                    if hasattr(item, 'Name') and item.Name == target_value_name:
-                        raw_value = item.Value
-                        if value_type == 'bool':
-                            parsed_value = (raw_value == 'true')
-                        elif value_type == 'str':
-                            parsed_value = raw_value
-                        elif value_type == 'int':
-                            try:
-                                parsed_value = int(raw_value)
-                            except ValueError:
-                                LOGGER.warning(f"Could not convert '{raw_value}' to int for topic {topic}. Keeping as string.")
-                                parsed_value = raw_value # Fallback to string if conversion fails
-                        # Break after finding the target value name, as we only expect one primary value
-                        break
-        except (AttributeError, TypeError, IndexError) as e:
-            # Log the specific error for custom parsing failure
-            LOGGER.warning(f"Error in custom parsing for topic '{topic}' (target '{target_value_name}'): {e}. Falling back to generic parsing.")
-            parsed_value = None # Reset parsed_value to trigger generic fallback
+    return extract
 
-    # 3. Fallback: If custom parsing didn't find a value or topic not in filter, extract all data items
-    if parsed_value is None: # Only if custom parsing failed or topic was not in EVENT_DICT
+def compile_topic_extractors(rules: Iterable[TopicConfig], keep_raw_message: bool = False) -> Dict[str, TopicExtractor]:
+    """
+    Compiles the configured topic rules into one extractor per topic.
+    Messages on topics without an extractor are not monitored.
+    """
+    extractors = {}
+    for rule in rules:
+        if rule.value_type not in VALUE_CONVERTERS:
+            LOGGER.error(f"Unsupported value type '{rule.value_type}' for topic {rule.topic}, skipping topic.")
+            continue
         try:
-            if hasattr(msg, 'Message') and \
-               hasattr(msg.Message, '_value_1') and \
-               hasattr(msg.Message._value_1, 'Data') and \
-               hasattr(msg.Message._value_1.Data, 'SimpleItem') and \
-               msg.Message._value_1.Data.SimpleItem is not None:
-
-                # Convert to a list if it's a single object for consistent iteration.
-                simple_items_fallback = msg.Message._value_1.Data.SimpleItem
-                if not isinstance(simple_items_fallback, list):
-                    simple_items_fallback = [simple_items_fallback]
+            extractors[rule.topic] = _compile_extractor(rule, keep_raw_message)
+        except (TypeError, ValueError):
+            LOGGER.error(f"Could not convert 'activeWhen' value {rule.active_when!r} to {rule.value_type} for topic {rule.topic}, skipping topic.")
+    return extractors
 
-                for item in simple_items_fallback:
-                    if hasattr(item, 'Name') and hasattr(item, 'Value'):
-                        # Only add items not already processed by a successful custom parser attempt
-                        # (This check is implicitly covered by parsed_value being None,
-                        # but keeping in mind if more complex logic were here)
-                        data_items_parsed[item.Name] = item.Value
-        except (AttributeError, TypeError, IndexError) as e:
-            LOGGER.debug(f"Error extracting generic data for topic {topic}: {e}")
-
-        # Combine source and data items for generic value if no specific value was found
-        combined_data_for_value = {**source_items_parsed, **data_items_parsed}
-        if combined_data_for_value:
-            # If there's only one item in combined_data, make its value the parsed_value for simplicity
-            if len(combined_data_for_value) == 1:
-                parsed_value = list(combined_data_for_value.values())[0]
-            else:
-                parsed_value = str(combined_data_for_value) # Convert dictionary to string for complex data
-        else:
-            parsed_value = "No specific data found"
+def parse_event_message(msg: Any, extractors: Dict[str, TopicExtractor]) -> ONVIFEvent | None:
+    """Parses a notification message with the extractor of its topic, if there is one."""
+    try:
+        topic = msg['Topic']['_value_1']
+    except (KeyError, TypeError):
+        LOGGER.debug("Received an event message without a valid topic, skipping.")
+        return None
 
-    # Return the Event object with all collected information
-    return ONVIFEvent(
-        topic=topic,
-        value=parsed_value,
-        event_name=parsed_event_name,
-        raw_message=msg # Store the full raw message for debugging if needed
-    )
\ No newline at end of file
+    extractor = extractors.get(topic)
+    if extractor is None:
+        # Some devices append a separator to the topic
+        extractor = extractors.get(topic.rstrip('/.')) if isinstance(topic, str) else None
+        if extractor is None:
+            return None
+    return extractor(msg)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, TYPE_CHECKING
+
+from utils.event_handler import EventHandler
+from utils.states import state
+from utils.config import CONFIG
+from utils.metrics import ONVIF_CAMERA_FAILURES, ONVIF_CAMERA_UP, ONVIF_EVENTS
+from onvif_.event_parser import TopicExtractor, compile_topic_extractors
+from onvif_.xaddr_cache import XAddrCache
+
+if TYPE_CHECKING:
+    from onvif_.monitor_events import CameraMonitor
+
+log = logging.getLogger(__name__)
+
+# Settings every camera monitor is built from, changing one restarts them all
+SHARED_ONVIF_SETTINGS = {
+    'onvif_cache_path',
+    'onvif_topics',
+    'onvif_keep_raw_message',
+    'onvif_coalesce_window',
+    'onvif_emit_cleared'
+}
+
+
+class ONVIFMonitor:
+    """
+    Runs a CameraMonitor per configured camera.
+
+    `reconfigure` rebuilds the camera list from CONFIG: cameras whose
+    settings are unchanged keep their connection, changed ones reconnect and
+    removed ones disconnect. A change to the shared ONVIF settings restarts
+    them all.
+    """
+    def __init__(self, event_handler_instance: EventHandler):
+        self._evh: EventHandler = event_handler_instance
+        self.cameras: List['CameraMonitor'] = []
+        self._reconfigured = asyncio.Event()
+        self._wsdl_loaded = False
+        self._xaddr_cache: Optional[XAddrCache] = None
+        self._extractors: Optional[Dict[str, TopicExtractor]] = None
+        self._build_cameras(rebuild_all=True)
+
+    def _build_cameras(self, rebuild_all: bool) -> None:
+        if not CONFIG.onvif_cameras:
+            self.cameras = []
+            return
+        # Imports onvif and zeep, only once a camera is configured
+        from onvif_.monitor_events import CameraMonitor
+
+        if rebuild_all or self._extractors is None:
+            self._xaddr_cache = XAddrCache(CONFIG.onvif_cache_path)
+            self._extractors = compile_topic_extractors(CONFIG.onvif_topics, CONFIG.onvif_keep_raw_message)
+        current = {} if rebuild_all else {camera_monitor.camera.id: camera_monitor for camera_monitor in self.cameras}
+        cameras = []
+        for camera in CONFIG.onvif_cameras:
+            camera_monitor = current.get(camera.id)
+            if camera_monitor is None or camera_monitor.camera != camera:
+                camera_monitor = CameraMonitor(camera, self._evh, self._xaddr_cache, self._extractors)
+            cameras.append(camera_monitor)
+        self.cameras = cameras
+
+    async def reconfigure(self, changed: Set[str]) -> None:
+        """Config listener, the monitoring worker applies the new camera list."""
+        if not any(name.startswith('onvif_') for name in changed):
+            return
+        self._build_cameras(rebuild_all=not changed.isdisjoint(SHARED_ONVIF_SETTINGS))
+        self._reconfigured.set()
+
+    def collect_metrics(self) -> None:
+        # Cameras removed from the config disappear from the metrics
+        ONVIF_CAMERA_UP.clear()
+        ONVIF_CAMERA_FAILURES.clear()
+        ONVIF_EVENTS.clear()
+        for camera_monitor in self.cameras:
+            ONVIF_CAMERA_UP.set(1 if camera_monitor.is_up else 0, camera=camera_monitor.camera.id)
+            ONVIF_CAMERA_FAILURES.set(camera_monitor.failures, camera=camera_monitor.camera.id)
+            for outcome, count in camera_monitor.topic_states.metrics.items():
+                ONVIF_EVENTS.set(count, camera=camera_monitor.camera.id, outcome=outcome)
+
+    async def _sync_tasks(self, tasks: Dict['CameraMonitor', asyncio.Task]) -> None:
+        """Stops the monitors no longer configured and starts the new ones."""
+        stopped = [tasks.pop(camera_monitor) for camera_monitor in list(tasks) if camera_monitor not in self.cameras]
+        for task in stopped:
+            task.cancel()
+        await asyncio.gather(*stopped, return_exceptions=True)
+
+        started = [camera_monitor for camera_monitor in self.cameras if camera_monitor not in tasks]
+        if started and not self._wsdl_loaded:
+            from onvif_.monitor_events import preload_wsdl
+            await preload_wsdl()
+            self._wsdl_loaded = True
+        for camera_monitor in started:
+            tasks[camera_monitor] = asyncio.create_task(camera_monitor.run())
+        if stopped or started:
+            log.info(f'Monitoring {len(tasks)} ONVIF camera(s).')
+
+    async def onvif_event_monitoring_worker(self):
+        tasks: Dict['CameraMonitor', asyncio.Task] = {}
+        try:
+            while state.is_server_up():
+                self._reconfigured.clear()
+                await self._sync_tasks(tasks)
+                await self._reconfigured.wait()
+        except asyncio.CancelledError:
+            log.info('ONVIF event monitoring worker was cancelled.')
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        log.info('Shutting down onvif event monitoring worker...')
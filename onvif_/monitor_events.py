@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 import os
+import time
 import uuid
+import random
 import asyncio
 import datetime
 import logging
+from pathlib import Path
+from typing import Dict
 
+import aiohttp
 import onvif
-from onvif import ONVIFCamera
+from onvif import ONVIFCamera, ONVIFService
+from onvif.definition import SERVICES
 from onvif.exceptions import ONVIFError
 from onvif.util import stringify_onvif_error
 from zeep.exceptions import Fault, TransportError, XMLParseError
@@ -16,15 +22,37 @@ from zeep.exceptions import ValidationError # Ensure this is imported for CREATE
 from objects.event import Event
 from utils.event_handler import EventHandler
 from utils.states import state
-from utils.config import CONFIG
-from onvif_.event_parser import parse_event_message
+from utils.config import CONFIG, CameraConfig
+from utils.metrics import STAGE_LATENCY
+from onvif_.event_parser import TopicExtractor, compile_topic_extractors, parse_event_message
+from onvif_.topic_state import TopicStateTracker
+from onvif_.xaddr_cache import XAddrCache
 
 log = logging.getLogger(__name__)
 
 # Constants for subscription management
 SUBSCRIPTION_TIME = datetime.timedelta(minutes=10)
-PULLPOINT_POLL_TIME = datetime.timedelta(seconds=1) # How long to wait for messages in one pull request
+# Long poll: the camera holds each PullMessages request until a message arrives or the timeout
+# passes, and the next request goes out right away. Stays below the 90 s pullpoint read timeout.
+PULLPOINT_POLL_TIME = datetime.timedelta(seconds=60)
+# Shortest timeout asked for, and the pace for cameras that answer empty pulls without waiting
+PULLPOINT_MIN_POLL_TIME = datetime.timedelta(seconds=1)
 PULLPOINT_MESSAGE_LIMIT = 100 # Max messages to pull at once
+# Renew once the subscription would expire within this margin of the next pull
+PULLPOINT_RENEW_MARGIN = datetime.timedelta(seconds=10)
+
+# Backoff between failed pulls, reset by the next successful one
+PULL_ERROR_BACKOFF_MIN = .1
+PULL_ERROR_BACKOFF_MAX = 10
+
+# Reconnect backoff per camera, reset once a subscription is live.
+# The first reconnect after losing a live subscription is immediate.
+RECONNECT_BACKOFF_MIN = .1
+RECONNECT_BACKOFF_MAX = 60
+
+# Every camera shares the WSDL files, `onvif` caches each parsed file by path
+WSDL_DIR = os.path.join(os.path.dirname(onvif.__file__), 'wsdl')
+PRELOADED_SERVICES = ('devicemgmt', 'events', 'pullpoint', 'subscription')
 
 # ONVIF Error types
 SUBSCRIPTION_ERRORS = (Fault, TimeoutError, TransportError)
@@ -36,83 +64,142 @@ CREATE_ERRORS = (
     ValidationError, # Make sure ValidationError is imported from zeep.exceptions
 )
 UNSUBSCRIBE_ERRORS = (XMLParseError, *SUBSCRIPTION_ERRORS)
+# The camera could not be reached at all, its cached XAddrs may still be right
+UNREACHABLE_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError)
+
+async def preload_wsdl(wsdl_dir: str = WSDL_DIR) -> None:
+    """
+    Parses the WSDL files used for event monitoring once, before the
+    cameras connect concurrently and would each parse them on a cache miss.
+    """
+    for name in PRELOADED_SERVICES:
+        definition = SERVICES[name]
+        service = ONVIFService(
+            'http://127.0.0.1/',
+            None,
+            None,
+            str(Path(wsdl_dir) / definition['wsdl']),
+            binding_name=f'{{{definition["ns"]}}}{definition["binding"]}'
+        )
+        try:
+            await service.setup()
+        finally:
+            await service.close()
 
-TOPIC_FILTER = [
-    'tns1:RuleEngine/CellMotionDetector/Motion',
-    'tns1:RuleEngine/PeopleDetector/People'
-]
 
-class ONVIFMonitor:
-    def __init__(self, event_handler_instance: EventHandler):
+class CameraMonitor:
+    """Supervised PullPoint monitoring of one camera, with its own health and backoff."""
+    def __init__(self,
+                 camera: CameraConfig,
+                 event_handler_instance: EventHandler,
+                 xaddr_cache: XAddrCache | None = None,
+                 extractors: Dict[str, TopicExtractor] | None = None):
+        self.camera = camera
         self._evh: EventHandler = event_handler_instance
+        self._xaddr_cache = xaddr_cache if xaddr_cache is not None else XAddrCache()
+        if extractors is None:
+            extractors = compile_topic_extractors(CONFIG.onvif_topics, CONFIG.onvif_keep_raw_message)
+        self._extractors = extractors
+        # Reset for each new subscription, whose synchronization point re-reports the current states
+        self.topic_states = TopicStateTracker(self._emit, CONFIG.onvif_coalesce_window, CONFIG.onvif_emit_cleared)
+        self.is_up = False
+        self.failures = 0
+        self.last_error: str | None = None
+        self._device: ONVIFCamera | None = None
+
+    async def _emit(self, event_name: str, topic: str, data: dict) -> None:
+        ice_event = Event(
+            event_id=str(uuid.uuid4()),
+            event_event=event_name,
+            event_type='onvif',
+            event_source=self.camera.id,
+            event_data={'camera': self.camera.id, 'topic': topic, **data}
+        )
+        await self._evh.broadcast(ice_event)
 
-    async def monitor_onvif_events(self,
-                                   onvif_ip: str,
-                                   onvif_port: int,
-                                   username: str,
-                                   password: str):
-        """Monitors ONVIF events from a camera using PullPoint subscription."""
-        log.info(f'Connecting to ONVIF camera at {onvif_ip}:{onvif_port}...')
-        mycam = None
+    async def monitor_onvif_events(self):
+        """Monitors ONVIF events from the camera using PullPoint subscription."""
+        camera = self.camera
+        log.info(f'[{camera.id}] Connecting to ONVIF camera at {camera.host}:{camera.port}...')
         pullpoint_manager = None
         pull_messages_task = None
+        cached_xaddrs = self._xaddr_cache.get(camera)
+        is_reachable = True
 
         try:
-            mycam = ONVIFCamera(onvif_ip, onvif_port, username, password, f'{os.path.dirname(onvif.__file__)}/wsdl/', no_cache=True)
-            # Ensure the device is reachable and services are initialized
-            await mycam.update_xaddrs()
-            log.info('Successfully connected to camera and updated XAddrs.')
+            # The device object (and its service clients) is kept across reconnects
+            if self._device is None:
+                self._device = ONVIFCamera(camera.host, camera.port, camera.username, camera.password, WSDL_DIR)
+            mycam = self._device
+            if cached_xaddrs is not None:
+                mycam.xaddrs = cached_xaddrs
+                log.info(f'[{camera.id}] Using cached XAddrs.')
+            else:
+                # Ensure the device is reachable and services are initialized
+                await mycam.update_xaddrs()
+                await self._xaddr_cache.put(camera, mycam.xaddrs)
+                log.info(f'[{camera.id}] Successfully connected to camera and updated XAddrs.')
 
             # Check if event service is available
-            event_service = mycam.create_events_service()
+            event_service = await mycam.create_events_service()
             if not event_service:
-                log.error('Event service not available on this ONVIF camera. Cannot monitor events.')
+                log.error(f'[{camera.id}] Event service not available on this ONVIF camera. Cannot monitor events.')
                 return
 
             # Create PullPoint subscription
-            log.info('Creating PullPoint subscription...')
+            log.info(f'[{camera.id}] Creating PullPoint subscription...')
             try:
                 pullpoint_manager = await mycam.create_pullpoint_manager(
                     SUBSCRIPTION_TIME,
-                    lambda: log.warning('ONVIF PullPoint subscription lost or expired. Events may be missed until renewed.')
+                    lambda: log.warning(f'[{camera.id}] ONVIF PullPoint subscription lost or expired. Events may be missed until renewed.')
                 )
+                # A clear may have been missed while disconnected, the first reports decide
+                self.topic_states.reset()
                 await pullpoint_manager.set_synchronization_point()
-                log.info('PullPoint subscription created successfully.')
+                log.info(f'[{camera.id}] PullPoint subscription created successfully.')
             except CREATE_ERRORS as err:
+                is_reachable = not isinstance(err, UNREACHABLE_ERRORS)
                 log.error(
-                    f'Failed to create PullPoint subscription: {stringify_onvif_error(err)}. '
+                    f'[{camera.id}] Failed to create PullPoint subscription: {stringify_onvif_error(err)}. '
                     'Device may not support PullPoint service or has too many subscriptions.'
                 )
                 return
 
+            self.is_up = True
+            self.failures = 0
+
             async def _pull_messages_loop():
-                """Continuously pull messages from the device."""
+                """Continuously long-polls messages from the device."""
+                pull_errors = 0
+                # The first answer tells how long the camera keeps the subscription
+                poll_time = PULLPOINT_MIN_POLL_TIME
+                renew_requested_for = None
                 while True:
                     # Monitors server up status
                     if not state.is_server_up():
-                        log.info(f'Received server shutting down. Exitting ONVIF monitoring loop...')
-                        pull_messages_task.cancel()
-                        breakpoint
+                        log.info(f'[{camera.id}] Received server shutting down. Exitting ONVIF monitoring loop...')
+                        break
 
                     if pullpoint_manager is None or pullpoint_manager.closed:
-                        log.info('PullPoint manager is closed, stopping message pull loop.')
+                        log.info(f'[{camera.id}] PullPoint manager is closed, stopping message pull loop.')
                         break
 
                     log.debug(
-                        f'Pulling PullPoint messages timeout={PULLPOINT_POLL_TIME} limit={PULLPOINT_MESSAGE_LIMIT}'
+                        f'[{camera.id}] Pulling PullPoint messages timeout={poll_time} limit={PULLPOINT_MESSAGE_LIMIT}'
                     )
 
                     response = None
+                    pull_started = time.perf_counter()
                     try:
                         response = await pullpoint_manager.get_service().PullMessages(
                             {
                                 'MessageLimit': PULLPOINT_MESSAGE_LIMIT,
-                                'Timeout': PULLPOINT_POLL_TIME,
+                                'Timeout': poll_time,
                             }
                         )
                     except Fault as err:
                         log.warning(
-                            f'Failed to fetch PullPoint subscription messages (Fault): {stringify_onvif_error(err)}. '
+                            f'[{camera.id}] Failed to fetch PullPoint subscription messages (Fault): {stringify_onvif_error(err)}. '
                             'Attempting to re-establish subscription.'
                         )
                         pullpoint_manager.resume()
@@ -122,95 +209,117 @@ class ONVIFMonitor:
                         asyncio.TimeoutError,
                     ) as err:
                         log.warning(
-                            f'PullPoint subscription encountered a transient error: {stringify_onvif_error(err)}. '
+                            f'[{camera.id}] PullPoint subscription encountered a transient error: {stringify_onvif_error(err)}. '
                             'Retrying after delay.'
                         )
                     except Exception as err:
-                        log.error(f'An unexpected error occurred during PullMessages: {err}. Stopping monitoring.')
+                        log.error(f'[{camera.id}] An unexpected error occurred during PullMessages: {err}. Stopping monitoring.')
                         break
+                    pulled_at = time.perf_counter()
+
+                    if response is None:
+                        pull_errors += 1
+                        await asyncio.sleep(min(PULL_ERROR_BACKOFF_MIN * 2 ** (pull_errors - 1), PULL_ERROR_BACKOFF_MAX))
+                        continue
+                    pull_errors = 0
 
-                    if response and (notification_messages := response.NotificationMessage):
+                    # Both times come from the camera's clock, so skew between the clocks doesn't matter
+                    poll_time = PULLPOINT_POLL_TIME
+                    termination_time = response.TerminationTime
+                    if termination_time and response.CurrentTime:
+                        expires_in = termination_time - response.CurrentTime
+                        if expires_in - poll_time < PULLPOINT_RENEW_MARGIN:
+                            poll_time = max(expires_in - PULLPOINT_RENEW_MARGIN, PULLPOINT_MIN_POLL_TIME)
+                            if renew_requested_for != termination_time and expires_in < PULLPOINT_RENEW_MARGIN + PULLPOINT_MIN_POLL_TIME:
+                                log.info(f'[{camera.id}] PullPoint subscription expires in {expires_in}, renewing.')
+                                renew_requested_for = termination_time
+                                pullpoint_manager.resume()
+
+                    if notification_messages := response.NotificationMessage:
                         for msg in notification_messages:
                             # Process every message using the generic parser
                             try:
-                                # Filter events
-                                topic_name = msg.Topic._value_1
-                                if topic_name in TOPIC_FILTER:
-                                    event = await parse_event_message(msg)
-                                    if event:
-                                        log.debug(f'Received ONVIF Event: {event}')
-                                        if event.value != True:
-                                            # Ignore disarm events
-                                            continue
-
-                                        ice_event = Event(
-                                            event_id=str(uuid.uuid4()),
-                                            event_event='motion',
-                                            event_type='onvif',
-                                            event_source='server'
-                                        )
-
-                                        await self._evh.broadcast(ice_event)
-
-                                    else:
-                                        log.debug(f'Parser returned no event for message: {msg}')
+                                # Messages on topics without an extractor are dropped here
+                                with STAGE_LATENCY.time(stage='onvif_parse'):
+                                    event = parse_event_message(msg, self._extractors)
+                                if event is None:
+                                    continue
+                                log.debug(f'[{camera.id}] Received ONVIF Event: {event.event_name}={event.value} ({event.topic})')
+                                if await self.topic_states.update(event):
+                                    STAGE_LATENCY.observe(time.perf_counter() - pulled_at, stage='onvif_pull_to_broadcast')
                             except Exception as e:
-                                log.error(f'Error parsing event message: {e} - Raw message: {msg}')
+                                log.error(f'[{camera.id}] Error parsing event message: {e} - Raw message: {msg}')
                     else:
-                        log.debug('No new events received in this pull cycle.')
-
-                    # Wait for the next pull cycle
-                    await asyncio.sleep(PULLPOINT_POLL_TIME.total_seconds())
+                        log.debug(f'[{camera.id}] No new events received in this pull cycle.')
+                        # Some cameras answer empty pulls right away instead of holding them
+                        remaining = PULLPOINT_MIN_POLL_TIME.total_seconds() - (pulled_at - pull_started)
+                        if remaining > 0:
+                            await asyncio.sleep(remaining)
 
             # Start the continuous message pulling task
             pull_messages_task = asyncio.create_task(_pull_messages_loop())
-            log.info('Started continuous ONVIF event pulling.')
+            log.info(f'[{camera.id}] Started continuous ONVIF event pulling.')
 
             await pull_messages_task
 
         except ONVIFError as e:
-            log.error(f'ONVIF camera error: {e}')
+            self.last_error = str(e)
+            log.error(f'[{camera.id}] ONVIF camera error: {e}')
         except Exception as e:
-            log.error(f'An unexpected error occurred: {e}')
+            self.last_error = str(e)
+            is_reachable = not isinstance(e, UNREACHABLE_ERRORS)
+            log.error(f'[{camera.id}] An unexpected error occurred: {e}')
         finally:
-            log.info('Stopping ONVIF event monitoring...')
+            if cached_xaddrs is not None and not self.is_up and is_reachable:
+                # The camera answered but the cached endpoints did not work
+                await self._xaddr_cache.invalidate(camera)
+            self.is_up = False
+            log.info(f'[{camera.id}] Stopping ONVIF event monitoring...')
             if pull_messages_task and not pull_messages_task.done():
                 pull_messages_task.cancel()
                 try:
                     await pull_messages_task
                 except asyncio.CancelledError:
-                    log.info('Event pulling task cancelled.')
+                    log.info(f'[{camera.id}] Event pulling task cancelled.')
 
             if pullpoint_manager and not pullpoint_manager.closed:
-                log.info('Unsubscribing from PullPoint...')
+                log.info(f'[{camera.id}] Unsubscribing from PullPoint...')
                 try:
                     await pullpoint_manager.shutdown()
-                    log.info('Successfully unsubscribed from PullPoint.')
+                    log.info(f'[{camera.id}] Successfully unsubscribed from PullPoint.')
                 except UNSUBSCRIBE_ERRORS as err:
                     log.warning(
-                        f'Failed to unsubscribe PullPoint subscription: {stringify_onvif_error(err)}. '
+                        f'[{camera.id}] Failed to unsubscribe PullPoint subscription: {stringify_onvif_error(err)}. '
                         'This is normal if the device restarted or subscription already expired.'
                     )
                 except Exception as e:
-                    log.error(f'Error during PullPoint shutdown: {e}')
+                    log.error(f'[{camera.id}] Error during PullPoint shutdown: {e}')
 
-            log.info('ONVIF event monitoring stopped.')
+            log.info(f'[{camera.id}] ONVIF event monitoring stopped.')
 
-    async def onvif_event_monitoring_worker(self):
+    async def run(self):
+        """Keeps the camera monitored, backing off exponentially while it keeps failing."""
+        try:
+            while state.is_server_up():
+                try:
+                    await self.monitor_onvif_events()
+                except Exception as e:
+                    self.last_error = str(e)
+                    log.critical(f'[{self.camera.id}] Encountered critical error while monitoring ONVIF event: {e}')
 
-        while state.is_server_up():
-            try:
-                await self.monitor_onvif_events(
-                    CONFIG.onvif_host,
-                    CONFIG.onvif_port,
-                    CONFIG.onvif_username,
-                    CONFIG.onvif_password
-                )
-            except asyncio.CancelledError:
-                log.info('ONVIF event monitoring worker was cancelled.')
-                break
-            except Exception as e:
-                log.critical(f'Encountered critical error while monitoring ONVIF event: {e}')
-                log.info('Restarting ONVIF monitoring...')
-
-        log.info('Shutting down onvif event monitoring worker...')
\ No newline at end of file
+                self.failures += 1
+                if not state.is_server_up():
+                    break
+
+                backoff = 0
+                if self.failures > 1:
+                    backoff = min(RECONNECT_BACKOFF_MIN * 2 ** (self.failures - 2), RECONNECT_BACKOFF_MAX)
+                    # Jitter keeps cameras that dropped together from reconnecting in lockstep
+                    backoff *= random.uniform(.5, 1)
+                log.info(f'[{self.camera.id}] Restarting ONVIF monitoring in {backoff:.1f}s (attempt {self.failures})...')
+                await asyncio.sleep(backoff)
+        finally:
+            self.topic_states.close()
+            if self._device is not None:
+                await self._device.close()
+                self._device = None
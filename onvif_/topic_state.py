@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Set
+
+from objects.onvif_event import ONVIFEvent
+
+log = logging.getLogger(__name__)
+
+CLEARED_SUFFIX = '_cleared'
+
+EmitCallback = Callable[[str, str, dict], Awaitable[None]]
+
+class TopicState:
+    def __init__(self) -> None:
+        self.active = False
+        # Edges in the current burst, 0 while no burst is open
+        self.count = 0
+        self.started = 0.
+        self.cleared = 0.
+        self.close_timer: asyncio.TimerHandle | None = None
+
+
+class TopicStateTracker:
+    """
+    Edge-triggered state of one camera's topics.
+
+    Only an inactive→active edge emits an event (active as in the topic's
+    `activeWhen` values), re-reports of an active state don't. Edges within `coalesce_window` seconds of the previous clear
+    belong to the same burst and are only counted. Once a topic stays
+    inactive for the window the burst closes, optionally emitting a
+    '<event>_cleared' event that carries the burst's edge count.
+    """
+    def __init__(self, emit: EmitCallback, coalesce_window: float = 0, emit_cleared: bool = False) -> None:
+        self._emit = emit
+        self._coalesce_window = coalesce_window
+        self._emit_cleared = emit_cleared
+        self._states: Dict[str, TopicState] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.metrics = {
+            'emitted': 0,
+            'repeated': 0,
+            'coalesced': 0,
+            'cleared': 0
+        }
+
+    async def update(self, event: ONVIFEvent) -> bool:
+        """Applies a parsed message, returns whether it emitted an event."""
+        state = self._states.get(event.topic)
+        if state is None:
+            state = self._states[event.topic] = TopicState()
+
+        if not event.active:
+            if state.active:
+                state.active = False
+                state.cleared = time.monotonic()
+                if self._coalesce_window > 0:
+                    state.close_timer = asyncio.get_running_loop().call_later(
+                        self._coalesce_window, self._close_burst, event, state
+                    )
+                else:
+                    self._close_burst(event, state)
+            return False
+
+        if state.active:
+            self.metrics['repeated'] += 1
+            return False
+        state.active = True
+
+        if state.close_timer is not None:
+            # Back within the window of the last clear, same burst
+            state.close_timer.cancel()
+            state.close_timer = None
+            state.count += 1
+            self.metrics['coalesced'] += 1
+            return False
+
+        state.count = 1
+        state.started = time.monotonic()
+        self.metrics['emitted'] += 1
+        await self._emit(event.event_name, event.topic, {})
+        return True
+
+    def _close_burst(self, event: ONVIFEvent, state: TopicState) -> None:
+        state.close_timer = None
+        count, state.count = state.count, 0
+        if not self._emit_cleared:
+            return
+        self.metrics['cleared'] += 1
+        data = {
+            'count': count,
+            'duration': round(state.cleared - state.started, 3)
+        }
+        task = asyncio.create_task(self._emit(f'{event.event_name}{CLEARED_SUFFIX}', event.topic, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def reset(self) -> None:
+        """
+        Forgets every topic's state, for a new subscription: its first
+        active report is an edge, whatever was missed while disconnected.
+        Open bursts are dropped without emitting their cleared events.
+        """
+        for state in self._states.values():
+            if state.close_timer is not None:
+                state.close_timer.cancel()
+        self._states.clear()
+
+    def close(self) -> None:
+        """Drops open bursts without emitting their cleared events."""
+        self.reset()
+        for task in self._tasks:
+            task.cancel()
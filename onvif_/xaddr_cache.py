@@ -0,0 +1,73 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from utils.config import CameraConfig
+
+log = logging.getLogger(__name__)
+
+class XAddrCache:
+    """
+    Service XAddrs discovered per camera, optionally persisted to a JSON file.
+
+    A (re)connect with a cached entry skips service discovery. An entry is
+    dropped whenever a connection attempt made with it fails, e.g. after
+    the device restarted with different endpoints, so the next attempt
+    rediscovers them.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path
+        self._entries: Dict[str, dict] = {}
+        if path is not None:
+            self._entries = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            log.info(f'Loaded cached XAddrs for {len(entries)} camera(s).')
+            return entries
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            log.warning(f'Ignoring unreadable XAddr cache at {self._path}: {e}')
+            return {}
+
+    def _write(self, entries: Dict[str, dict]) -> None:
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f'{self._path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self._path)
+
+    async def _save(self) -> None:
+        if self._path is None:
+            return
+        try:
+            await asyncio.to_thread(self._write, dict(self._entries))
+        except Exception as e:
+            log.warning(f'Failed to write XAddr cache: {e}')
+
+    def get(self, camera: CameraConfig) -> Optional[Dict[str, str]]:
+        entry = self._entries.get(camera.id)
+        # Only valid for the address it was discovered at
+        if entry is None or entry['host'] != camera.host or entry['port'] != camera.port:
+            return None
+        return dict(entry['xaddrs'])
+
+    async def put(self, camera: CameraConfig, xaddrs: Dict[str, str]) -> None:
+        self._entries[camera.id] = {
+            'host': camera.host,
+            'port': camera.port,
+            'xaddrs': dict(xaddrs)
+        }
+        await self._save()
+
+    async def invalidate(self, camera: CameraConfig) -> None:
+        if self._entries.pop(camera.id, None) is not None:
+            log.info(f'[{camera.id}] Dropped cached XAddrs.')
+            await self._save()
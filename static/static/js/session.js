@@ -65,6 +65,9 @@ document.addEventListener('DOMContentLoaded', () => {
     let oldClientListHA = [];
     let oldClientListHTML = [];
 
+    let clientMap = new Map();
+    let stateRevision = null;
+
     let lastOnvifTimestamp = new Date(0);
 
     const socket = io({
@@ -621,6 +624,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     socket.on('connect', () => {
         heartbeatTimestamp = new Date();
+        stateRevision = null;
         let payload = {
             'name': clientName,
             'type': 'html'
@@ -639,27 +643,12 @@ document.addEventListener('DOMContentLoaded', () => {
         handleEvent(data['event'], !isArmedStandalone);
     });
 
-    socket.on('ping', (data) => {
-        socket.emit('get');
-    });
-
-    socket.on('get_result', (data) => {
-        const newIsArmed = Boolean(data['isArmed']);
-
-        const eventList = data['eventList'];
-        const clientList = data['clientList'];
+    function rebuildClientLists() {
         let newClientListPC = [];
         let newClientListHA = [];
         let newClientListHTML = [];
 
-        let needUpdatePage = false;
-
-        if (isArmed !== newIsArmed) {
-            isArmed = newIsArmed;
-            needUpdatePage = true;
-        }
-
-        clientList.forEach(client => {
+        clientMap.forEach(client => {
             if (client['type'] === 'pc') {
                 newClientListPC.push(client);
             } else if (client['type'] === 'ha') {
@@ -669,21 +658,56 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
 
-        if (clientListPC !== newClientListPC ||
-            clientListHA !== newClientListHA ||
-            clientListHTML !== newClientListHTML
-        ) {
-            clientListPC = newClientListPC;
-            clientListHA = newClientListHA;
-            clientListHTML = newClientListHTML;
-            needUpdatePage = true;
+        clientListPC = newClientListPC;
+        clientListHA = newClientListHA;
+        clientListHTML = newClientListHTML;
+    }
+
+    function checkZeroClient() {
+        // Connected client count check
+        if (isArmed && (clientListPC.length === 0 || clientListHA.length === 0 || clientListHTML.length === 0)) {
+            const timeNow = new Date();
+            internalEvent = {
+                'event': 'zero_client',
+                'type': 'client',
+                'source': 'self',
+                'timestamp': timeNow.toISOString()
+            }
+            handleInternalEvent(internalEvent);
+        } else if (isArmed) {
+            if (flashEventSource === 'client_zero_client') {
+                removeFlash('client_zero_client');
+            }
+            if (videoOverlayEventSource === 'client_zero_client') {
+                removeVideoOverlay('client_zero_client');
+            }
         }
+    }
+
+    socket.on('ping', (data) => {
+        socket.emit('pong');
+
+        // Update heartbeat
+        heartbeatTimestamp = new Date();
+        updateHeartbeat();
+    });
+
+    socket.on('get_result', (data) => {
+        const eventList = data['eventList'];
+        const clientList = data['clientList'];
+
+        stateRevision = data['rev'];
+        isArmed = Boolean(data['isArmed']);
+
+        clientMap = new Map();
+        clientList.forEach(client => {
+            clientMap.set(client['sid'], client);
+        });
+        rebuildClientLists();
 
         let newEventList = [];
         let ackedEventList = [];
 
-        socket.emit('pong');
-
         function isDuplicateEvent(eventID) {
             for (const event of receivedEventList) {
                 if (event['id'] === eventID) {
@@ -718,28 +742,36 @@ document.addEventListener('DOMContentLoaded', () => {
         heartbeatTimestamp = new Date();
         updateHeartbeat();
 
-        // Connected client count check
-        if (isArmed && (clientListPC.length === 0 || clientListHA.length === 0 || clientListHTML.length === 0)) {
-            const timeNow = new Date();
-            internalEvent = {
-                'event': 'zero_client',
-                'type': 'client',
-                'source': 'self',
-                'timestamp': timeNow.toISOString()
-            }
-            handleInternalEvent(internalEvent);
-        } else if (isArmed) {
-            if (flashEventSource === 'client_zero_client') {
-                removeFlash('client_zero_client');
-            }
-            if (videoOverlayEventSource === 'client_zero_client') {
-                removeVideoOverlay('client_zero_client');
-            }
+        checkZeroClient();
+        updatePage();
+    });
+
+    socket.on('delta', (data) => {
+        if (stateRevision === null || data['rev'] <= stateRevision) {
+            return; // Snapshot pending or already covered by it
         }
+        if (data['rev'] !== stateRevision + 1) {
+            // Missed a delta, resync from a full snapshot
+            stateRevision = null;
+            socket.emit('get');
+            return;
+        }
+        stateRevision = data['rev'];
 
-        if (needUpdatePage) {
-            updatePage();
+        if ('isArmed' in data) {
+            isArmed = Boolean(data['isArmed']);
         }
+        if ('clientUpdated' in data) {
+            clientMap.set(data['clientUpdated']['sid'], data['clientUpdated']);
+            rebuildClientLists();
+        }
+        if ('clientRemoved' in data) {
+            clientMap.delete(data['clientRemoved']);
+            rebuildClientLists();
+        }
+
+        checkZeroClient();
+        updatePage();
     });
 
     socket.on("connect_error", (error) => {
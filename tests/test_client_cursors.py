@@ -0,0 +1,75 @@
+import asyncio
+
+from objects.client import Client
+from objects.clients import Clients
+from objects.event import Event
+
+
+def test_out_of_order_acks_advance_the_cursor_once_contiguous():
+    client = Client('sid', cursor=2)
+    client.ack_event(4)
+    client.ack_event(5)
+    assert (client.cursor, client.acked) == (2, {4, 5})
+    assert client.is_acked(1) and client.is_acked(5) and not client.is_acked(3)
+    client.ack_event(3)
+    assert (client.cursor, client.acked) == (5, set())
+
+    client.ack_event(7)
+    client.skip_to(6)
+    assert (client.cursor, client.acked) == (7, set())
+    client.reset_cursor(1)
+    assert not client.is_acked(2)
+
+
+async def pending_ids(clients: Clients, sid: str) -> list:
+    return [event.id for event in await clients.get_event_list(sid, False)]
+
+
+def test_each_client_sees_what_it_did_not_ack():
+    async def run() -> None:
+        clients = Clients()
+        for sid in ('a', 'b'):
+            await clients.add_client(sid)
+            await clients.update_client(sid, sid, 'pc')
+        for index in range(4):
+            await clients.add_event(Event(f'e{index}', 'motion', 'onvif', 'camera'))
+
+        await clients.ack_event('a', 'e2')
+        await clients.ack_event('a', 'e0')
+        assert await pending_ids(clients, 'a') == ['e1', 'e3']
+        assert await pending_ids(clients, 'b') == ['e0', 'e1', 'e2', 'e3']
+
+        await clients.ack_event('a', 'e1')
+        assert (await clients.get_client('a')).cursor == 3
+        assert await pending_ids(clients, 'a') == ['e3']
+
+    asyncio.run(run())
+
+
+def test_reconnect_replays_after_the_last_seen_event():
+    async def run() -> None:
+        clients = Clients(event_removal_threshold=10)
+        await clients.add_client('a')
+        await clients.update_client('a', 'kiosk', 'pc')
+        events = [Event(f'e{index}', 'motion', 'onvif', 'camera') for index in range(4)]
+        for event in events:
+            await clients.add_event(event)
+        for event in events:
+            await clients.ack_event('a', event.id)
+        assert await pending_ids(clients, 'a') == []
+
+        # Same client on a new socket, it saw up to e1
+        await clients.add_client('a2')
+        await clients.update_client('a2', 'kiosk', 'pc', last_event_id='e1')
+        assert await pending_ids(clients, 'a2') == ['e2', 'e3']
+
+        # Its last event expired, everything still buffered is replayed
+        events[0].received -= 20
+        events[1].received -= 20
+        await clients.clean_event()
+        await clients.update_client('a2', 'kiosk', 'pc', last_event_id='e1')
+        assert await pending_ids(clients, 'a2') == ['e2', 'e3']
+        await clients.update_client('a2', 'kiosk', 'pc', last_event_id='e0')
+        assert await pending_ids(clients, 'a2') == ['e2', 'e3']
+
+    asyncio.run(run())
@@ -0,0 +1,122 @@
+import os
+import sys
+import asyncio
+import tempfile
+import subprocess
+
+import pytest
+
+from objects.clients import Clients
+from utils.backend import Hub, LocalSocketBackend
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A worker process that connects one client and waits to be killed
+WORKER_SCRIPT = '''
+import sys
+import asyncio
+
+from objects.clients import Clients
+from utils.backend import LocalSocketBackend
+
+async def main():
+    backend = LocalSocketBackend(sys.argv[1])
+    clients = Clients(backend=backend)
+    backend.set_handler(clients.apply)
+    await backend.start()
+    await clients.add_client(sys.argv[2])
+    print('ready', flush=True)
+    await asyncio.Event().wait()
+
+asyncio.run(main())
+'''
+
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(.01)
+
+
+async def start_worker(path: str, sid: str) -> asyncio.subprocess.Process:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', WORKER_SCRIPT, path, sid,
+        cwd=REPO_ROOT,
+        env=dict(os.environ, PYTHONPATH=REPO_ROOT),
+        stdout=subprocess.PIPE
+    )
+    assert await asyncio.wait_for(process.stdout.readline(), 10) == b'ready\n'
+    return process
+
+
+async def join(path: str) -> Clients:
+    backend = LocalSocketBackend(path)
+    clients = Clients(backend=backend)
+    backend.set_handler(clients.apply)
+    await backend.start()
+    return clients
+
+
+def test_killed_worker_clients_are_removed_from_the_survivors():
+    async def run() -> None:
+        path = os.path.join(tempfile.mkdtemp(), 'hub.sock')
+        hub = Hub(path)
+        await hub.start()
+        survivors = [await join(path), await join(path)]
+        doomed = await start_worker(path, 'doomed-client')
+        try:
+            await survivors[0].add_client('survivor-client')
+            for clients in survivors:
+                await wait_for(lambda: len(clients) == 2)
+
+            doomed.kill()
+            await doomed.wait()
+
+            for clients in survivors:
+                await wait_for(lambda: len(clients) == 1)
+                assert await clients.get_client('doomed-client') is None
+                assert await clients.get_client('survivor-client') is not None
+        finally:
+            if doomed.returncode is None:
+                doomed.kill()
+            for clients in survivors:
+                await clients._backend.stop()
+            await hub.stop()
+
+    asyncio.run(run())
+
+
+def test_lost_hub_fails_pending_publishes():
+    async def run() -> None:
+        path = os.path.join(tempfile.mkdtemp(), 'hub.sock')
+        connections = []
+
+        # Welcomes the worker and then swallows its ops, so a publish stays pending
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            connections.append(writer)
+            await reader.readline()
+            writer.write(b'{"hub":"welcome","leader":true}\n')
+            while await reader.readline():
+                pass
+
+        server = await asyncio.start_unix_server(handle, path)
+        backend = LocalSocketBackend(path)
+        backend.set_handler(lambda message: asyncio.sleep(0))
+        await backend.start()
+
+        publish = asyncio.create_task(backend.publish({'op': 'armed', 'armed': True}))
+        await asyncio.sleep(.05)
+        assert not publish.done()
+        for writer in connections:
+            writer.close()
+        server.close()
+
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(publish, 5)
+        assert backend.lost
+        with pytest.raises(ConnectionError):
+            await backend.publish({'op': 'armed', 'armed': False})
+        await backend.stop()
+
+    asyncio.run(run())
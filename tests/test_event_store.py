@@ -0,0 +1,79 @@
+from objects.event import Event
+from objects.event_store import EventStore
+
+
+def make_event(index: int, name: str = 'motion', source: str = 'camera', received: float = 0) -> Event:
+    event = Event(f'e{index}', name, 'onvif', source)
+    event.received = received
+    return event
+
+
+def test_events_get_increasing_seqs_and_replay_after_a_seq():
+    store = EventStore()
+    assert (store.first_seq, store.last_seq) == (1, 0)
+    events = [make_event(index) for index in range(5)]
+    assert [store.append(event) for event in events] == [1, 2, 3, 4, 5]
+    assert (store.first_seq, store.last_seq) == (1, 5)
+    assert store.events_since(0) == events
+    assert store.events_since(3) == events[3:]
+    assert store.events_since(5) == []
+    assert store.get('e2') is events[2]
+
+
+def test_expire_advances_the_head_and_drops_the_indexes():
+    store = EventStore()
+    for index in range(4):
+        store.append(make_event(index, source=f'camera{index % 2}', received=index))
+
+    expired = store.expire(threshold=10, now=11.5)
+    assert [event.id for event in expired] == ['e0', 'e1']
+    assert len(store) == 2
+    assert store.first_seq == 3
+    assert store.get('e0') is None
+    assert [event.id for event in store.events_since(0)] == ['e2', 'e3']
+    # Expiry keeps sequence numbers, new events continue after the last one
+    assert store.append(make_event(4, received=12)) == 5
+
+    store.expire(threshold=10, now=100)
+    assert len(store) == 0
+    assert (store.first_seq, store.last_seq) == (6, 5)
+
+
+def test_previous_event_validity_by_name_and_source():
+    store = EventStore()
+    store.append(make_event(0, source='front', received=0))
+    store.append(make_event(1, source='garage', received=8))
+    assert store.is_previous_event_valid('motion', 10, now=12)
+    assert store.is_previous_event_valid('motion', 10, now=12, event_source='garage')
+    assert not store.is_previous_event_valid('motion', 10, now=12, event_source='front')
+    assert not store.is_previous_event_valid('person', 10, now=12)
+
+    # The newest event of a name outlives the expiry of older ones
+    store.expire(threshold=10, now=12)
+    assert store.is_previous_event_valid('motion', 10, now=12)
+    store.expire(threshold=10, now=20)
+    assert not store.is_previous_event_valid('motion', 10, now=20)
+
+
+def test_compaction_keeps_replay_positions(monkeypatch):
+    monkeypatch.setattr('objects.event_store.COMPACT_THRESHOLD', 4)
+    store = EventStore()
+    for index in range(10):
+        store.append(make_event(index, received=index))
+    store.expire(threshold=0, now=5.5)
+    # Six expired, the log was compacted and the head is back at the start
+    assert store._head == 0
+    assert [event.seq for event in store.events_since(0)] == [7, 8, 9, 10]
+    assert [event.seq for event in store.events_since(8)] == [9, 10]
+
+
+def test_load_replaces_the_log():
+    store = EventStore()
+    store.append(make_event(0))
+    events = [make_event(index) for index in range(1, 3)]
+    for seq, event in enumerate(events, start=7):
+        event.seq = seq
+    store.load(events, next_seq=9)
+    assert store.get('e0') is None
+    assert (store.first_seq, store.last_seq) == (7, 8)
+    assert store.append(make_event(3)) == 9
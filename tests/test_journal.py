@@ -0,0 +1,97 @@
+import os
+import asyncio
+import tempfile
+
+import pytest
+
+from objects.event import Event
+from utils.journal import Journal
+
+
+def make_journal() -> Journal:
+    return Journal(os.path.join(tempfile.mkdtemp(), 'journal', 'ice.journal'))
+
+
+def recovered(journal: Journal, threshold: float = 60):
+    is_armed, events, acked_event_ids = Journal(journal._path).recover(threshold)
+    return is_armed, [event.id for event in events], acked_event_ids
+
+
+def test_recovers_flushed_records():
+    journal = make_journal()
+    assert recovered(journal) == (None, [], set())
+    events = [Event(f'e{index}', 'motion', 'onvif', 'camera') for index in range(3)]
+
+    async def run() -> None:
+        journal.record_armed(True)
+        for event in events:
+            journal.record_event(event)
+        journal.record_ack('e1')
+        await journal.flush()
+        # Only flushed records survive
+        journal.record_armed(False)
+
+    asyncio.run(run())
+    assert recovered(journal) == (True, ['e0', 'e1', 'e2'], {'e1'})
+    journal.close()
+
+
+def test_compaction_keeps_the_state_and_the_records_after_it():
+    journal = make_journal()
+
+    async def run() -> None:
+        journal.record_armed(True)
+        for index in range(3):
+            journal.record_event(Event(f'e{index}', 'motion', 'onvif', 'camera'))
+        await journal.flush()
+        live = [Event('e2', 'motion', 'onvif', 'camera')]
+        await journal.compact(False, live, {'e2'})
+        journal.record_event(Event('e3', 'person', 'onvif', 'camera'))
+        await journal.flush()
+
+    asyncio.run(run())
+    assert recovered(journal) == (False, ['e2', 'e3'], {'e2'})
+    with open(journal._path, 'rb') as f:
+        assert len(f.readlines()) == 2
+    journal.close()
+
+
+def test_crash_before_the_compacted_journal_is_renamed(monkeypatch):
+    journal = make_journal()
+
+    async def run() -> None:
+        journal.record_armed(True)
+        journal.record_event(Event('e0', 'motion', 'onvif', 'camera'))
+        await journal.flush()
+        journal.record_armed(False)
+        await journal.flush()
+
+        def crash(src, dst):
+            raise OSError('crashed')
+        monkeypatch.setattr(os, 'replace', crash)
+        with pytest.raises(OSError):
+            await journal.compact(False, [], set())
+        monkeypatch.undo()
+
+    asyncio.run(run())
+    # The old journal is intact and nothing is replayed twice
+    assert recovered(journal) == (False, ['e0'], set())
+    journal.close()
+
+
+def test_torn_last_record_and_expired_events_are_skipped():
+    journal = make_journal()
+    old = Event('old', 'motion', 'onvif', 'camera')
+    old.wall_time -= 120
+
+    async def run() -> None:
+        journal.record_event(old)
+        journal.record_event(Event('new', 'motion', 'onvif', 'camera'))
+        journal.record_ack('new')
+        await journal.flush()
+
+    asyncio.run(run())
+    with open(journal._path, 'ab') as f:
+        f.write(b'{"t":"armed","arm')
+    assert recovered(journal, threshold=60) == (None, ['new'], {'new'})
+    journal.close()
@@ -0,0 +1,91 @@
+import asyncio
+
+from onvif_.event_parser import compile_topic_extractors, parse_event_message
+from onvif_.topic_state import TopicStateTracker
+from utils.config import parse_topic_configs
+
+TOPICS = {
+    'tns1:RuleEngine/CellMotionDetector/Motion': {
+        'event': 'motion',
+        'valueName': 'IsMotion'
+    },
+    'tns1:Device/Trigger/DigitalInput': {
+        'event': 'doorbell',
+        'type': 'str',
+        'valueName': 'LogicalState',
+        'activeWhen': ['On', 'Pressed']
+    },
+    'tns1:VideoSource/GlobalSceneChange': {
+        'event': 'tamper',
+        'type': 'int',
+        'valueName': 'State',
+        'activeWhen': '1'
+    }
+}
+
+
+def message(topic: str, name: str, value: str) -> dict:
+    return {
+        'Topic': {'_value_1': topic},
+        'Message': {'_value_1': {'Data': {'SimpleItem': [{'Name': name, 'Value': value}]}}}
+    }
+
+
+def run_tracker(extractors: dict, messages: list) -> list:
+    emitted = []
+
+    async def emit(event_name: str, topic: str, data: dict) -> None:
+        emitted.append(event_name)
+
+    async def run() -> None:
+        tracker = TopicStateTracker(emit)
+        for msg in messages:
+            await tracker.update(parse_event_message(msg, extractors))
+        tracker.close()
+
+    asyncio.run(run())
+    return emitted
+
+
+def test_typed_topics_fire_on_their_active_values():
+    extractors = compile_topic_extractors(parse_topic_configs(TOPICS))
+    emitted = run_tracker(extractors, [
+        message('tns1:RuleEngine/CellMotionDetector/Motion', 'IsMotion', 'true'),
+        message('tns1:Device/Trigger/DigitalInput', 'LogicalState', 'Off'),
+        message('tns1:Device/Trigger/DigitalInput', 'LogicalState', 'Pressed'),
+        message('tns1:Device/Trigger/DigitalInput', 'LogicalState', 'On'),
+        message('tns1:VideoSource/GlobalSceneChange', 'State', '0'),
+        message('tns1:VideoSource/GlobalSceneChange', 'State', '1')
+    ])
+    assert emitted == ['motion', 'doorbell', 'tamper']
+
+
+def test_typed_topics_without_an_active_value_are_skipped():
+    topics = {
+        'tns1:VideoSource/GlobalSceneChange': {'event': 'tamper', 'type': 'int', 'valueName': 'State'},
+        'tns1:Device/Trigger/DigitalInput': {'event': 'doorbell', 'type': 'int', 'valueName': 'State', 'activeWhen': 'on'}
+    }
+    assert [rule.topic for rule in parse_topic_configs(topics)] == ['tns1:Device/Trigger/DigitalInput']
+    # 'on' is not an int
+    assert compile_topic_extractors(parse_topic_configs(topics)) == {}
+
+
+def test_first_active_report_after_a_reset_is_an_edge():
+    emitted = []
+
+    async def emit(event_name: str, topic: str, data: dict) -> None:
+        emitted.append(event_name)
+
+    async def run() -> None:
+        extractors = compile_topic_extractors(parse_topic_configs(TOPICS))
+        motion = parse_event_message(message('tns1:RuleEngine/CellMotionDetector/Motion', 'IsMotion', 'true'), extractors)
+        tracker = TopicStateTracker(emit)
+        assert await tracker.update(motion)
+        assert not await tracker.update(motion)
+        # Resubscribed, the clear in between was missed
+        tracker.reset()
+        assert await tracker.update(motion)
+        tracker.close()
+
+    asyncio.run(run())
+    assert emitted == ['motion', 'motion']
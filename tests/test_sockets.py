@@ -0,0 +1,84 @@
+import asyncio
+
+import socketio
+
+from utils.metrics import CLIENT_OUTBOUND_QUEUE, CLIENT_OUTBOUND_QUEUE_MAX, CLIENT_OUTBOUND_QUEUED
+from utils.sockets import SocketServers
+
+
+async def connect(servers: SocketServers, server: socketio.AsyncServer, eio_sid: str, *rooms: str) -> str:
+    sid = await server.manager.connect(eio_sid, '/')
+    servers._owners[sid] = server
+    servers._connections[server] += 1
+    for room in rooms:
+        await servers.enter_room(sid, room)
+    return sid
+
+
+def make_servers():
+    server = socketio.AsyncServer(async_mode='asgi')
+    servers = SocketServers({'json': server}, max_queue=10)
+    emits = []
+
+    async def emit(event, data=None, to=None, skip_sid=None):
+        emits.append((event, to, skip_sid))
+    server.emit = emit
+    return servers, server, emits
+
+
+def test_droppable_emits_skip_only_the_slow_clients_they_reach():
+    async def run() -> None:
+        servers, server, emits = make_servers()
+        slow = await connect(servers, server, 'slow', 'camera-1')
+        healthy = await connect(servers, server, 'healthy', 'camera-2')
+        servers._queue_grew(slow, 10)
+
+        # To a healthy client
+        await servers.emit('delta', {}, to=healthy, droppable=True)
+        assert emits == [('delta', healthy, None)]
+        # To a room the slow client is not in
+        await servers.emit('event_ignored', {}, to=['camera-2'], droppable=True)
+        assert emits[-1] == ('event_ignored', ['camera-2'], None)
+        assert servers.outbound_metrics['skipped'] == 0
+        assert not servers._resync
+
+        # To a room with the slow client in it
+        await servers.emit('event_ignored', {}, to=['camera-1', 'camera-2'], droppable=True)
+        assert emits[-1] == ('event_ignored', ['camera-1', 'camera-2'], [slow])
+        # To the slow client itself
+        await servers.emit('delta', {}, to=slow, droppable=True)
+        assert len(emits) == 3
+        assert servers.outbound_metrics['skipped'] == 2
+        assert servers._resync == {slow}
+
+    asyncio.run(run())
+
+
+def test_undroppable_emits_reach_slow_clients():
+    async def run() -> None:
+        servers, server, emits = make_servers()
+        slow = await connect(servers, server, 'slow', 'camera-1')
+        servers._queue_grew(slow, 10)
+
+        await servers.emit('event', {}, to=['camera-1'])
+        await servers.emit('ping', {}, to=slow)
+        assert emits == [('event', ['camera-1'], None), ('ping', slow, None)]
+        assert servers.outbound_metrics['skipped'] == 0
+
+    asyncio.run(run())
+
+
+def test_queue_depth_series_only_for_backed_up_clients(monkeypatch):
+    monkeypatch.setattr('utils.sockets.QUEUE_SERIES_LIMIT', 2)
+    servers, _, _ = make_servers()
+    depths = {'idle': 0, 'busy': 4, 'behind': 5, 'slow': 12, 'slower': 30}
+    servers.queue_depths = lambda: depths
+
+    servers.collect_metrics()
+    assert CLIENT_OUTBOUND_QUEUE._values == {('slower',): 30, ('slow',): 12}
+    assert CLIENT_OUTBOUND_QUEUE_MAX._values == {(): 30}
+    assert CLIENT_OUTBOUND_QUEUED._values == {(): 51}
+
+    depths.update(slow=2, slower=3)
+    servers.collect_metrics()
+    assert CLIENT_OUTBOUND_QUEUE._values == {('behind',): 5}
@@ -0,0 +1,72 @@
+import pytest
+
+from benchmarks.bench_template import recursive_replace
+from utils.config import WEBHOOK_PLACEHOLDERS
+from utils.template_replacer import compile_template
+
+REPLACEMENTS = {
+    '$event_id': 'e1',
+    '$event_name': 'motion',
+    '$event_type': 'onvif',
+    '$event_source': 'front-door',
+    '$event_data': {'camera': 'front-door', 'topic': 'tns1:RuleEngine/CellMotionDetector/Motion'},
+    '$event_timestamp': '2026-01-02T03:04:05'
+}
+
+# Templates the previous walk rendered correctly, the compiled plan must agree
+SAME_AS_BEFORE = [
+    '$event_id',
+    '$event_data',
+    'name: $event_name',
+    'id=$event_id;',
+    'no placeholders here',
+    '$unknown',
+    'prefix $unknown suffix',
+    '',
+    'data: $event_data',
+    ['$event_type', 'static', {'nested': '$event_source'}],
+    {'id': '$event_id', 'data': '$event_data', 'count': 3, 'enabled': True, 'missing': None},
+    {'title': 'alarm $event_name', 'labels': ['a', 'b'], 'deep': [{'at': 'at $event_timestamp'}]},
+    7,
+    None
+]
+
+
+@pytest.mark.parametrize('template', SAME_AS_BEFORE)
+def test_renders_like_the_previous_walk(template):
+    compiled = compile_template(template, WEBHOOK_PLACEHOLDERS)
+    assert compiled.render(REPLACEMENTS) == recursive_replace(template, REPLACEMENTS)
+
+
+@pytest.mark.parametrize('template, expected', [
+    # The previous walk stopped after the first placeholder it found in a string
+    ('$event_name from $event_source', 'motion from front-door'),
+    ('$event_name $event_name', 'motion motion'),
+    ('$event_source/$event_type/$event_id at $event_timestamp', 'front-door/onvif/e1 at 2026-01-02T03:04:05'),
+    # Non-string values only replace a whole string, inside text the placeholder stays
+    ('$event_name: $event_data', 'motion: $event_data'),
+    ('$event_name$unknown', 'motion$unknown'),
+    ({'title': '$event_type alarm from $event_source', 'id': '$event_id'},
+     {'title': 'onvif alarm from front-door', 'id': 'e1'})
+])
+def test_substitutes_every_placeholder_of_a_string(template, expected):
+    assert compile_template(template, WEBHOOK_PLACEHOLDERS).render(REPLACEMENTS) == expected
+
+
+def test_placeholders_without_a_value_are_kept():
+    compiled = compile_template({'id': '$event_id', 'text': '$event_name at $event_timestamp'}, WEBHOOK_PLACEHOLDERS)
+    assert compiled.render({'$event_name': 'motion'}) == {'id': '$event_id', 'text': 'motion at $event_timestamp'}
+
+
+def test_longer_placeholders_win_over_their_prefixes():
+    compiled = compile_template('$a and $ab', ['$a', '$ab'])
+    assert compiled.render({'$a': 'short', '$ab': 'long'}) == 'short and long'
+
+
+def test_constant_subtrees_are_shared_between_renders():
+    template = {'static': {'labels': ['a', 'b']}, 'id': '$event_id'}
+    compiled = compile_template(template, WEBHOOK_PLACEHOLDERS)
+    first, second = compiled.render({'$event_id': '1'}), compiled.render({'$event_id': '2'})
+    assert (first['id'], second['id']) == ('1', '2')
+    assert first['static'] is second['static'] is template['static']
+    assert not compile_template(template['static'], WEBHOOK_PLACEHOLDERS).is_dynamic
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from utils.timer_wheel import TimerWheel
+
+# Ticks of a power of two fraction and a whole second start land exactly on tick boundaries
+TICK = .25
+
+
+def make_wheel(slots: int):
+    start = float(int(time.monotonic()) + 1)
+    return TimerWheel(TICK, slots=slots), lambda ticks: start + ticks * TICK
+
+
+def test_keys_expire_once_their_deadline_passed():
+    wheel, at = make_wheel(8)
+    wheel.schedule('a', 1.5 * TICK, now=at(0))
+    wheel.schedule('b', 3 * TICK, now=at(0))
+    assert wheel.expire(now=at(1)) == []
+    assert wheel.expire(now=at(2)) == ['a']
+    assert 'a' not in wheel and 'b' in wheel
+    assert wheel.expire(now=at(3)) == ['b']
+    assert len(wheel) == 0
+
+
+def test_cancel_and_reschedule():
+    wheel, at = make_wheel(8)
+    wheel.schedule('a', 2 * TICK, now=at(0))
+    wheel.schedule('b', 2 * TICK, now=at(0))
+    wheel.cancel('a')
+    # Rescheduling moves the deadline, it doesn't add a second one
+    wheel.schedule('b', 4 * TICK, now=at(1))
+    assert len(wheel) == 1
+    assert wheel.expire(now=at(3)) == []
+    assert wheel.expire(now=at(5)) == ['b']
+    wheel.cancel('b')
+
+
+def test_keys_a_revolution_ahead_stay_in_their_slot():
+    wheel, at = make_wheel(4)
+    wheel.schedule('near', TICK, now=at(0))
+    # Shares the slot of 'near' one revolution later
+    wheel.schedule('far', 5 * TICK, now=at(0))
+    assert wheel.expire(now=at(1)) == ['near']
+    assert wheel.expire(now=at(4)) == []
+    assert wheel.expire(now=at(5)) == ['far']
+
+
+def test_falling_behind_a_revolution_expires_everything_due():
+    wheel, at = make_wheel(4)
+    for index in range(6):
+        wheel.schedule(index, (index + 1) * TICK, now=at(0))
+    wheel.schedule('later', 20 * TICK, now=at(0))
+    assert sorted(wheel.expire(now=at(10))) == list(range(6))
+    assert 'later' in wheel
+
+
+def test_tick_must_be_positive():
+    with pytest.raises(ValueError):
+        TimerWheel(0)
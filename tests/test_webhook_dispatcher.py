@@ -0,0 +1,178 @@
+import asyncio
+from typing import List
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from objects.event import Event
+from utils.config import CONFIG, WEBHOOK_PLACEHOLDERS
+from utils.event_handler import EventHandler
+from utils.template_replacer import compile_template
+from utils.webhook_dispatcher import WebhookDispatcher
+
+
+class Receiver:
+    """Answers with `statuses` in turn, then 200, after `latency` seconds."""
+    def __init__(self, statuses: List[int] = (), latency: float = 0) -> None:
+        self.statuses = list(statuses)
+        self.latency = latency
+        self.requests = 0
+        self.payloads: List = []
+        self.server = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status == 200:
+            self.payloads.append(await request.json())
+        return web.Response(status=status)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/hook', self.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return str(self.server.make_url('/hook'))
+
+    async def close(self) -> None:
+        await self.server.close()
+
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(.01)
+
+
+async def deliver(receiver: Receiver, calls: int, retries: int) -> WebhookDispatcher:
+    url = await receiver.start()
+    dispatcher = WebhookDispatcher(url, 'POST', workers=1, retries=retries, backoff=.001)
+    await dispatcher.start()
+    try:
+        for i in range(calls):
+            assert dispatcher.submit({'json': {'id': i}})
+        await dispatcher.close(5)
+    finally:
+        await receiver.close()
+    return dispatcher
+
+
+def test_retries_server_errors_and_rate_limits():
+    receiver = Receiver([503, 429])
+    dispatcher = asyncio.run(deliver(receiver, 1, retries=3))
+    assert receiver.requests == 3
+    assert receiver.payloads == [{'id': 0}]
+    assert dispatcher.metrics['retried'] == 2
+    assert dispatcher.metrics['sent'] == 1
+    assert dispatcher.metrics['failed'] == 0
+
+
+def test_gives_up_after_max_attempts():
+    receiver = Receiver([500] * 10)
+    dispatcher = asyncio.run(deliver(receiver, 1, retries=2))
+    assert receiver.requests == 3
+    assert dispatcher.metrics['retried'] == 2
+    assert dispatcher.metrics['sent'] == 0
+    assert dispatcher.metrics['failed'] == 1
+
+
+def test_client_errors_are_not_retried():
+    receiver = Receiver([400])
+    dispatcher = asyncio.run(deliver(receiver, 1, retries=3))
+    assert receiver.requests == 1
+    assert dispatcher.metrics['retried'] == 0
+    assert dispatcher.metrics['failed'] == 1
+
+
+def test_close_delivers_queued_calls():
+    receiver = Receiver(latency=.02)
+    dispatcher = asyncio.run(deliver(receiver, 5, retries=0))
+    assert receiver.payloads == [{'id': i} for i in range(5)]
+    assert dispatcher.metrics['sent'] == 5
+    assert not dispatcher.submit({'json': {'id': 5}})
+
+
+def test_close_drops_what_is_left_after_the_timeout():
+    async def run() -> WebhookDispatcher:
+        receiver = Receiver(latency=.5)
+        url = await receiver.start()
+        dispatcher = WebhookDispatcher(url, 'POST', workers=1, retries=0)
+        await dispatcher.start()
+        for i in range(5):
+            dispatcher.submit({'json': {'id': i}})
+        await wait_for(lambda: receiver.requests == 1)
+        await dispatcher.close(.05)
+        await receiver.close()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert dispatcher.metrics['dropped'] == 4
+
+
+def test_reconfigure_drains_the_previous_dispatcher(monkeypatch):
+    webhook_data = {'id': '$event_id'}
+    for name, value in {
+        'webhook_enabled': True,
+        'webhook_method': 'POST',
+        'webhook_data': webhook_data,
+        'webhook_template': compile_template(webhook_data, WEBHOOK_PLACEHOLDERS),
+        'webhook_headers': None,
+        'webhook_workers': 1,
+        'webhook_retries': 0,
+        'webhook_batch_window': 0
+    }.items():
+        monkeypatch.setattr(CONFIG, name, value)
+
+    async def run() -> None:
+        old_receiver = Receiver(latency=.05)
+        new_receiver = Receiver()
+        monkeypatch.setattr(CONFIG, 'webhook_url', await old_receiver.start())
+        handler = EventHandler(None, None)
+        await handler.start()
+        try:
+            for i in range(3):
+                handler.call_webhook(Event(f'old-{i}', 'motion', 'onvif', 'camera'))
+
+            monkeypatch.setattr(CONFIG, 'webhook_url', await new_receiver.start())
+            await handler.reconfigure({'webhook_url'})
+            handler.call_webhook(Event('new', 'motion', 'onvif', 'camera'))
+
+            await wait_for(lambda: len(old_receiver.payloads) == 3 and len(new_receiver.payloads) == 1)
+            assert old_receiver.payloads == [{'id': f'old-{i}'} for i in range(3)]
+            assert new_receiver.payloads == [{'id': 'new'}]
+        finally:
+            await handler.stop()
+            await old_receiver.close()
+            await new_receiver.close()
+
+    asyncio.run(run())
+
+
+def test_raw_body_in_a_batch_window_is_delivered_by_the_worker():
+    async def run() -> WebhookDispatcher:
+        receiver = Receiver()
+        url = await receiver.start()
+        dispatcher = WebhookDispatcher(url, 'POST', workers=1, retries=0, batch_window=.05)
+        deliver_batch = dispatcher._deliver
+
+        async def deliver(batch):
+            if any('data' in item for item in batch):
+                raise RuntimeError('unexpected')
+            await deliver_batch(batch)
+        dispatcher._deliver = deliver
+
+        await dispatcher.start()
+        dispatcher.submit({'json': {'id': 0}})
+        dispatcher.submit({'data': 'raw'})
+        dispatcher.submit({'json': {'id': 1}})
+        await dispatcher.close(5)
+        await receiver.close()
+        assert receiver.payloads == [{'id': 0}, {'id': 1}]
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+    assert dispatcher.metrics['sent'] == 2
+    assert dispatcher.metrics['failed'] == 1
+    assert dispatcher.metrics['dropped'] == 0
@@ -0,0 +1,43 @@
+import json
+
+import msgpack
+from socketio import packet
+
+from utils import wire
+from utils.wire import RawJSON
+
+EVENT = {'id': 'e1', 'event': 'motion', 'source': 'camera'}
+
+
+def raw(value) -> RawJSON:
+    return RawJSON(json.dumps(value), value)
+
+
+class JSONPacket(packet.Packet):
+    json = wire
+
+
+MsgPackPacket = wire.msgpack_packet_class()
+
+
+def test_cached_parts_are_spliced_into_both_formats():
+    data = ['get_result', {'isArmed': True, 'eventList': [raw(EVENT), raw(EVENT)], 'clientList': raw([])}]
+    expected = ['get_result', {'isArmed': True, 'eventList': [EVENT, EVENT], 'clientList': []}]
+    assert json.loads(JSONPacket(packet.EVENT, data=data).encode()[1:]) == expected
+    assert msgpack.loads(MsgPackPacket(packet.EVENT, data=data).encode())['data'] == expected
+
+
+def test_msgpack_packets_with_cached_parts_skip_the_native_attempt(monkeypatch):
+    packed = []
+
+    def packb(obj):
+        packed.append(obj)
+        return msgpack.Packer().pack(obj)
+    monkeypatch.setattr(wire, '_packb', packb)
+
+    MsgPackPacket(packet.EVENT, data=['event', {'event': raw(EVENT)}]).encode()
+    assert not any(isinstance(obj, dict) and 'nsp' in obj for obj in packed)
+
+    packed.clear()
+    MsgPackPacket(packet.EVENT, data=['delta', {'rev': 1}]).encode()
+    assert len(packed) == 1 and packed[0]['data'] == ['delta', {'rev': 1}]
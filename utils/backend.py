@@ -0,0 +1,334 @@
+import os
+import json
+import uuid
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Set
+
+from utils.states import state
+
+if TYPE_CHECKING:
+    from objects.clients import Clients
+
+log = logging.getLogger(__name__)
+
+MessageHandler = Callable[[dict], Awaitable[None]]
+
+SYNC_TIMEOUT = 10
+
+class Backend:
+    """
+    Totally ordered message bus shared by every ice_server worker.
+
+    Each worker keeps a full replica of clients, events and armed state and
+    mutates it only by publishing ops. Every worker (the publisher included)
+    receives every op in the same order, so the replicas stay identical.
+    `publish` returns once the publisher's own handler has applied the op,
+    which gives read-your-writes to the caller.
+
+    The backend also elects a single leader that runs the once-per-cluster
+    duties (ONVIF monitoring, journal).
+    """
+    def __init__(self) -> None:
+        self.worker_id = uuid.uuid4().hex
+        self._handler: Optional[MessageHandler] = None
+
+    def set_handler(self, handler: MessageHandler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, message: dict) -> None:
+        raise NotImplementedError
+
+    def is_leader(self) -> bool:
+        raise NotImplementedError
+
+    async def wait_for_leadership(self) -> None:
+        raise NotImplementedError
+
+    @property
+    def lost(self) -> bool:
+        """Whether this worker was cut off from the other workers."""
+        return False
+
+    async def wait_lost(self) -> None:
+        await asyncio.Future()
+
+
+class InProcessBackend(Backend):
+    """Single worker: ops are applied right away and this worker always leads."""
+    async def publish(self, message: dict) -> None:
+        message['origin'] = self.worker_id
+        await self._handler(message)
+
+    def is_leader(self) -> bool:
+        return True
+
+    async def wait_for_leadership(self) -> None:
+        return
+
+
+class LocalSocketBackend(Backend):
+    """Worker side of the Unix socket `Hub` for multi-process deployments."""
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self._path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._next_mid = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._leader = asyncio.Event()
+        self._welcomed = asyncio.Event()
+        self._lost = asyncio.Event()
+
+    async def start(self) -> None:
+        self._reader, self._writer = await asyncio.open_unix_connection(self._path, limit=2 ** 24)
+        self._read_task = asyncio.create_task(self._read_loop())
+        await self._send({'hub': 'hello', 'worker': self.worker_id})
+        await self._welcomed.wait()
+        log.info(f'Worker {self.worker_id} joined hub at {self._path} (leader: {self.is_leader()}).')
+
+    async def stop(self) -> None:
+        if self._read_task is not None:
+            self._read_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    async def _send(self, message: dict) -> None:
+        self._writer.write(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+        await self._writer.drain()
+
+    async def publish(self, message: dict) -> None:
+        if self._lost.is_set():
+            raise ConnectionError('Lost connection to the cluster hub.')
+        self._next_mid += 1
+        mid = self._next_mid
+        message['origin'] = self.worker_id
+        message['mid'] = mid
+        future = asyncio.get_running_loop().create_future()
+        self._pending[mid] = future
+        try:
+            await self._send(message)
+        except ConnectionError:
+            self._pending.pop(mid, None)
+            raise
+        await future
+
+    def is_leader(self) -> bool:
+        return self._leader.is_set()
+
+    async def wait_for_leadership(self) -> None:
+        await self._leader.wait()
+
+    @property
+    def lost(self) -> bool:
+        return self._lost.is_set()
+
+    async def wait_lost(self) -> None:
+        await self._lost.wait()
+
+    def _set_lost(self) -> None:
+        """Fails every publish waiting on the hub, replication can't continue."""
+        log.critical('Lost connection to the cluster hub.')
+        self._lost.set()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Lost connection to the cluster hub.'))
+        self._pending.clear()
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                try:
+                    line = await self._reader.readline()
+                except ConnectionError:
+                    line = b''
+                if not line:
+                    self._set_lost()
+                    break
+                message = json.loads(line)
+
+                control = message.get('hub')
+                if control == 'welcome':
+                    if message.get('leader'):
+                        self._leader.set()
+                    self._welcomed.set()
+                    continue
+                if control == 'leader':
+                    log.info(f'Worker {self.worker_id} was promoted to cluster leader.')
+                    self._leader.set()
+                    continue
+
+                try:
+                    await self._handler(message)
+                except Exception as e:
+                    log.error(f'Failed to apply cluster op \'{message.get("op")}\': {e}')
+
+                if message.get('origin') == self.worker_id:
+                    future = self._pending.pop(message.get('mid'), None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+        except asyncio.CancelledError:
+            pass
+
+
+class Hub:
+    """
+    Sequencer for `LocalSocketBackend` workers, run by the supervisor.
+
+    Every op line from any worker is written to all workers before the next
+    one is handled, which defines the single total order. Leadership goes to
+    the oldest connected worker and moves on when it disconnects.
+
+    A worker that disconnects, crashed or not, is announced to the others
+    with a `worker_gone` op so they drop the clients it was serving.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: List[asyncio.StreamWriter] = []
+        self._workers: List[asyncio.StreamWriter] = []
+        # Worker connection -> the worker id it introduced itself with
+        self._worker_ids: Dict[asyncio.StreamWriter, str] = {}
+
+    async def start(self) -> None:
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = await asyncio.start_unix_server(self._handle, self._path, limit=2 ** 24)
+        log.info(f'Cluster hub listening on {self._path}.')
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.append(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                if line.startswith(b'{"hub"'):
+                    message = json.loads(line)
+                    if message.get('hub') == 'hello':
+                        self._workers.append(writer)
+                        self._worker_ids[writer] = message['worker']
+                        writer.write(self._encode({'hub': 'welcome', 'leader': self._workers[0] is writer}))
+                    continue
+
+                await self._broadcast(line)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.remove(writer)
+            was_leader = bool(self._workers) and self._workers[0] is writer
+            if writer in self._workers:
+                self._workers.remove(writer)
+            if was_leader and self._workers:
+                self._workers[0].write(self._encode({'hub': 'leader'}))
+            writer.close()
+            worker_id = self._worker_ids.pop(writer, None)
+            if worker_id is not None and self._writers and self._server.is_serving():
+                log.warning(f'Worker {worker_id} left the cluster, dropping its clients.')
+                await self._broadcast(self._encode({'op': 'worker_gone', 'worker': worker_id}))
+
+    async def _broadcast(self, line: bytes) -> None:
+        # Write to every worker before awaiting, this is the total order
+        for target in self._writers:
+            target.write(line)
+        for target in list(self._writers):
+            try:
+                await target.drain()
+            except ConnectionError:
+                pass
+
+
+class ReplicaSync:
+    """
+    Brings a worker that joins a running cluster up to date.
+
+    The joining worker publishes `sync_request` and buffers every op that
+    follows it. The leader answers with a copy of its replica taken exactly
+    at the request's position in the op order, so loading that copy and
+    replaying the buffer leaves the new replica identical to the others.
+    """
+    def __init__(self,
+                 backend: Backend,
+                 clients_instance: 'Clients',
+                 apply: MessageHandler,
+                 timeout: float = SYNC_TIMEOUT):
+        self._backend = backend
+        self._clients = clients_instance
+        self._apply = apply
+        self._timeout = timeout
+        self._buffer: Optional[List[dict]] = None
+        self._synced = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def request(self) -> None:
+        await self._backend.publish({'op': 'sync_request'})
+        try:
+            await asyncio.wait_for(self._synced.wait(), self._timeout)
+            log.info('Replica synchronized with cluster leader.')
+        except asyncio.TimeoutError:
+            log.error('Cluster leader did not answer the sync request, continuing with a partial replica.')
+            await self._replay()
+
+    async def handle(self, message: dict) -> None:
+        op = message['op']
+        is_own = message.get('origin') == self._backend.worker_id
+
+        if op == 'sync_request':
+            if is_own:
+                self._buffer = []
+            elif self._backend.is_leader():
+                snapshot = {
+                    'isArmed': state.is_armed(),
+                    'clients': self._clients.export_state()
+                }
+                # Publishing from the read path would wait on itself
+                task = asyncio.create_task(self._backend.publish({
+                    'op': 'sync_state',
+                    'target': message['origin'],
+                    'state': snapshot
+                }))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return
+
+        if op == 'sync_state':
+            if message['target'] == self._backend.worker_id and self._buffer is not None:
+                state.set_armed(message['state']['isArmed'])
+                self._clients.import_state(message['state']['clients'])
+                await self._replay()
+                self._synced.set()
+            return
+
+        if self._buffer is not None:
+            self._buffer.append(message)
+            return
+        await self._apply(message)
+
+    async def _replay(self) -> None:
+        buffered, self._buffer = self._buffer or [], None
+        for message in buffered:
+            await self._apply(message)
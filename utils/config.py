@@ -1,21 +1,111 @@
+import os
 import json
+import asyncio
 import logging
-from typing import List, Union
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple, Union
+
+from utils.template_replacer import CompiledTemplate, compile_template
+from utils.metrics import CONFIG_RELOADS
 
 CONFIG_PATH = '/config.json'
 
+WEBHOOK_PLACEHOLDERS = (
+    '$event_id',
+    '$event_name',
+    '$event_type',
+    '$event_source',
+    '$event_data',
+    '$event_timestamp'
+)
+
+# Topics monitored when the onvif block doesn't configure any
+DEFAULT_ONVIF_TOPICS = {
+    'tns1:RuleEngine/CellMotionDetector/Motion': {
+        'event': 'motion',
+        'type': 'bool',
+        'valueName': 'IsMotion'
+    },
+    'tns1:RuleEngine/PeopleDetector/People': {
+        'event': 'person',
+        'type': 'bool',
+        'valueName': 'IsPeople'
+    }
+}
+
+# What happens to a client whose queue reaches `disconnectQueue`, see SocketServers
+OUTBOUND_POLICIES = ('disconnect', 'drop')
+
+# How often the config file is checked for changes
+CONFIG_POLL_INTERVAL = 1
+
+# Settings a running server keeps until it is restarted
+RESTART_SETTINGS = (
+    'host',
+    'port',
+    'liveness_tick',
+    'journal_enabled',
+    'journal_path',
+    'journal_compact_interval',
+    'cluster_workers',
+    'cluster_socket_path'
+)
+# Derived from other settings, never compared on their own
+DERIVED_SETTINGS = ('webhook_template',)
+
 log = logging.getLogger(__name__)
 
+class CameraConfig:
+    def __init__(self, camera_id: str, host: str, port: int, username: str, password: str) -> None:
+        self.id = camera_id
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CameraConfig) and vars(self) == vars(other)
+
+class TopicConfig:
+    def __init__(self, topic: str, event: str, value_type: str, value_name: str, active_when: Any = True) -> None:
+        self.topic = topic
+        self.event = event
+        self.value_type = value_type
+        self.value_name = value_name
+        # Value (or list of values) of the item that means the topic is active
+        self.active_when = active_when
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, TopicConfig) and vars(self) == vars(other)
+
+def parse_topic_configs(topic_confs: dict) -> List[TopicConfig]:
+    topics = []
+    for topic, topic_conf in topic_confs.items():
+        value_type = topic_conf.get('type', 'bool')
+        # Only booleans have an obvious active value
+        if value_type != 'bool' and 'activeWhen' not in topic_conf:
+            log.error(f'Topic {topic} of type \'{value_type}\' has no \'activeWhen\' value, skipping topic.')
+            continue
+        topics.append(TopicConfig(
+            topic,
+            topic_conf['event'],
+            value_type,
+            topic_conf['valueName'],
+            topic_conf.get('activeWhen', True)
+        ))
+    return topics
+
 class Config:
     def __init__(self):
         self.host = '0.0.0.0'
         self.port = 8080
 
         self.onvif_enabled: bool = False
-        self.onvif_host: str = None
-        self.onvif_port: int = None
-        self.onvif_username: str = None
-        self.onvif_password: str = None
+        self.onvif_cameras: List[CameraConfig] = []
+        self.onvif_cache_path: str = None
+        self.onvif_topics: List[TopicConfig] = parse_topic_configs(DEFAULT_ONVIF_TOPICS)
+        self.onvif_keep_raw_message: bool = False
+        self.onvif_coalesce_window: float = 5
+        self.onvif_emit_cleared: bool = False
 
         self.go2rtc_host: str = None
         self.go2rtc_src: str = None
@@ -24,59 +114,229 @@ class Config:
         self.webhook_url: str = None
         self.webhook_method: str = None
         self.webhook_data: Union[str, dict] = None
+        self.webhook_template: CompiledTemplate = compile_template(None, WEBHOOK_PLACEHOLDERS)
         self.webhook_headers: dict = None
         self.webhook_on_ignored: bool = False
         self.webhook_on_event_type: List[str] = []
         self.webhook_on_event_source: List[str] = []
+        self.webhook_workers: int = 4
+        self.webhook_queue_size: int = 1000
+        self.webhook_timeout: float = 5
+        self.webhook_retries: int = 3
+        self.webhook_backoff: float = .5
+        self.webhook_batch_window: float = 0
+        self.webhook_batch_size: int = 50
 
-        config_data = {}
+        self.client_removal_threshold: float = 1
+        self.event_removal_threshold: float = 15
+        self.liveness_tick: float = .1
 
-        try:
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config_data = json.load(f)
-                log.info('Successfully loaded config file.')
+        self.outbound_max_queue: int = 64
+        self.outbound_disconnect_queue: int = 512
+        self.outbound_policy: str = 'disconnect'
 
-        except Exception as e:
-            log.critical(f'Failed to load config file: {e}')
+        self.journal_enabled: bool = False
+        self.journal_path: str = None
+        self.journal_fsync_interval: float = .05
+        self.journal_compact_interval: float = 60
 
-        try:
-            # Load Server Config
-            self.host = config_data.get('host', '0.0.0.0')
-            self.port = config_data.get('port', 8080)
-
-            # Load ONVIF Config
-            onvif_conf = config_data.get('onvif', {})
-            self.onvif_host = onvif_conf.get('host', None)
-            self.onvif_port = onvif_conf.get('port', 80)
-            self.onvif_username = onvif_conf.get('username', '')
-            self.onvif_password = onvif_conf.get('password', '')
-
-            if isinstance(self.onvif_host, str) and self.onvif_host != '':
-                self.onvif_enabled = True
-            else:
-                self.onvif_enabled = False
-
-            # Load go2rtc Stream Config
-            go2rtc_conf = config_data.get('go2rtc', {})
-            self.go2rtc_host = go2rtc_conf.get('host', None)
-            self.go2rtc_src = go2rtc_conf.get('src', None)
-
-            # Load Webhook Config
-            webhook_conf = config_data.get('webhook', {})
-            self.webhook_url = webhook_conf.get('url', None)
-            self.webhook_method = webhook_conf.get('method', 'GET')
-            self.webhook_data = webhook_conf.get('data', None)
-            self.webhook_headers = webhook_conf.get('headers', None)
-            self.webhook_on_ignored = webhook_conf.get('onIgnored', False)
-            self.webhook_on_event_type = webhook_conf.get('onEventType', [])
-            self.webhook_on_event_source = webhook_conf.get('onEventSource', [])
-
-            if isinstance(self.webhook_url, str) and self.webhook_url != '':
-                self.webhook_enabled = True
-            else:
-                self.webhook_enabled = False
+        self.cluster_workers: int = 1
+        self.cluster_socket_path: str = '/tmp/ice_server.sock'
+
+    def parse(self, config_data: dict) -> None:
+        """Reads the settings of a config file, raises if one is invalid."""
+        # Load Server Config
+        self.host = config_data.get('host', '0.0.0.0')
+        self.port = config_data.get('port', 8080)
+
+        # Load ONVIF Config
+        onvif_conf = config_data.get('onvif', {})
+        # A single camera may still be configured directly in the onvif block,
+        # entries in `cameras` fall back to the block's port and credentials.
+        camera_confs = onvif_conf.get('cameras', [onvif_conf])
+        self.onvif_cameras = []
+        for camera_conf in camera_confs:
+            camera_host = camera_conf.get('host', None)
+            if not isinstance(camera_host, str) or camera_host == '':
+                continue
+            camera_id = str(camera_conf.get('id', camera_host))
+            if any(camera.id == camera_id for camera in self.onvif_cameras):
+                log.error(f'Duplicate ONVIF camera id \'{camera_id}\', skipping camera.')
+                continue
+            self.onvif_cameras.append(CameraConfig(
+                camera_id,
+                camera_host,
+                int(camera_conf.get('port', onvif_conf.get('port', 80))),
+                camera_conf.get('username', onvif_conf.get('username', '')),
+                camera_conf.get('password', onvif_conf.get('password', ''))
+            ))
+
+        self.onvif_enabled = len(self.onvif_cameras) > 0
+        self.onvif_cache_path = onvif_conf.get('cachePath', None)
+        self.onvif_topics = parse_topic_configs(onvif_conf.get('topics', DEFAULT_ONVIF_TOPICS))
+        self.onvif_keep_raw_message = onvif_conf.get('keepRawMessage', False)
+        self.onvif_coalesce_window = float(onvif_conf.get('coalesceWindow', 5))
+        self.onvif_emit_cleared = onvif_conf.get('emitCleared', False)
+
+        # Load go2rtc Stream Config
+        go2rtc_conf = config_data.get('go2rtc', {})
+        self.go2rtc_host = go2rtc_conf.get('host', None)
+        self.go2rtc_src = go2rtc_conf.get('src', None)
+
+        # Load Webhook Config
+        webhook_conf = config_data.get('webhook', {})
+        self.webhook_url = webhook_conf.get('url', None)
+        self.webhook_method = webhook_conf.get('method', 'GET')
+        self.webhook_data = webhook_conf.get('data', None)
+        self.webhook_template = compile_template(self.webhook_data, WEBHOOK_PLACEHOLDERS)
+        self.webhook_headers = webhook_conf.get('headers', None)
+        self.webhook_on_ignored = webhook_conf.get('onIgnored', False)
+        self.webhook_on_event_type = webhook_conf.get('onEventType', [])
+        self.webhook_on_event_source = webhook_conf.get('onEventSource', [])
+        self.webhook_workers = int(webhook_conf.get('workers', 4))
+        self.webhook_queue_size = int(webhook_conf.get('queueSize', 1000))
+        self.webhook_timeout = float(webhook_conf.get('timeout', 5))
+        self.webhook_retries = int(webhook_conf.get('retries', 3))
+        self.webhook_backoff = float(webhook_conf.get('backoff', .5))
+        self.webhook_batch_window = float(webhook_conf.get('batchWindow', 0))
+        self.webhook_batch_size = int(webhook_conf.get('batchSize', 50))
+
+        if isinstance(self.webhook_url, str) and self.webhook_url != '':
+            self.webhook_enabled = True
+        else:
+            self.webhook_enabled = False
 
+        # Load Liveness Config
+        liveness_conf = config_data.get('liveness', {})
+        self.client_removal_threshold = float(liveness_conf.get('clientRemovalThreshold', 1))
+        self.event_removal_threshold = float(liveness_conf.get('eventRemovalThreshold', 15))
+        self.liveness_tick = float(liveness_conf.get('tick', .1))
+
+        # Load Outbound Config
+        outbound_conf = config_data.get('outbound', {})
+        self.outbound_max_queue = int(outbound_conf.get('maxQueue', 64))
+        self.outbound_disconnect_queue = int(outbound_conf.get('disconnectQueue', 512))
+        self.outbound_policy = outbound_conf.get('policy', 'disconnect')
+        if self.outbound_policy not in OUTBOUND_POLICIES:
+            log.error(f'Unknown outbound policy \'{self.outbound_policy}\', using \'disconnect\'.')
+            self.outbound_policy = 'disconnect'
+
+        # Load Journal Config
+        journal_conf = config_data.get('journal', {})
+        self.journal_path = journal_conf.get('path', None)
+        self.journal_fsync_interval = float(journal_conf.get('fsyncInterval', .05))
+        self.journal_compact_interval = float(journal_conf.get('compactInterval', 60))
+
+        if isinstance(self.journal_path, str) and self.journal_path != '':
+            self.journal_enabled = True
+        else:
+            self.journal_enabled = False
+
+        # Load Cluster Config
+        cluster_conf = config_data.get('cluster', {})
+        self.cluster_workers = max(int(cluster_conf.get('workers', 1)), 1)
+        self.cluster_socket_path = cluster_conf.get('socketPath', '/tmp/ice_server.sock')
+
+ConfigListener = Callable[[Set[str]], Awaitable[None]]
+
+def read_config_file(path: str = CONFIG_PATH) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        config_data = json.load(f)
+    if not isinstance(config_data, dict):
+        raise ValueError('expected a JSON object')
+    return config_data
+
+def load_config(path: str = CONFIG_PATH) -> Config:
+    """Loads the config at startup, settings that can't be read keep their defaults."""
+    config = Config()
+    try:
+        config_data = read_config_file(path)
+        log.info('Successfully loaded config file.')
+    except Exception as e:
+        log.critical(f'Failed to load config file: {e}')
+        return config
+
+    try:
+        config.parse(config_data)
+    except Exception as e:
+        log.critical(f'Failed to parse config file: {e}')
+    return config
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+class ConfigWatcher:
+    """
+    Polls the config file and applies its changes to the running `config`.
+
+    A changed file is parsed into a fresh Config first and ignored as a
+    whole if that fails, so a broken or half-written file never reaches the
+    server. The changed settings are then copied into `config` in one step,
+    without awaiting, and the listeners are called with their names to
+    re-initialize whatever they built from them. Settings in
+    RESTART_SETTINGS keep their running values.
+    """
+    def __init__(self, config: Config, path: str = CONFIG_PATH, interval: float = CONFIG_POLL_INTERVAL) -> None:
+        self._config = config
+        self._path = path
+        self._interval = interval
+        self._signature = file_signature(path)
+        self._listeners: List[ConfigListener] = []
+        self.metrics = {
+            'applied': 0,
+            'rejected': 0
+        }
+
+    def add_listener(self, listener: ConfigListener) -> None:
+        self._listeners.append(listener)
+
+    def collect_metrics(self) -> None:
+        for outcome, count in self.metrics.items():
+            CONFIG_RELOADS.set(count, outcome=outcome)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            signature = file_signature(self._path)
+            if signature != self._signature:
+                self._signature = signature
+                await self.reload()
+
+    async def reload(self) -> Set[str]:
+        """Re-reads the config file, returns the names of the settings applied."""
+        config = Config()
+        try:
+            config.parse(read_config_file(self._path))
         except Exception as e:
-            log.critical(f'Failed to parse config file: {e}')
+            log.error(f'Ignoring changed config file: {e}')
+            self.metrics['rejected'] += 1
+            return set()
+
+        changed = {name for name, value in vars(config).items()
+                   if name not in DERIVED_SETTINGS and getattr(self._config, name) != value}
+        pending_restart = changed.intersection(RESTART_SETTINGS)
+        if pending_restart:
+            log.warning(f'Changed settings {", ".join(sorted(pending_restart))} take effect after a restart.')
+            changed -= pending_restart
+
+        for name in changed:
+            setattr(self._config, name, getattr(config, name))
+        if 'webhook_data' in changed:
+            self._config.webhook_template = config.webhook_template
+        self.metrics['applied'] += 1
+        if not changed:
+            return changed
+
+        log.info(f'Reloaded config file, changed: {", ".join(sorted(changed))}.')
+        for listener in self._listeners:
+            try:
+                await listener(changed)
+            except Exception as e:
+                log.error(f'Failed to apply config change: {e}')
+        return changed
 
-CONFIG = Config()
\ No newline at end of file
+CONFIG = load_config()
\ No newline at end of file
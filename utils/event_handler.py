@@ -1,18 +1,18 @@
-from typing import Tuple, TYPE_CHECKING
+from typing import Dict, Optional, Set, Tuple, TYPE_CHECKING
 
-import logging
 import asyncio
-import socketio
-
-import aiohttp
+import logging
 
 from utils.config import CONFIG
 from utils.states import state
-from utils.template_replacer import recursive_replace
+from utils.metrics import EMITS, EMIT_RECIPIENTS, STAGE_LATENCY, WEBHOOK_DELIVERIES, WEBHOOK_QUEUE_DEPTH
 
 if TYPE_CHECKING:
+    from utils.sockets import SocketServers
     from objects.event import Event
     from objects.clients import Clients
+    from utils.backend import Backend
+    from utils.webhook_dispatcher import WebhookDispatcher
 
 VALIDITY_CHECK_TARGET_EVENT_NAMES = [
     # Empty at the moment
@@ -21,27 +21,110 @@ VALIDITY_CHECK_TARGET_EVENT_TYPES = [
     'onvif'
 ]
 
+# Settings the webhook dispatcher is built from, the others are read per call
+WEBHOOK_DISPATCHER_SETTINGS = {
+    'webhook_enabled',
+    'webhook_url',
+    'webhook_method',
+    'webhook_headers',
+    'webhook_workers',
+    'webhook_queue_size',
+    'webhook_timeout',
+    'webhook_retries',
+    'webhook_backoff',
+    'webhook_batch_window',
+    'webhook_batch_size'
+}
+# How long a replaced dispatcher may keep delivering its queued calls
+WEBHOOK_DRAIN_TIMEOUT = 30
+
 log = logging.getLogger(__name__)
 
 class EventHandler:
+    """
+    Decides whether an event is accepted and fans it out.
+
+    The decision is taken on the worker that received the event, then a
+    `broadcast` op carries it to every worker, which buffers accepted events
+    and emits to its own sockets in `apply`. Webhooks are called by the
+    receiving worker only.
+    """
     def __init__(self,
-                 socketio_instance: socketio.AsyncServer,
-                 clients_instance: 'Clients'):
+                 socketio_instance: 'SocketServers',
+                 clients_instance: 'Clients',
+                 backend: Optional['Backend'] = None):
         self._sio = socketio_instance
         self._clients = clients_instance
+        self._backend = backend
+        self._webhook: Optional['WebhookDispatcher'] = None
+        # Replaced dispatchers still delivering their queue, and the totals of those done
+        self._retiring: Dict[asyncio.Task, 'WebhookDispatcher'] = {}
+        self._retired_metrics: Dict[str, int] = {}
+
+    async def start(self) -> None:
+        if CONFIG.webhook_enabled:
+            # Imported with the first enabled webhook
+            from utils.webhook_dispatcher import WebhookDispatcher
+
+            self._webhook = WebhookDispatcher(
+                CONFIG.webhook_url,
+                CONFIG.webhook_method,
+                CONFIG.webhook_headers if isinstance(CONFIG.webhook_headers, dict) else None,
+                workers=CONFIG.webhook_workers,
+                queue_size=CONFIG.webhook_queue_size,
+                timeout=CONFIG.webhook_timeout,
+                retries=CONFIG.webhook_retries,
+                backoff=CONFIG.webhook_backoff,
+                batch_window=CONFIG.webhook_batch_window,
+                batch_size=CONFIG.webhook_batch_size
+            )
+            await self._webhook.start()
+
+    async def stop(self) -> None:
+        if self._webhook is not None:
+            await self._webhook.stop()
+            self._webhook = None
+        retiring = list(self._retiring.items())
+        for task, _ in retiring:
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in retiring), return_exceptions=True)
+        # The cancel may land while `close` is stopping the dispatcher
+        for _, dispatcher in retiring:
+            await dispatcher.stop()
+
+    async def reconfigure(self, changed: Set[str]) -> None:
+        """Config listener, replaces the webhook dispatcher when its settings changed."""
+        if changed.isdisjoint(WEBHOOK_DISPATCHER_SETTINGS):
+            return
+        previous = self._webhook
+        self._webhook = None
+        await self.start()
+        if previous is not None:
+            # Calls queued before the change still go out, with the old settings
+            task = asyncio.create_task(previous.close(WEBHOOK_DRAIN_TIMEOUT))
+            self._retiring[task] = previous
+            task.add_done_callback(self._retire)
+
+    def _retire(self, task: asyncio.Task) -> None:
+        dispatcher = self._retiring.pop(task)
+        for outcome, count in dispatcher.metrics.items():
+            self._retired_metrics[outcome] = self._retired_metrics.get(outcome, 0) + count
+
+    def call_webhook(self, event: 'Event') -> None:
+        if self._webhook is None:
+            return
 
-    async def call_webhook(self, event: 'Event') -> None:
         request_kwargs = {}
 
         replacements_map = {
-            '$event_id': str(event.id),
+            '$event_id': event.id,
             '$event_name': event.event,
             '$event_type': event.type,
             '$event_source': event.source,
             '$event_data': event.data,
             '$event_timestamp': event.timestamp.isoformat()
         }
-        replaced_data = recursive_replace(CONFIG.webhook_data, replacements_map)
+        replaced_data = CONFIG.webhook_template.render(replacements_map)
 
         # Append data
         if isinstance(CONFIG.webhook_data, dict):
@@ -49,55 +132,64 @@ class EventHandler:
         elif isinstance(CONFIG.webhook_data, str):
             request_kwargs['data'] = replaced_data
 
-        # Append headers
-        if isinstance(CONFIG.webhook_headers, dict):
-            request_kwargs['headers'] = CONFIG.webhook_headers
-
-        # Call webhook
-        try:
-            async with aiohttp.ClientSession() as session:
-                method = CONFIG.webhook_method.upper()
-                url = CONFIG.webhook_url
-
-                if method == 'GET':
-                    log.info(f'Firing GET webhook to {url}...')
-                    async with session.get(url, **request_kwargs) as response:
-                        log.debug(f"Webhook response status: {response.status}")
-                elif method == 'POST':
-                    log.info(f'Firing POST webhook to {url}...')
-                    async with session.post(url, **request_kwargs) as response:
-                        log.debug(f"Webhook response status: {response.status}")
-                else:
-                    log.error(f"Unsupported HTTP method: {CONFIG.webhook_method}")
-        except aiohttp.ClientError as e:
-            log.error(f"Webhook call failed: {e}")
+        self._webhook.submit(request_kwargs)
+
+    def collect_metrics(self) -> None:
+        dispatchers = list(self._retiring.values())
+        if self._webhook is not None:
+            dispatchers.append(self._webhook)
+        if not dispatchers and not self._retired_metrics:
+            return
+        totals = dict(self._retired_metrics)
+        for dispatcher in dispatchers:
+            for outcome, count in dispatcher.metrics.items():
+                totals[outcome] = totals.get(outcome, 0) + count
+        for outcome, count in totals.items():
+            WEBHOOK_DELIVERIES.set(count, outcome=outcome)
+        WEBHOOK_QUEUE_DEPTH.set(sum(dispatcher.queue_depth() for dispatcher in dispatchers))
 
     async def broadcast(self, event: 'Event') -> Tuple[str, str]:
-        is_previous_event_valid = await self._clients.is_previous_event_valid(event.event)
+        with STAGE_LATENCY.time(stage='broadcast'):
+            return await self._broadcast(event)
+
+    async def _broadcast(self, event: 'Event') -> Tuple[str, str]:
+        is_previous_event_valid = await self._clients.is_previous_event_valid(event.event, event.source)
         broadcast_type = 'event_ignored'
         result = ''
-        payload = {
-            'event': event.to_dict(json_friendly=True)
-        }
         if (is_previous_event_valid and
             ((event.event in VALIDITY_CHECK_TARGET_EVENT_NAMES) or
              (event.type in VALIDITY_CHECK_TARGET_EVENT_TYPES))):
             log.debug(f'Event \'{event.event}\' ignored. (reason: Previous event still valid)')
-            payload['reason'] = 'previous_valid'
+            payload = {
+                'event': event.to_dict(json_friendly=True),
+                'reason': 'previous_valid'
+            }
             result = 'ignored'
         else:
             if state.is_armed():
                 log.info(f'Event \'{event.event}\' accepted. Broadcasting event...')
                 broadcast_type = 'event'
                 result = 'success'
-                await self._clients.add_event(event)
+                payload = {
+                    'event': self._clients.event_op(event)['event']
+                }
             else:
                 log.debug(f'Event \'{event.event}\' ignored. (reason: ICE is disarmed)')
-                payload['reason'] = 'not_armed'
+                payload = {
+                    'event': event.to_dict(json_friendly=True),
+                    'reason': 'not_armed'
+                }
                 result = 'ignored'
 
-
-        await self._sio.emit(broadcast_type, payload)
+        message = {
+            'op': 'broadcast',
+            'type': broadcast_type,
+            'payload': payload
+        }
+        if self._backend is None:
+            await self.apply(message)
+        else:
+            await self._backend.publish(message)
 
         # Call webhook if enabled
         if CONFIG.webhook_enabled and (broadcast_type == 'event' or CONFIG.webhook_on_ignored):
@@ -106,6 +198,22 @@ class EventHandler:
             if len(CONFIG.webhook_on_event_source) > 0 and event.source not in CONFIG.webhook_on_event_source:
                 return result, broadcast_type
 
-            asyncio.create_task(self.call_webhook(event))
+            self.call_webhook(event)
 
         return result, broadcast_type
+
+    async def apply(self, message: dict) -> None:
+        broadcast_type = message['type']
+        payload = message['payload']
+        event_obj = payload['event']
+        if broadcast_type == 'event':
+            event = self._clients.apply_event(payload)
+            payload = {'event': event.to_json()}
+
+        # Only the clients subscribed to the event's type and source receive it
+        rooms = self._clients.event_rooms(event_obj['type'], event_obj['source'], broadcast_type == 'event')
+        with STAGE_LATENCY.time(stage='emit'):
+            await self._sio.emit(broadcast_type, payload, to=rooms,
+                                 droppable=broadcast_type != 'event' or self._sio.drops_alarms)
+        EMITS.inc(message=broadcast_type)
+        EMIT_RECIPIENTS.inc(self._clients.local_subscriber_count(rooms), message=broadcast_type)
@@ -0,0 +1,185 @@
+import os
+import json
+import mmap
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from objects.event import Event
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FSYNC_INTERVAL = .05
+DEFAULT_COMPACT_INTERVAL = 60
+DEFAULT_COMPACT_SIZE = 4 * 1024 * 1024
+
+class Journal:
+    """
+    Optional append-only journal of accepted events, armed-state changes
+    and acks.
+
+    `record_*` calls only buffer a line in memory, the buffer is written and
+    fsync'ed in batches by `flush`. `compact` replaces the journal with a new
+    one that starts with a snapshot of the live state, so recovery only has
+    to read the snapshot plus a short tail. The new journal is renamed over
+    the old one, a crash leaves one or the other, never a snapshot next to
+    records it already covers.
+    """
+    def __init__(self,
+                 path: str,
+                 compact_interval: float = DEFAULT_COMPACT_INTERVAL,
+                 compact_size: int = DEFAULT_COMPACT_SIZE) -> None:
+        self._path = path
+        self._compact_interval = compact_interval
+        self._compact_size = compact_size
+        self._pending: List[bytes] = []
+        self._lock = asyncio.Lock()
+        self._file = None
+        # Bytes appended since the snapshot (or since opening the file)
+        self._size = 0
+        self._last_compacted = time.monotonic()
+
+    def _append(self, record: dict) -> None:
+        self._pending.append(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def record_event(self, event: Event) -> None:
+        self._append({'t': 'event', 'event': event.to_dict(json_friendly=True)})
+
+    def record_armed(self, is_armed: bool) -> None:
+        self._append({'t': 'armed', 'armed': is_armed})
+
+    def record_ack(self, event_id: str) -> None:
+        self._append({'t': 'ack', 'id': str(event_id)})
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self._path, 'ab')
+            self._size = os.fstat(self._file.fileno()).st_size
+        return self._file
+
+    def _write(self, records: List[bytes]) -> None:
+        journal_file = self._open()
+        data = b''.join(records)
+        journal_file.write(data)
+        journal_file.flush()
+        self._size += len(data)
+        os.fsync(journal_file.fileno())
+
+    async def flush(self) -> None:
+        """Writes and fsyncs every buffered record in one batch."""
+        async with self._lock:
+            if not self._pending:
+                return
+            records, self._pending = self._pending, []
+            await asyncio.to_thread(self._write, records)
+
+    def needs_compaction(self) -> bool:
+        if self._file is None:
+            return False
+        if time.monotonic() - self._last_compacted >= self._compact_interval:
+            return True
+        return self._size >= self._compact_size
+
+    def _write_snapshot(self, snapshot: bytes) -> None:
+        directory = os.path.dirname(self._path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self._path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        # Makes the rename itself durable
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        # The append handle still points at the replaced file
+        self.close()
+        self._open()
+        self._size = 0
+
+    async def compact(self, is_armed: bool, events: List[Event], acked_event_ids: Set[str]) -> None:
+        """
+        Replaces the journal with a snapshot of the given state. The caller
+        must gather the state and call this without awaiting in between, so
+        that every record buffered so far is covered by the snapshot.
+        """
+        snapshot = json.dumps({
+            't': 'snapshot',
+            'armed': is_armed,
+            'events': [event.to_dict(json_friendly=True) for event in events],
+            'acked': sorted(acked_event_ids)
+        }, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._pending = []
+
+        async with self._lock:
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+        self._last_compacted = time.monotonic()
+        log.debug(f'Compacted journal to a snapshot of {len(events)} events.')
+
+    def recover(self, event_removal_threshold: float) -> Tuple[Optional[bool], List[Event], Set[str]]:
+        """
+        Rebuilds state from the journal's snapshot and the records after it.
+
+        Returns the last armed flag (None if never recorded), the events still
+        within `event_removal_threshold` in arrival order, and the ids of
+        those events that some client acked.
+        """
+        is_armed: Optional[bool] = None
+        events: Dict[str, dict] = {}
+        acked_event_ids: Set[str] = set()
+
+        for record in self._read_journal():
+            record_type = record.get('t')
+            if record_type == 'snapshot':
+                is_armed = record.get('armed', None)
+                events = {event_obj['id']: event_obj for event_obj in record.get('events', [])}
+                acked_event_ids = set(record.get('acked', []))
+            elif record_type == 'event':
+                events[record['event']['id']] = record['event']
+            elif record_type == 'armed':
+                is_armed = record['armed']
+            elif record_type == 'ack':
+                acked_event_ids.add(record['id'])
+
+        recovered_events = []
+        for event_obj in events.values():
+            try:
+                event = Event.from_dict(event_obj)
+            except (KeyError, ValueError) as e:
+                log.warning(f'Skipping unreadable journal event: {e}')
+                continue
+            if time.monotonic() - event.received <= event_removal_threshold:
+                recovered_events.append(event)
+        recovered_events.sort(key=lambda event: event.timestamp)
+
+        acked_event_ids &= {event.id for event in recovered_events}
+        return is_armed, recovered_events, acked_event_ids
+
+    def _read_journal(self):
+        try:
+            with open(self._path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter(mm.readline, b''):
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            # Torn write from a crash, nothing after it is trustworthy
+                            log.warning('Journal ends with a partial record, ignoring it.')
+                            break
+        except FileNotFoundError:
+            return
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
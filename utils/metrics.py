@@ -0,0 +1,255 @@
+import math
+import time
+import contextlib
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            *self._samples()
+        ]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """For totals kept by their component and copied in by a collector."""
+        self._values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(self._sums[key])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self,
+                  name: str,
+                  documentation: str,
+                  labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Registers a callback that refreshes gauges right before rendering."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Registry()
+
+STAGE_LATENCY = METRICS.histogram(
+    'ice_stage_latency_seconds',
+    'Latency of each event pipeline stage (onvif_parse, onvif_pull_to_broadcast, broadcast, emit, ack).',
+    labels=('stage',)
+)
+EMITS = METRICS.counter(
+    'ice_emits_total',
+    'socket.io messages emitted, by message name.',
+    labels=('message',)
+)
+EMIT_RECIPIENTS = METRICS.counter(
+    'ice_emit_recipients_total',
+    'Recipients reached by socket.io emits (fan-out), by message name.',
+    labels=('message',)
+)
+CLIENTS_CONNECTED = METRICS.gauge(
+    'ice_clients_connected',
+    'Connected clients, by client type.',
+    labels=('type',)
+)
+SOCKET_CONNECTIONS = METRICS.gauge(
+    'ice_socket_connections',
+    'socket.io connections to this worker, by wire format.',
+    labels=('serializer',)
+)
+CLIENT_OUTBOUND_QUEUE = METRICS.gauge(
+    'ice_client_outbound_queue',
+    'Packets waiting to be written to each backed up client (half the slow limit or more, the longest queues only).',
+    labels=('sid',)
+)
+CLIENT_OUTBOUND_QUEUE_MAX = METRICS.gauge(
+    'ice_client_outbound_queue_max',
+    'Packets waiting to be written to the most backed up client of this worker.'
+)
+CLIENT_OUTBOUND_QUEUED = METRICS.gauge(
+    'ice_client_outbound_queued',
+    'Packets waiting to be written, summed over the clients of this worker.'
+)
+OUTBOUND_ACTIONS = METRICS.counter(
+    'ice_outbound_actions_total',
+    'Slow consumer handling since start, by action (skipped, resynced, disconnected).',
+    labels=('action',)
+)
+EVENTS_BUFFERED = METRICS.gauge(
+    'ice_events_buffered',
+    'Events currently held in the event store.'
+)
+EVENTS_PENDING = METRICS.gauge(
+    'ice_events_pending',
+    'Buffered events not yet acked, summed over all clients.'
+)
+WEBHOOK_DELIVERIES = METRICS.counter(
+    'ice_webhook_deliveries_total',
+    'Webhook deliveries since start, by outcome.',
+    labels=('outcome',)
+)
+WEBHOOK_QUEUE_DEPTH = METRICS.gauge(
+    'ice_webhook_queue_depth',
+    'Webhook calls waiting in the dispatcher queue.'
+)
+ONVIF_CAMERA_UP = METRICS.gauge(
+    'ice_onvif_camera_up',
+    'Whether the PullPoint subscription of each ONVIF camera is live.',
+    labels=('camera',)
+)
+ONVIF_CAMERA_FAILURES = METRICS.gauge(
+    'ice_onvif_camera_failures',
+    'Consecutive failed connection attempts of each ONVIF camera.',
+    labels=('camera',)
+)
+ONVIF_EVENTS = METRICS.counter(
+    'ice_onvif_events_total',
+    'Active-state ONVIF reports since start, by camera and outcome (emitted, repeated, coalesced, cleared).',
+    labels=('camera', 'outcome')
+)
+CONFIG_RELOADS = METRICS.counter(
+    'ice_config_reloads_total',
+    'Changed config files since start, by outcome (applied, rejected).',
+    labels=('outcome',)
+)
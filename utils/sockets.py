@@ -0,0 +1,288 @@
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import parse_qs
+
+import heapq
+import asyncio
+import logging
+import socketio
+
+from utils.metrics import CLIENT_OUTBOUND_QUEUE, CLIENT_OUTBOUND_QUEUE_MAX, CLIENT_OUTBOUND_QUEUED, OUTBOUND_ACTIONS, SOCKET_CONNECTIONS
+
+log = logging.getLogger(__name__)
+
+SERIALIZER_QUERY_PARAM = 'serializer'
+# Most clients exported with their own queue depth series
+QUEUE_SERIES_LIMIT = 20
+
+class OutboundQueue(asyncio.Queue):
+    """
+    engine.io's outbound queue of one socket, reporting its depth to
+    `SocketServers` whenever a packet is added or taken.
+    """
+    def __init__(self, servers: 'SocketServers') -> None:
+        super().__init__()
+        self._servers = servers
+        # socket.io sid, set once the client joined the namespace
+        self.sid: Optional[str] = None
+
+    def put_nowait(self, item) -> None:
+        super().put_nowait(item)
+        if self.sid is not None:
+            self._servers._queue_grew(self.sid, self.qsize())
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        if self.sid is not None:
+            self._servers._queue_shrank(self.sid, self.qsize())
+        return item
+
+
+class SocketServers:
+    """
+    This worker's socket.io servers, one per wire format, used like one AsyncServer.
+
+    A client picks its format with the `serializer` query parameter of the
+    connection URL (`?serializer=msgpack`), without one it gets the first
+    (JSON) server. Asking for a format this worker can't speak is refused
+    rather than answered in another format the client couldn't decode.
+    Handlers are registered on every server, broadcasts are emitted by each
+    server that has connections, and emits to, room changes and disconnects
+    of a sid go to the server that owns it. Sids are random, so they don't
+    clash across servers (or with room names).
+
+    Every client has its own outbound queue (engine.io's, drained by the
+    socket's writer), an `OutboundQueue` that reports its depth as packets
+    are added and taken, so no client is looked at unless its queue moved.
+    Once one holds `max_queue` packets the client is slow, and emits marked
+    droppable skip it: state deltas, snapshots and ignored events, plus
+    alarms under the 'drop' policy. They are all superseded by the single
+    snapshot sent once its queue drained to half the limit, which also
+    replays the alarms it didn't ack. Pings are never dropped, a client that
+    can't answer them is evicted by the client cleaner. At
+    `disconnect_queue` packets the 'disconnect' policy drops the connection,
+    the client reconnects and replays from its last event. A `max_queue` of
+    0 turns this off.
+    """
+    def __init__(self,
+                 servers: Dict[str, socketio.AsyncServer],
+                 max_queue: int = 0,
+                 disconnect_queue: int = 0,
+                 policy: str = 'disconnect') -> None:
+        self._servers = servers
+        self._default = next(iter(servers.values()))
+        self._owners: Dict[str, socketio.AsyncServer] = {}
+        self._connections: Dict[socketio.AsyncServer, int] = {server: 0 for server in servers.values()}
+        self._max_queue = max_queue
+        self._disconnect_queue = disconnect_queue
+        self._policy = policy
+        self._slow: Set[str] = set()
+        # Slow clients that missed something and need a snapshot once they recover
+        self._resync: Set[str] = set()
+        # Left for `check_outbound`: clients to disconnect (with their queue
+        # depth) and recovered clients that need a snapshot
+        self._evict: Dict[str, int] = {}
+        self._recovered: Set[str] = set()
+        self._outbound_changed = asyncio.Event()
+        for server in servers.values():
+            # engine.io creates each socket's queue through this hook
+            server.eio.create_queue = lambda *args, **kwargs: OutboundQueue(self)
+        self.outbound_metrics = {
+            'skipped': 0,
+            'resynced': 0,
+            'disconnected': 0
+        }
+
+    def set_outbound_limits(self, max_queue: int, disconnect_queue: int, policy: str) -> None:
+        self._max_queue = max_queue
+        self._disconnect_queue = disconnect_queue
+        self._policy = policy
+        # Queues only report when they move, measure them once against the new limits
+        if max_queue <= 0:
+            self._recovered.update(self._slow & self._resync)
+            self._slow.clear()
+            self._resync.clear()
+            self._evict.clear()
+        else:
+            for sid, depth in self.queue_depths().items():
+                self._queue_shrank(sid, depth)
+                self._queue_grew(sid, depth)
+        self._outbound_changed.set()
+
+    @property
+    def drops_alarms(self) -> bool:
+        return self._policy == 'drop'
+
+    def collect_metrics(self) -> None:
+        for name, server in self._servers.items():
+            SOCKET_CONNECTIONS.set(self._connections[server], serializer=name)
+        depths = self.queue_depths()
+        CLIENT_OUTBOUND_QUEUE_MAX.set(max(depths.values(), default=0))
+        CLIENT_OUTBOUND_QUEUED.set(sum(depths.values()))
+        # Rebuilt on every scrape, series of clients that went away or caught up disappear
+        CLIENT_OUTBOUND_QUEUE.clear()
+        threshold = max(self._max_queue // 2, 1)
+        backed_up = ((depth, sid) for sid, depth in depths.items() if depth >= threshold)
+        for depth, sid in heapq.nlargest(QUEUE_SERIES_LIMIT, backed_up):
+            CLIENT_OUTBOUND_QUEUE.set(depth, sid=sid)
+        for action, count in self.outbound_metrics.items():
+            OUTBOUND_ACTIONS.set(count, action=action)
+
+    def on(self, event: str) -> Callable:
+        def decorator(handler: Callable) -> Callable:
+            for server in self._servers.values():
+                server.on(event, self._wrap(event, server, handler))
+            return handler
+        return decorator
+
+    def _wrap(self, event: str, server: socketio.AsyncServer, handler: Callable) -> Callable:
+        if event == 'connect':
+            async def handle_connect(sid, *args):
+                if sid not in self._owners:
+                    self._owners[sid] = server
+                    self._connections[server] += 1
+                    eio_socket = server.eio.sockets.get(server.manager.eio_sid_from_sid(sid, '/'))
+                    if eio_socket is not None and isinstance(eio_socket.queue, OutboundQueue):
+                        eio_socket.queue.sid = sid
+                accepted = await handler(sid, *args)
+                if accepted is False:
+                    # Refused connections never see a disconnect
+                    self._owners.pop(sid, None)
+                    self._connections[server] -= 1
+                return accepted
+            return handle_connect
+        if event == 'disconnect':
+            async def handle_disconnect(sid, *args):
+                try:
+                    return await handler(sid, *args)
+                finally:
+                    if self._owners.pop(sid, None) is not None:
+                        self._connections[server] -= 1
+                    self._slow.discard(sid)
+                    self._resync.discard(sid)
+                    self._evict.pop(sid, None)
+                    self._recovered.discard(sid)
+            return handle_disconnect
+        return handler
+
+    async def emit(self, event: str, data=None, to: str | List[str] | None = None, droppable: bool = False) -> None:
+        """Emits to everyone, to one sid or to the clients in a room or list of rooms."""
+        skip_sid = None
+        if droppable and self._slow:
+            skip_sid = self._slow_recipients(to) or None
+            if skip_sid is not None:
+                self._skip(skip_sid)
+                if isinstance(to, str) and to in self._owners:
+                    return
+
+        if isinstance(to, str) and to in self._owners:
+            await self._owners[to].emit(event, data, to=to)
+            return
+        for server, count in self._connections.items():
+            # Each server encodes the packet once, skip those without clients
+            if count > 0:
+                await server.emit(event, data, to=to, skip_sid=skip_sid)
+
+    def _slow_recipients(self, to: str | List[str] | None) -> List[str]:
+        """The slow clients an emit to `to` would reach."""
+        if to is None:
+            return list(self._slow)
+        rooms = {to} if isinstance(to, str) else set(to)
+        # Slow clients are few, look up their rooms rather than the rooms' members
+        return [sid for sid in self._slow if not rooms.isdisjoint(self.rooms(sid))]
+
+    def _skip(self, sids: List[str]) -> None:
+        self.outbound_metrics['skipped'] += len(sids)
+        self._resync.update(sids)
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Packets waiting in the outbound queue of each local client."""
+        depths = {}
+        for server in self._servers.values():
+            for eio_sid, eio_socket in list(server.eio.sockets.items()):
+                sid = server.manager.sid_from_eio_sid(eio_sid, '/')
+                if sid is not None:
+                    depths[sid] = eio_socket.queue.qsize()
+        return depths
+
+    def _queue_grew(self, sid: str, depth: int) -> None:
+        if self._max_queue <= 0 or depth < self._max_queue:
+            return
+        if self._policy == 'disconnect' and 0 < self._disconnect_queue <= depth:
+            if sid not in self._evict:
+                self._evict[sid] = depth
+                self._outbound_changed.set()
+        elif sid not in self._slow:
+            log.info(f'Client \'{sid}\' has {depth} packets queued, skipping droppable messages.')
+            self._slow.add(sid)
+
+    def _queue_shrank(self, sid: str, depth: int) -> None:
+        if sid not in self._slow or depth > self._max_queue // 2:
+            return
+        self._slow.discard(sid)
+        if sid in self._resync:
+            self._resync.discard(sid)
+            self._recovered.add(sid)
+            self._outbound_changed.set()
+
+    async def wait_outbound(self) -> None:
+        """Waits until a client has to be disconnected or was recovered."""
+        await self._outbound_changed.wait()
+        self._outbound_changed.clear()
+
+    async def check_outbound(self) -> List[str]:
+        """Applies the slow consumer policy, returns the recovered clients to send a snapshot."""
+        evict, self._evict = self._evict, {}
+        for sid, depth in evict.items():
+            log.warning(f'Client \'{sid}\' has {depth} packets queued, disconnecting.')
+            self.outbound_metrics['disconnected'] += 1
+            self._slow.discard(sid)
+            self._resync.discard(sid)
+            await self.disconnect(sid)
+
+        recovered, self._recovered = list(self._recovered), set()
+        self.outbound_metrics['resynced'] += len(recovered)
+        return recovered
+
+    async def enter_room(self, sid: str, room: str) -> None:
+        await self._owners.get(sid, self._default).enter_room(sid, room)
+
+    async def leave_room(self, sid: str, room: str) -> None:
+        await self._owners.get(sid, self._default).leave_room(sid, room)
+
+    def rooms(self, sid: str) -> List[str]:
+        return self._owners.get(sid, self._default).rooms(sid)
+
+    async def disconnect(self, sid: str) -> None:
+        await self._owners.get(sid, self._default).disconnect(sid)
+
+    def asgi_app(self) -> Callable:
+        apps = {name: socketio.ASGIApp(server) for name, server in self._servers.items()}
+        default_app = next(iter(apps.values()))
+
+        async def dispatch(scope, receive, send):
+            app = default_app
+            if scope['type'] in ('http', 'websocket'):
+                query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+                serializer = query.get(SERIALIZER_QUERY_PARAM, [None])[0]
+                if serializer is not None:
+                    app = apps.get(serializer)
+                    if app is None:
+                        await self._refuse_serializer(scope, receive, send, serializer)
+                        return
+            await app(scope, receive, send)
+        return dispatch
+
+    async def _refuse_serializer(self, scope, receive, send, serializer: str) -> None:
+        message = f'Unsupported serializer \'{serializer}\', available: {", ".join(self._servers)}.'
+        log.warning(f'Refused a socket.io connection: {message}')
+        if scope['type'] == 'websocket':
+            await receive()
+            # Policy violation, before the handshake it becomes a 403
+            await send({'type': 'websocket.close', 'code': 1008, 'reason': message})
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 400,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')]
+        })
+        await send({'type': 'http.response.body', 'body': message.encode('utf-8')})
@@ -0,0 +1,107 @@
+import sys
+import time
+from importlib.machinery import ExtensionFileLoader, SourceFileLoader, SourcelessFileLoader
+from typing import Dict, List, Tuple
+
+# Rows of each table in the report
+REPORT_ROWS = 20
+
+# Loaders created per module, unlike the built-in and frozen importers
+TIMED_LOADERS = (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)
+
+class StartupProfile:
+    """
+    Where the time goes between launching the server and its first
+    accepted socket, for `app.py --profile-startup`.
+
+    `install` times the execution of every module imported after it, and
+    `mark` ends a step of the startup sequence. Module times are split
+    into the module's own execution (its initialization code) and the
+    modules it imported.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self.installed = False
+        # Module name -> (own time, time including the modules it imported)
+        self.modules: Dict[str, Tuple[float, float]] = {}
+        self.phases: List[Tuple[str, float]] = []
+        # Time spent in nested imports, one entry per module being executed
+        self._nested: List[float] = []
+
+    def install(self) -> None:
+        if not self.installed:
+            sys.meta_path.insert(0, _TimingFinder(self))
+            self.installed = True
+
+    def uninstall(self) -> None:
+        sys.meta_path[:] = [finder for finder in sys.meta_path if not isinstance(finder, _TimingFinder)]
+        self.installed = False
+
+    def _timed_exec(self, name: str, exec_module):
+        def exec_module_timed(module) -> None:
+            self._nested.append(0.)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter() - start
+                nested = self._nested.pop()
+                self.modules[name] = (total - nested, total)
+                if self._nested:
+                    self._nested[-1] += total
+        return exec_module_timed
+
+    def mark(self, name: str) -> None:
+        """Records the time since the previous mark as the phase `name`."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_mark))
+        self._last_mark = now
+
+    def report(self) -> str:
+        total_elapsed = time.perf_counter() - self.started
+        lines = [f'{total_elapsed * 1000:.1f} ms from the first import to the first accepted socket.', '']
+
+        lines.append('phase                                           ms')
+        for name, elapsed in self.phases:
+            lines.append(f'  {name:<40} {elapsed * 1000:>7.1f}')
+
+        packages: Dict[str, float] = {}
+        for name, (own, _) in self.modules.items():
+            package = name.split('.', 1)[0]
+            packages[package] = packages.get(package, 0) + own
+        lines.append('')
+        lines.append('imports by top-level package                    ms')
+        for package, elapsed in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:REPORT_ROWS]:
+            lines.append(f'  {package:<40} {elapsed * 1000:>7.1f}')
+
+        lines.append('')
+        lines.append('modules by own execution time              own ms  total ms')
+        for name, (own, total) in sorted(self.modules.items(), key=lambda item: item[1][0], reverse=True)[:REPORT_ROWS]:
+            lines.append(f'  {name:<40} {own * 1000:>7.1f}  {total * 1000:>8.1f}')
+        return '\n'.join(lines)
+
+
+class _TimingFinder:
+    """Finds modules with the other finders and wraps their loader's `exec_module`."""
+    def __init__(self, profile: StartupProfile) -> None:
+        self._profile = profile
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            if isinstance(loader, TIMED_LOADERS):
+                loader.exec_module = self._profile._timed_exec(fullname, loader.exec_module)
+            return spec
+        return None
+
+    def invalidate_caches(self) -> None:
+        pass
+
+
+STARTUP_PROFILE = StartupProfile()
@@ -0,0 +1,243 @@
+"""
+Static files of the web UI, fingerprinted and precompressed.
+
+At startup every file under the `static` URL prefix gets a content-hashed
+name (`/static/js/session.<hash>.js`) and the references to it in HTML,
+CSS and JS are rewritten to that name, so those URLs can be cached
+forever. Pages keep their URLs and are revalidated through their ETag,
+and the unhashed asset URLs keep working for clients holding old pages.
+
+`compress` then builds gzip and, when brotli is installed, brotli variants
+of the files they shrink, served to clients that accept them.
+"""
+import os
+import re
+import gzip
+import asyncio
+import hashlib
+import logging
+import mimetypes
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+ASSET_URL_PREFIX = '/static/'
+INDEX_FILE = 'index.html'
+# Files whose references to other assets are rewritten, HTML pages last
+REWRITTEN_SUFFIXES = ('.css', '.js', '.html')
+# Asset references in rewritten files, with the old `?v=` cache buster
+ASSET_URL_PATTERN = re.compile(r'/static/[\w./-]+(?:\?v=[\w.-]*)?')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+FINGERPRINT_LENGTH = 16
+
+# A variant is kept only if it saves at least this share of the bytes
+MIN_COMPRESSION_SAVING = .1
+GZIP_LEVEL = 9
+# Quality 11 takes about a second on the alarm sound for a few percent
+BROTLI_QUALITY = 9
+# Preferred first
+ENCODINGS = ('br', 'gzip')
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+PLAIN_TEXT = (b'content-type', b'text/plain; charset=utf-8')
+
+
+class Asset:
+    __slots__ = ('content', 'media_type', 'digest', 'variants')
+
+    def __init__(self, content: bytes, media_type: str) -> None:
+        self.content = content
+        self.media_type = media_type
+        self.digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+        # Content-Encoding -> compressed content, filled in by `compress`
+        self.variants: Dict[str, bytes] = {}
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding is not None else f'"{self.digest}"'
+
+
+def media_type_of(path: str) -> str:
+    media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if media_type.startswith('text/') or media_type == 'application/javascript':
+        media_type += '; charset=utf-8'
+    return media_type
+
+def fingerprinted_url(url: str, digest: str) -> str:
+    stem, suffix = os.path.splitext(url)
+    return f'{stem}.{digest}{suffix}'
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    encodings = set()
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+def compress_content(content: bytes) -> Dict[str, bytes]:
+    variants = {}
+    limit = len(content) * (1 - MIN_COMPRESSION_SAVING)
+    compressed = gzip.compress(content, GZIP_LEVEL, mtime=0)
+    if len(compressed) > limit:
+        # Already compressed, brotli won't do much better either
+        return variants
+    variants['gzip'] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=BROTLI_QUALITY)
+        if len(compressed) < len(variants['gzip']):
+            variants['br'] = compressed
+    return variants
+
+
+class StaticAssets:
+    """ASGI app serving `directory` at `/`, with `index.html` for directories."""
+    def __init__(self, directory: str) -> None:
+        # URL -> asset and whether the URL is fingerprinted
+        self._routes: Dict[str, Tuple[Asset, bool]] = {}
+        self._assets: List[Asset] = []
+        self._build(directory)
+
+    def _build(self, directory: str) -> None:
+        paths = []
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                paths.append((path, '/' + os.path.relpath(path, directory).replace(os.sep, '/')))
+
+        def build_order(entry: Tuple[str, str]) -> int:
+            suffix = os.path.splitext(entry[0])[1]
+            return REWRITTEN_SUFFIXES.index(suffix) + 1 if suffix in REWRITTEN_SUFFIXES else 0
+
+        fingerprinted: Dict[str, str] = {}
+
+        def rewrite(match: re.Match) -> str:
+            url = match.group(0).split('?', 1)[0]
+            return fingerprinted.get(url, match.group(0))
+
+        for path, url in sorted(paths, key=build_order):
+            with open(path, 'rb') as f:
+                content = f.read()
+            if path.endswith(REWRITTEN_SUFFIXES):
+                content = ASSET_URL_PATTERN.sub(rewrite, content.decode('utf-8')).encode('utf-8')
+            asset = Asset(content, media_type_of(path))
+            self._assets.append(asset)
+            self._routes[url] = (asset, False)
+            if url.startswith(ASSET_URL_PREFIX):
+                fingerprinted[url] = fingerprinted_url(url, asset.digest)
+                self._routes[fingerprinted[url]] = (asset, True)
+        log.info(f'Fingerprinted {len(fingerprinted)} static assets.')
+
+    async def compress(self) -> None:
+        """Builds the compressed variants in a thread, assets are served uncompressed until theirs are ready."""
+        for asset in self._assets:
+            asset.variants = await asyncio.to_thread(compress_content, asset.content)
+        saved = sum(len(asset.content) - min(map(len, asset.variants.values()), default=len(asset.content))
+                    for asset in self._assets)
+        log.info(f'Precompressed static assets, {saved} bytes saved per full download '
+                 f'({"gzip and brotli" if brotli is not None else "gzip"}).')
+
+    def _resolve(self, path: str) -> Tuple[Optional[Tuple[Asset, bool]], Optional[str]]:
+        """Route for `path`, or the URL to redirect a directory to."""
+        route = self._routes.get(path)
+        if route is not None:
+            return route, None
+        directory = path if path.endswith('/') else path + '/'
+        if directory + INDEX_FILE in self._routes:
+            if directory != path:
+                return None, directory
+            return self._routes[directory + INDEX_FILE], None
+        return None, None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            if scope['type'] == 'websocket':
+                await send({'type': 'websocket.close'})
+            return
+
+        if scope['method'] not in ('GET', 'HEAD'):
+            await self._respond(send, 405, [(b'allow', b'GET, HEAD'), PLAIN_TEXT], b'Method Not Allowed')
+            return
+
+        route, redirect = self._resolve(scope['path'])
+        if redirect is not None:
+            location = scope.get('root_path', '') + redirect
+            if scope.get('query_string'):
+                location += '?' + scope['query_string'].decode('latin-1')
+            await self._respond(send, 307, [(b'location', location.encode('latin-1'))], b'')
+            return
+        if route is None:
+            await self._respond(send, 404, [PLAIN_TEXT], b'Not Found')
+            return
+
+        asset, is_fingerprinted = route
+        request_headers = {}
+        for name, value in scope['headers']:
+            request_headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+
+        encoding = None
+        is_range = 'range' in request_headers
+        if asset.variants and not is_range:
+            accepted = accepted_encodings(request_headers.get('accept-encoding', ''))
+            encoding = next((name for name in ENCODINGS if name in asset.variants and name in accepted), None)
+        content = asset.variants[encoding] if encoding is not None else asset.content
+
+        etag = asset.etag(encoding)
+        headers = [
+            (b'etag', etag.encode('latin-1')),
+            (b'cache-control', (IMMUTABLE_CACHE_CONTROL if is_fingerprinted else REVALIDATE_CACHE_CONTROL).encode('latin-1'))
+        ]
+        if asset.variants:
+            headers.append((b'vary', b'accept-encoding'))
+
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if etag in tags or '*' in tags:
+                await self._respond(send, 304, headers, b'')
+                return
+
+        headers.append((b'content-type', asset.media_type.encode('latin-1')))
+        if encoding is not None:
+            headers.append((b'content-encoding', encoding.encode('latin-1')))
+        else:
+            headers.append((b'accept-ranges', b'bytes'))
+
+        status = 200
+        match = RANGE_PATTERN.match(request_headers['range'].strip()) if is_range else None
+        if match is not None:
+            # A single byte range, anything else gets the whole file
+            size = len(content)
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(size - int(match.group(2) or 0), 0), size - 1
+            if start > end:
+                await self._respond(send, 416, [(b'content-range', f'bytes */{size}'.encode('latin-1'))], b'')
+                return
+            status = 206
+            headers.append((b'content-range', f'bytes {start}-{end}/{size}'.encode('latin-1')))
+            content = content[start:end + 1]
+
+        await self._respond(send, status, headers, content if scope['method'] == 'GET' else b'', len(content))
+
+    @staticmethod
+    async def _respond(send, status: int, headers: list, body: bytes, content_length: Optional[int] = None) -> None:
+        if status != 304:
+            headers = [*headers, (b'content-length', str(len(body) if content_length is None else content_length).encode('latin-1'))]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
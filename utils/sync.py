@@ -0,0 +1,68 @@
+from typing import TYPE_CHECKING
+
+import logging
+
+from utils.states import state
+from utils.metrics import EMITS, EMIT_RECIPIENTS
+
+if TYPE_CHECKING:
+    from utils.sockets import SocketServers
+    from objects.client import Client
+    from objects.clients import Clients
+
+log = logging.getLogger(__name__)
+
+class StateSync:
+    """
+    Pushes shared state to clients.
+
+    Full snapshots (`get_result`) are only ever sent to the sid that asked
+    for one. Everything else goes out as a small `delta` whenever it actually
+    changes, each stamped with a revision number so clients can detect a gap
+    and ask for a fresh snapshot.
+
+    Revisions are per worker, as each worker only pushes to its own sockets.
+    """
+    def __init__(self,
+                 socketio_instance: 'SocketServers',
+                 clients_instance: 'Clients'):
+        self._sio = socketio_instance
+        self._clients = clients_instance
+        self._revision = 0
+
+    async def heartbeat(self) -> None:
+        # Payload-free liveness probe, clients answer with `pong`.
+        await self._sio.emit('ping')
+        EMITS.inc(message='ping')
+        EMIT_RECIPIENTS.inc(self._clients.local_count(), message='ping')
+
+    async def send_snapshot(self, sid: str) -> None:
+        payload = {
+            'isArmed': state.is_armed(),
+            'clientList': await self._clients.get_encoded_client_list(),
+            # Each buffered event is encoded once, snapshots splice the cached JSON
+            'eventList': [event.to_json() for event in await self._clients.get_event_list(sid, False)]
+        }
+        payload['rev'] = self._revision
+        # A slow client gets a single snapshot once it caught up instead
+        await self._sio.emit('get_result', payload, to=sid, droppable=True)
+        EMITS.inc(message='get_result')
+        EMIT_RECIPIENTS.inc(message='get_result')
+
+    async def push_armed(self) -> None:
+        await self._push({'isArmed': state.is_armed()})
+
+    async def push_client_updated(self, client: 'Client') -> None:
+        await self._push({'clientUpdated': client.to_dict(json_friendly=True)})
+
+    async def push_client_removed(self, sid: str) -> None:
+        await self._push({'clientRemoved': sid})
+
+    async def _push(self, delta: dict) -> None:
+        self._revision += 1
+        delta['rev'] = self._revision
+        log.debug(f'Pushing state delta: {delta}')
+        # Clients that miss deltas see a revision gap, or get a snapshot once they catch up
+        await self._sio.emit('delta', delta, droppable=True)
+        EMITS.inc(message='delta')
+        EMIT_RECIPIENTS.inc(self._clients.local_count(), message='delta')
@@ -1,25 +1,89 @@
-def recursive_replace(value: dict, replacements: dict) -> dict:
+import re
+from typing import Any, Iterable, List, Tuple
+
+class CompiledTemplate:
     """
-    Recursively replaces templates in a value.
+    Render plan for a template, built once by `compile_template`.
+
+    Subtrees without placeholders are shared as-is between renders, so a
+    render only rebuilds the containers on the path to a placeholder and
+    only substitutes the dynamic leaves.
     """
-    # If the value is a dictionary, recurse through its items.
+    def __init__(self, template: Any, is_dynamic: bool, node: Any) -> None:
+        self.template = template
+        self.is_dynamic = is_dynamic
+        self._node = node
+
+    def render(self, replacements: dict) -> Any:
+        if not self.is_dynamic:
+            return self._node
+        return self._node(replacements)
+
+
+def _compile_string(value: str, placeholders: frozenset, pattern: re.Pattern) -> Tuple[bool, Any]:
+    # Exact match replacement, the placeholder may stand for a non-string value
+    if value in placeholders:
+        return True, lambda replacements: replacements.get(value, value)
+
+    # re.split with a capture group alternates literal text and placeholders
+    segments = pattern.split(value)
+    if len(segments) == 1:
+        return False, value
+
+    literals = segments[0::2]
+    names = segments[1::2]
+
+    if len(names) == 1:
+        name, prefix, suffix = names[0], literals[0], literals[1]
+
+        def render_single(replacements: dict) -> str:
+            new_value = replacements.get(name, name)
+            return prefix + (new_value if isinstance(new_value, str) else name) + suffix
+
+        return True, render_single
+
+    def render(replacements: dict) -> str:
+        parts: List[str] = [literals[0]]
+        for name, literal in zip(names, literals[1:]):
+            new_value = replacements.get(name, name)
+            parts.append(new_value if isinstance(new_value, str) else name)
+            parts.append(literal)
+        return ''.join(parts)
+
+    return True, render
+
+
+def _compile(value: Any, placeholders: frozenset, pattern: re.Pattern) -> Tuple[bool, Any]:
     if isinstance(value, dict):
-        return {k: recursive_replace(v, replacements) for k, v in value.items()}
+        items = [(k, *_compile(v, placeholders, pattern)) for k, v in value.items()]
+        if not any(is_dynamic for _, is_dynamic, _ in items):
+            return False, value
+        return True, lambda replacements: {
+            k: node(replacements) if is_dynamic else node for k, is_dynamic, node in items
+        }
 
-    # If the value is a list, recurse through its items.
     elif isinstance(value, list):
-        return [recursive_replace(item, replacements) for item in value]
+        items = [_compile(item, placeholders, pattern) for item in value]
+        if not any(is_dynamic for is_dynamic, _ in items):
+            return False, value
+        return True, lambda replacements: [
+            node(replacements) if is_dynamic else node for is_dynamic, node in items
+        ]
 
-    # If the value is a string, check for replacements.
     elif isinstance(value, str):
-        # Exact match replacement (e.g., "$dict_value" -> {"new": "dict"})
-        if value in replacements:
-            return replacements[value]
+        return _compile_string(value, placeholders, pattern)
+
+    return False, value
 
-        # Substring replacement (e.g., "prefix_$string_value" -> "prefix_10:00")
-        for old_template, new_value in replacements.items():
-            if isinstance(new_value, str) and old_template in value:
-                return value.replace(old_template, new_value)
 
-    # Return the value as is if no replacement is needed.
-    return value
+def compile_template(template: Any, placeholders: Iterable[str]) -> CompiledTemplate:
+    """
+    Compiles a template tree once. Every placeholder in a string is
+    substituted in a single pass on render.
+    """
+    placeholders = frozenset(placeholders)
+    # Longest first so a placeholder never shadows a longer one sharing its prefix
+    alternation = '|'.join(re.escape(p) for p in sorted(placeholders, key=len, reverse=True))
+    pattern = re.compile(f'({alternation})') if alternation else re.compile(r'(?!x)x')
+    is_dynamic, node = _compile(template, placeholders, pattern)
+    return CompiledTemplate(template, is_dynamic, node)
@@ -0,0 +1,76 @@
+import math
+import time
+from typing import Dict, Hashable, List, Optional
+
+DEFAULT_WHEEL_SLOTS = 512
+
+class TimerWheel:
+    """
+    Hashed timing wheel keyed by an arbitrary hashable (e.g. a client sid).
+
+    `schedule` and `cancel` are O(1). `expire` only visits the slots for the
+    ticks that elapsed since the last call, so its cost depends on how many
+    keys actually expire rather than how many are scheduled.
+    """
+    def __init__(self, tick: float, slots: int = DEFAULT_WHEEL_SLOTS) -> None:
+        if tick <= 0:
+            raise ValueError('Timer wheel tick must be positive.')
+        self._tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._current_tick = self._to_tick(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(timestamp / self._tick)
+
+    def schedule(self, key: Hashable, timeout: float, now: Optional[float] = None) -> None:
+        """(Re)schedules `key` to expire `timeout` seconds from now."""
+        if now is None:
+            now = time.monotonic()
+        due_tick = max(math.ceil((now + timeout) / self._tick), self._current_tick + 1)
+
+        self.cancel(key)
+        slot = due_tick % len(self._slots)
+        self._slots[slot][key] = due_tick
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def expire(self, now: Optional[float] = None) -> List[Hashable]:
+        """Removes and returns every key whose deadline has passed."""
+        if now is None:
+            now = time.monotonic()
+        now_tick = self._to_tick(now)
+        if now_tick <= self._current_tick:
+            return []
+
+        elapsed = now_tick - self._current_tick
+        if elapsed >= len(self._slots):
+            # Fell behind a full revolution, every slot is due for a check
+            ticks = range(now_tick - len(self._slots) + 1, now_tick + 1)
+        else:
+            ticks = range(self._current_tick + 1, now_tick + 1)
+
+        expired = []
+        for tick in ticks:
+            bucket = self._slots[tick % len(self._slots)]
+            if not bucket:
+                continue
+            for key, due_tick in list(bucket.items()):
+                # Keys more than one revolution ahead share the slot, keep them
+                if due_tick <= now_tick:
+                    del bucket[key]
+                    del self._where[key]
+                    expired.append(key)
+
+        self._current_tick = now_tick
+        return expired
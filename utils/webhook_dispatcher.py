@@ -0,0 +1,179 @@
+import random
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_TIMEOUT = 5
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = .5
+DEFAULT_BATCH_SIZE = 50
+
+SUPPORTED_METHODS = ('GET', 'POST')
+
+class RetryableStatus(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(f'HTTP {status}')
+        self.status = status
+
+class WebhookDispatcher:
+    """
+    Long-lived webhook sender.
+
+    Requests are put on a bounded queue and delivered by a fixed number of
+    workers sharing one connection pool, with a per-request timeout and
+    exponential-backoff retries. With `batch_window` > 0, JSON POSTs that
+    arrive within the window are coalesced into one POST of a JSON list.
+    """
+    def __init__(self,
+                 url: str,
+                 method: str = 'GET',
+                 headers: Optional[dict] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF,
+                 batch_window: float = 0,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        self._url = url
+        self._method = method.upper()
+        self._headers = headers
+        self._worker_count = max(workers, 1)
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._batch_window = batch_window if self._method == 'POST' else 0
+        self._batch_size = max(batch_size, 1)
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._workers: List[asyncio.Task] = []
+
+        self.metrics: Dict[str, int] = {
+            'queued': 0,
+            'sent': 0,
+            'failed': 0,
+            'dropped': 0,
+            'retried': 0
+        }
+
+    async def start(self) -> None:
+        if self._method not in SUPPORTED_METHODS:
+            log.error(f'Unsupported HTTP method: {self._method}')
+            return
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._worker_count),
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+            headers=self._headers
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._worker_count)]
+        log.info(f'Started {self._worker_count} webhook workers for {self._method} {self._url}.')
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def close(self, timeout: float) -> None:
+        """Delivers the queued calls for up to `timeout` seconds, then stops."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning(f'Dropping {self._queue.qsize()} queued webhook calls to {self._url}.')
+            self.metrics['dropped'] += self._queue.qsize()
+        finally:
+            await self.stop()
+
+    def submit(self, request_kwargs: dict) -> bool:
+        """Queues one webhook call, returns False if it was dropped."""
+        if self._session is None:
+            self.metrics['dropped'] += 1
+            return False
+        try:
+            self._queue.put_nowait(request_kwargs)
+        except asyncio.QueueFull:
+            log.warning('Webhook queue is full, dropping webhook call.')
+            self.metrics['dropped'] += 1
+            return False
+        self.metrics['queued'] += 1
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _collect_batch(self, first_item: dict) -> Tuple[List[dict], Optional[dict]]:
+        """Returns the batch and the item that ended it, if it can't be merged."""
+        batch = [first_item]
+        if self._batch_window <= 0 or 'json' not in first_item:
+            return batch, None
+
+        deadline = asyncio.get_running_loop().time() + self._batch_window
+        while len(batch) < self._batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if 'json' not in item:
+                # Can't merge raw bodies, the worker delivers it next on its own
+                return batch, item
+            batch.append(item)
+        return batch, None
+
+    async def _worker(self) -> None:
+        held = None
+        while True:
+            item = held if held is not None else await self._queue.get()
+            batch, held = await self._collect_batch(item)
+            try:
+                await self._deliver(batch)
+            except Exception as e:
+                log.error(f'Unexpected error while delivering webhook: {e}')
+                self.metrics['failed'] += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _deliver(self, batch: List[dict]) -> None:
+        if len(batch) == 1:
+            request_kwargs = batch[0]
+        else:
+            request_kwargs = {'json': [item['json'] for item in batch]}
+
+        for attempt in range(self._retries + 1):
+            try:
+                log.info(f'Firing {self._method} webhook to {self._url}...')
+                async with self._session.request(self._method, self._url, **request_kwargs) as response:
+                    log.debug(f'Webhook response status: {response.status}')
+                    if response.status >= 500 or response.status == 429:
+                        raise RetryableStatus(response.status)
+                    if response.status >= 400:
+                        log.error(f'Webhook call rejected with status {response.status}.')
+                        self.metrics['failed'] += len(batch)
+                        return
+                self.metrics['sent'] += len(batch)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                if attempt >= self._retries:
+                    log.error(f'Webhook call failed: {e}')
+                    break
+                delay = self._backoff * (2 ** attempt)
+                log.warning(f'Webhook call failed: {e}. Retrying in {delay:.2f}s...')
+                self.metrics['retried'] += 1
+                await asyncio.sleep(delay + random.uniform(0, self._backoff))
+
+        self.metrics['failed'] += len(batch)
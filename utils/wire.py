@@ -0,0 +1,154 @@
+"""
+Wire formats of the socket.io servers.
+
+Payload parts that are sent over and over (buffered events, the client
+list) are encoded once and wrapped in `RawJSON`. This module is handed to
+the JSON socket.io server as its JSON module: payloads without such parts
+(pings, acks, deltas) go straight to the encoder, the others have their
+containers walked and those parts copied verbatim. orjson is used for the
+encoding when it is installed.
+
+When msgpack is installed, `msgpack_packet_class` serves native clients
+that ask for it. msgpack containers are a header followed by their items,
+so the value behind each `RawJSON` is packed once and spliced the same
+way. Both formats carry the same fields.
+"""
+import json
+import struct
+from typing import Any
+
+from engineio.json import loads
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+    from socketio.msgpack_packet import MsgPackPacket
+except ImportError:
+    msgpack = None
+    MsgPackPacket = None
+else:
+    # A packer is costly to set up, reuse one
+    _packb = msgpack.Packer().pack
+
+__all__ = ['RawJSON', 'encode', 'dumps', 'loads', 'pack', 'msgpack_packet_class']
+
+
+class RawJSON:
+    """Text that is already valid JSON, along with the value it encodes."""
+    __slots__ = ('text', 'value', 'packed')
+
+    def __init__(self, text: str, value: Any) -> None:
+        self.text = text
+        self.value = value
+        # msgpack encoding of `value`, built when a msgpack client first needs it
+        self.packed: bytes | None = None
+
+    def __repr__(self) -> str:
+        return f'RawJSON({self.text!r})'
+
+
+def encode(obj: Any) -> str:
+    """Compact JSON of a payload without `RawJSON` parts."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            # e.g. non-string keys, which the standard encoder converts
+            pass
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _is_raw(value: Any) -> bool:
+    return isinstance(value, RawJSON) or (isinstance(value, list) and bool(value) and isinstance(value[0], RawJSON))
+
+
+def _holds_raw(obj: Any) -> bool:
+    """
+    Whether a packet's data has `RawJSON` parts where emits put them: as
+    arguments, values of an argument or items of such a value. Failing the
+    native encoders costs more than this look.
+    """
+    if not isinstance(obj, (list, tuple)):
+        return _is_raw(obj)
+    for item in obj:
+        if _is_raw(item) or (isinstance(item, dict) and any(_is_raw(value) for value in item.values())):
+            return True
+    return False
+
+
+def dumps(obj: Any, **kwargs) -> str:
+    """Compact JSON of `obj` with `RawJSON` parts spliced in, other arguments are ignored."""
+    if not _holds_raw(obj):
+        try:
+            if orjson is not None:
+                return orjson.dumps(obj).decode('utf-8')
+            return json.dumps(obj, separators=(',', ':'))
+        except TypeError:
+            # A `RawJSON` part further down, or a key orjson doesn't take
+            pass
+    return _splice(obj)
+
+
+def _splice(obj: Any) -> str:
+    if isinstance(obj, RawJSON):
+        return obj.text
+    if isinstance(obj, dict):
+        return '{' + ','.join(
+            f'{encode(key if isinstance(key, str) else encode(key))}:{_splice(value)}'
+            for key, value in obj.items()
+        ) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ','.join(_splice(item) for item in obj) + ']'
+    return encode(obj)
+
+
+def _container_header(size: int, fix_code: int, code16: int, code32: int) -> bytes:
+    if size < 16:
+        return bytes((fix_code | size,))
+    if size < 0x10000:
+        return struct.pack('>BH', code16, size)
+    return struct.pack('>BI', code32, size)
+
+
+def pack(obj: Any) -> bytes:
+    """msgpack of `obj` with the packed value of `RawJSON` parts spliced in."""
+    if not _holds_raw(obj):
+        try:
+            return _packb(obj)
+        except TypeError:
+            pass
+    return _splice_packed(obj)
+
+
+def _splice_packed(obj: Any) -> bytes:
+    if isinstance(obj, RawJSON):
+        if obj.packed is None:
+            obj.packed = _packb(obj.value)
+        return obj.packed
+    if isinstance(obj, dict):
+        return _container_header(len(obj), 0x80, 0xde, 0xdf) + b''.join(
+            _splice_packed(key) + _splice_packed(value) for key, value in obj.items()
+        )
+    if isinstance(obj, (list, tuple)):
+        return _container_header(len(obj), 0x90, 0xdc, 0xdd) + b''.join(_splice_packed(item) for item in obj)
+    return _packb(obj)
+
+
+def msgpack_packet_class() -> type | None:
+    """socket.io packet class for msgpack clients, None without msgpack."""
+    if MsgPackPacket is None:
+        return None
+
+    class SplicingMsgPackPacket(MsgPackPacket):
+        def encode(self):
+            packet = self._to_dict()
+            # The cached parts are in the arguments, the dict around them never is one
+            if _holds_raw(self.data):
+                return _splice_packed(packet)
+            return pack(packet)
+
+    return SplicingMsgPackPacket